@@ -5,9 +5,36 @@ from . import common
 from . import task
 from . import queue
 from . import timer
+from . import snapshot
+from . import stack
+from . import profiling
+from . import symbols
+from . import waitgraph
+from . import heap
+from . import top
+from . import eventgroup
+from . import streambuffer
+from . import cores
+from . import check
+from . import history
 
-common.FreeRtos()
-task.FreeRtosTask()
-queue.FreeRtosQueue()
-queue.FreeRtosSemaphore()
-timer.FreeRtosTimer()
+if common.gdb is not None:
+    common.FreeRtos()
+    task.FreeRtosTask()
+    queue.FreeRtosQueue()
+    queue.FreeRtosSemaphore()
+    timer.FreeRtosTimer()
+    stack.FreeRtosStack()
+    profiling.FreeRtosProfile()
+    symbols.FreeRtosSymbols()
+    waitgraph.FreeRtosWaitGraph()
+    heap.FreeRtosHeap()
+    top.FreeRtosTop()
+    eventgroup.FreeRtosEventGroup()
+    streambuffer.FreeRtosStreamBuffer()
+    cores.FreeRtosCores()
+    check.FreeRtosCheck()
+    history.FreeRtosRecord()
+    history.FreeRtosDiff()
+    snapshot.FreeRtosSnapshot()
+    snapshot.FreeRtosPrefetch()
@@ -0,0 +1,167 @@
+# SPDX-FileCopyrightText: 2022 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+#
+# Batch analysis of core dumps of one firmware:
+#
+#   python -m freertos_gdb.batch firmware.elf dumps/ --report report.jsonl --jobs 8
+#
+# Every dump is analyzed in a process pool and gets one line in the JSONL report. Summary tables are printed
+# at the end. DWARF is parsed once: the first dump is analyzed in the main process and the resolved types
+# and symbols are passed to the workers.
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+from collections import Counter
+from . import check, queue, snapshot, task, timer
+from .common import get_arg_parser, json_row, open_output, write_table
+from .memory import get_struct_layout, set_backend
+from .offline import ElfBackend
+
+_worker = {}
+
+
+def init_worker(elf_path, type_info):
+    backend = ElfBackend(elf_path, type_info=type_info)
+    _worker['backend'] = backend
+    set_backend(backend)
+
+
+def get_records(headers, rows):
+    return [json_row(headers, row) for row in rows]
+
+
+def analyze_dump(path):
+    """Return the report record of a core dump. Requires init_worker() to be called in the process"""
+    record = {'dump': path}
+    messages = io.StringIO()
+    try:
+        _worker['backend'].load_dump(path)
+        snapshot.invalidate()
+        with contextlib.redirect_stdout(messages):
+            # list walks stop at broken links, problems are recorded before the sections which walk the lists
+            record['list_problems'] = get_records(check.get_table_headers(),
+                                                  check.get_table_rows(check.check_lists(check.get_kernel_lists())))
+            state = snapshot.get_snapshot()
+            record['tasks'] = get_records(task.get_table_headers(get_struct_layout('TCB_t')),
+                                          (task.get_table_row(item.tcb, item.state, state.current_tcbs,
+                                                              state.blocked_on(item.tcb))
+                                           for item in state.iter_tasks()))
+            for name, is_semaphore in (('queues', False), ('semaphores', True)):
+                queues = queue.Queues(is_semaphore, state)
+                record[name] = get_records(queues.get_table_headers(), queues.get_table_rows(state.iter_queues()))
+            timers = timer.Timers(state)
+            record['timers'] = get_records(timers.get_table_headers(), timers.get_table_rows())
+    except Exception as err:  # pylint: disable=broad-except  # a broken dump must not stop the whole batch
+        record['error'] = f'{type(err).__name__}: {err}'
+    finally:
+        snapshot.invalidate()
+    if messages.getvalue():
+        record['messages'] = messages.getvalue().splitlines()
+    return record
+
+
+class Summary:
+    """Statistics over report records, accumulated as records arrive"""
+
+    def __init__(self):
+        self.dumps = 0
+        self.failed = 0
+        self.corrupted = 0
+        self.blocked_tasks = Counter()
+        self.blocked_dumps = Counter()
+        self.stack_headroom = {}
+
+    def add(self, record):
+        self.dumps += 1
+        if 'error' in record:
+            self.failed += 1
+        if record.get('list_problems'):
+            self.corrupted += 1
+        for _, section in enumerate(('queues', 'semaphores')):
+            for _, obj in enumerate(record.get(section, ())):
+                waiting = 0
+                for _, column in enumerate(('TASKS_WAITING_TO_SEND', 'TASKS_WAITING_TO_RECEIVE',
+                                            'TASKS_WAITING_TO_GIVE', 'TASKS_WAITING_TO_TAKE')):
+                    waiting += len(obj.get(column) or ())
+                if waiting:
+                    self.blocked_tasks[obj['NAME']] += waiting
+                    self.blocked_dumps[obj['NAME']] += 1
+        for _, tcb in enumerate(record.get('tasks', ())):
+            headroom = tcb.get('SL')
+            if headroom is None:
+                continue
+            lowest = self.stack_headroom.get(tcb['NAME'])
+            if lowest is None or headroom < lowest[0]:
+                self.stack_headroom[tcb['NAME']] = (headroom, record['dump'])
+
+    def write(self, fmt='table', output=None, top=10):
+        blocked = [[name, self.blocked_dumps[name], count] for name, count in self.blocked_tasks.most_common(top)]
+        headroom = sorted(([name, sl, dump] for name, (sl, dump) in self.stack_headroom.items()),
+                          key=lambda row: (row[1], row[0]))
+        with open_output(output) as stream:
+            if fmt == 'table':
+                print(f'Dumps: {self.dumps}, failed: {self.failed}, with corrupted kernel lists: {self.corrupted}\n',
+                      file=stream)
+                print('Queues and semaphores with blocked tasks', file=stream)
+            write_table(blocked, ['NAME', 'DUMPS', 'BLOCKED_TASKS'], fmt, stream)
+            if fmt == 'table':
+                print('\nLowest stack headroom per task name', file=stream)
+            write_table(headroom[:top], ['NAME', 'SL', 'DUMP'], fmt, stream)
+
+
+def list_dumps(directory, suffix):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.endswith(suffix) and os.path.isfile(os.path.join(directory, name)))
+
+
+def analyze(elf_path, dumps, jobs=None):
+    """Yield report records of dumps in the order of dumps"""
+    # dumps are analyzed here until one succeeds, this resolves every type and symbol the analysis needs
+    init_worker(elf_path, None)
+    analyzed = 0
+    try:
+        for _, path in enumerate(dumps):
+            record = analyze_dump(path)
+            analyzed += 1
+            yield record
+            if 'error' not in record:
+                break
+        type_info = _worker['backend'].type_info()
+    finally:
+        _worker.pop('backend').close()
+        set_backend(None)
+    rest = dumps[analyzed:]
+    if not rest:
+        return
+    jobs = jobs or os.cpu_count() or 1
+    with multiprocessing.Pool(min(jobs, len(rest)), init_worker, (elf_path, type_info)) as pool:
+        yield from pool.imap(analyze_dump, rest, chunksize=max(1, len(rest) // (jobs * 4)))
+
+
+def main(argv=None):
+    parser = get_arg_parser('python -m freertos_gdb.batch',
+                            'Analyze a directory of ELF core dumps of one firmware in parallel.')
+    parser.add_argument('elf', help='Program ELF file with debug info.')
+    parser.add_argument('dumps', help='Directory with ELF core dumps.')
+    parser.add_argument('--report', required=True, help='JSONL report file, one line per dump.')
+    parser.add_argument('--suffix', default='', help='Analyze only files ending with SUFFIX, e.g. .elf')
+    parser.add_argument('--jobs', type=int, default=None, help='Number of worker processes. Default: CPU count.')
+    parser.add_argument('--top', type=int, default=10, help='Number of rows in summary tables.')
+    args = parser.parse_args(argv)
+    dumps = list_dumps(args.dumps, args.suffix)
+    if not dumps:
+        parser.error(f'no dumps found in {args.dumps}')
+    summary = Summary()
+    with open(args.report, 'w', encoding='utf-8') as report:
+        for _, record in enumerate(analyze(args.elf, dumps, args.jobs)):
+            report.write(json.dumps(record) + '\n')
+            summary.add(record)
+    summary.write(args.format, args.output, args.top)
+    return 0 if summary.failed < summary.dumps else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
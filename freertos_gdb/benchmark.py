@@ -0,0 +1,417 @@
+# SPDX-FileCopyrightText: 2022 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+#
+# Benchmark of freertos commands against a synthetic FreeRTOS heap. Counts target memory reads and bytes and
+# can add a delay to every read to model a slow (JTAG) link. No GDB and no hardware needed:
+#
+#   python -m freertos_gdb.benchmark --tasks 200 --queues 20 --waiters 2 --timers 50 --latency-us 200
+import bisect
+import contextlib
+import os
+import sys
+import time
+from . import snapshot
+from .common import get_arg_parser, open_output, write_table
+from .memory import Address, Backend, FieldLayout, MemoryReadError, StructLayout, Symbol, SymbolNotFound, \
+    TypeCode, TypeNotFound, set_backend
+from .offline import COMMANDS, run_command
+
+POINTER_SIZE = 4
+MAX_PRIORITIES = 25
+STACK_SIZE = 512
+TASK_NAME_LEN = 16
+STACK_FILL_BYTE = 0xa5
+
+
+def _int(size=4, signed=False):
+    return FieldLayout('', 0, size, TypeCode.INT, signed)
+
+
+def _ptr():
+    return FieldLayout('', 0, POINTER_SIZE, TypeCode.PTR)
+
+
+def _array(element, count):
+    return FieldLayout('', 0, element.size * count, TypeCode.ARRAY, element=element)
+
+
+def _nested(layout):
+    return FieldLayout('', 0, layout.size, TypeCode.STRUCT, layout=layout)
+
+
+# scalar types of the synthetic target, char is unsigned like on Xtensa and ARM
+BASE_TYPES = {name: _int(size, signed) for name, size, signed in (
+    ('char', 1, False), ('uint8_t', 1, False), ('int', 4, True), ('unsigned int', 4, False), ('int32_t', 4, True),
+    ('uint32_t', 4, False), ('BaseType_t', 4, True), ('UBaseType_t', 4, False), ('TickType_t', 4, False))}
+
+
+def _alignment(field):
+    if field.code is TypeCode.ARRAY:
+        return _alignment(field.element)
+    if field.code is TypeCode.STRUCT:
+        return max((_alignment(sub) for sub in field.layout.fields.values()), default=1)
+    return max(1, min(field.size, 8))
+
+
+def _struct(name, members, union=False):
+    """Return StructLayout of members laid out with natural alignment like a 32-bit target compiler does"""
+    fields = {}
+    offset = 0
+    size = 0
+    align = 1
+    for _, (field_name, field) in enumerate(members):
+        field_align = _alignment(field)
+        align = max(align, field_align)
+        if not union:
+            offset = (offset + field_align - 1) // field_align * field_align
+        fields[field_name] = FieldLayout(field_name, offset, field.size, field.code, field.signed, field.element,
+                                         field.layout)
+        size = max(size, offset + field.size)
+        if not union:
+            offset += field.size
+    return StructLayout(name, (size + align - 1) // align * align, fields)
+
+
+def get_layouts():
+    """Layouts of kernel types of a 32-bit target with FreeRTOS configuration typical for ESP-IDF"""
+    list_item = _struct('ListItem_t', [('xItemValue', _int()), ('pxNext', _ptr()), ('pxPrevious', _ptr()),
+                                       ('pvOwner', _ptr()), ('pvContainer', _ptr())])
+    mini_list_item = _struct('MiniListItem_t', [('xItemValue', _int()), ('pxNext', _ptr()), ('pxPrevious', _ptr())])
+    list_ = _struct('List_t', [('uxNumberOfItems', _int()), ('pxIndex', _ptr()),
+                               ('xListEnd', _nested(mini_list_item))])
+    tcb = _struct('TCB_t', [('pxTopOfStack', _ptr()), ('xStateListItem', _nested(list_item)),
+                            ('xEventListItem', _nested(list_item)), ('uxPriority', _int()), ('pxStack', _ptr()),
+                            ('pcTaskName', _array(_int(1, True), TASK_NAME_LEN)), ('xCoreID', _int(signed=True)),
+                            ('pxEndOfStack', _ptr()), ('uxTCBNumber', _int()), ('uxTaskNumber', _int()),
+                            ('uxBasePriority', _int()), ('uxMutexesHeld', _int()), ('ulRunTimeCounter', _int()),
+                            ('ulNotifiedValue', _array(_int(), 1)), ('ucNotifyState', _array(_int(1), 1))])
+    queue_pointers = _struct('QueuePointers_t', [('pcTail', _ptr()), ('pcReadFrom', _ptr())])
+    semaphore_data = _struct('SemaphoreData_t', [('xMutexHolder', _ptr()), ('uxRecursiveCallCount', _int())])
+    queue_union = _struct('', [('xQueue', _nested(queue_pointers)), ('xSemaphore', _nested(semaphore_data))],
+                          union=True)
+    queue = _struct('Queue_t', [('pcHead', _ptr()), ('pcWriteTo', _ptr()), ('u', _nested(queue_union)),
+                                ('xTasksWaitingToSend', _nested(list_)), ('xTasksWaitingToReceive', _nested(list_)),
+                                ('uxMessagesWaiting', _int()), ('uxLength', _int()), ('uxItemSize', _int()),
+                                ('cRxLock', _int(1, True)), ('cTxLock', _int(1, True)), ('uxQueueNumber', _int()),
+                                ('ucQueueType', _int(1))])
+    registry_item = _struct('QueueRegistryItem_t', [('pcQueueName', _ptr()), ('xHandle', _ptr())])
+    timer = _struct('Timer_t', [('pcTimerName', _ptr()), ('xTimerListItem', _nested(list_item)),
+                                ('xTimerPeriodInTicks', _int()), ('pvTimerID', _ptr()),
+                                ('pxCallbackFunction', _ptr()), ('uxTimerNumber', _int()), ('ucStatus', _int(1))])
+    return {layout.name: layout for layout in (list_item, mini_list_item, list_, tcb, queue, registry_item, timer)}
+
+
+class SyntheticTarget:
+    """Little endian target memory image built from kernel type layouts"""
+
+    def __init__(self, layouts, base=0x3ffb0000):
+        self.layouts = layouts
+        self.base = base
+        self.memory = bytearray()
+        self.symbols = {}
+        self.functions = []
+
+    def alloc(self, size, align=POINTER_SIZE):
+        address = self.base + (len(self.memory) + align - 1) // align * align
+        self.memory.extend(bytes(address + size - self.base - len(self.memory)))
+        return address
+
+    def alloc_struct(self, type_name):
+        return self.alloc(self.layouts[type_name].size)
+
+    def add_symbol(self, name, type_name, count=0):
+        """Allocate a global variable of a struct type, or an array of them if count is given"""
+        layout = self.layouts[type_name]
+        field = FieldLayout(name, 0, layout.size, TypeCode.STRUCT, layout=layout)
+        if count:
+            field = FieldLayout(name, 0, layout.size * count, TypeCode.ARRAY, element=field)
+        address = self.alloc(field.size)
+        self.symbols[name] = Symbol(name, Address(address), field)
+        return address
+
+    def add_int_symbol(self, name, value, code=TypeCode.INT):
+        address = self.alloc(POINTER_SIZE)
+        self.symbols[name] = Symbol(name, Address(address), FieldLayout(name, 0, POINTER_SIZE, code))
+        self.write_int(address, value)
+        return address
+
+    def add_function(self, name, address):
+        self.functions.append((address, name))
+
+    def write_bytes(self, address, data):
+        offset = address - self.base
+        self.memory[offset:offset + len(data)] = data
+
+    def write_int(self, address, value, size=POINTER_SIZE):
+        self.write_bytes(address, int(value).to_bytes(size, 'little', signed=value < 0))
+
+    def write(self, type_name, address, path, value):
+        offset, field = self.layouts[type_name].field(path)
+        address += offset + field.offset
+        if isinstance(value, str):
+            self.write_bytes(address, value.encode()[:field.size - 1] + b'\0')
+        else:
+            self.write_int(address, value, field.size)
+
+    def add_string(self, text):
+        data = text.encode() + b'\0'
+        address = self.alloc(len(data), 1)
+        self.write_bytes(address, data)
+        return address
+
+    def list_init(self, address):
+        end = address + self.layouts['List_t'].field('xListEnd')[1].offset
+        self.write('List_t', address, 'pxIndex', end)
+        self.write('List_t', address, 'xListEnd.xItemValue', 0xffffffff)
+        self.write('List_t', address, 'xListEnd.pxNext', end)
+        self.write('List_t', address, 'xListEnd.pxPrevious', end)
+
+    def _read_ptr(self, address):
+        offset = address - self.base
+        return int.from_bytes(self.memory[offset:offset + POINTER_SIZE], 'little')
+
+    def list_insert_end(self, list_address, item_address, owner, value=0):
+        """Insert ListItem_t at item_address to the end of List_t at list_address"""
+        item = self.layouts['ListItem_t']
+        end = list_address + self.layouts['List_t'].field('xListEnd')[1].offset
+        last = self._read_ptr(end + item.fields['pxPrevious'].offset)
+        self.write('ListItem_t', item_address, 'xItemValue', value)
+        self.write('ListItem_t', item_address, 'pxNext', end)
+        self.write('ListItem_t', item_address, 'pxPrevious', last)
+        self.write('ListItem_t', item_address, 'pvOwner', owner)
+        self.write('ListItem_t', item_address, 'pvContainer', list_address)
+        self.write_int(last + item.fields['pxNext'].offset, item_address)
+        self.write_int(end + item.fields['pxPrevious'].offset, item_address)
+        count_offset = self.layouts['List_t'].fields['uxNumberOfItems'].offset
+        self.write_int(list_address + count_offset, self._read_ptr(list_address + count_offset) + 1)
+
+    def field_address(self, type_name, address, path):
+        offset, field = self.layouts[type_name].field(path)
+        return address + offset + field.offset
+
+
+def build_target(tasks=50, queues=10, waiters=1, timers=20):
+    """Return SyntheticTarget with a FreeRTOS kernel state of the given size.
+
+    Tasks blocked on queues are in the delayed list, the rest are spread over ready, delayed and suspended
+    lists. Every fourth registered queue is a mutex.
+    """
+    if queues * waiters > tasks:
+        raise ValueError(f'{queues} queues with {waiters} waiters need at least {queues * waiters} tasks')
+    target = SyntheticTarget(get_layouts())
+    ready = target.add_symbol('pxReadyTasksLists', 'List_t', MAX_PRIORITIES)
+    list_size = target.layouts['List_t'].size
+    for priority in range(MAX_PRIORITIES):
+        target.list_init(ready + priority * list_size)
+    task_lists = {}
+    for _, name in enumerate(('xDelayedTaskList1', 'xDelayedTaskList2', 'xPendingReadyList', 'xSuspendedTaskList',
+                              'xTasksWaitingTermination')):
+        task_lists[name] = target.add_symbol(name, 'List_t')
+        target.list_init(task_lists[name])
+
+    tcbs = []
+    for i in range(tasks):
+        tcb = target.alloc_struct('TCB_t')
+        stack = target.alloc(STACK_SIZE)
+        used = 64 + (i * 37) % (STACK_SIZE - 128)
+        target.write_bytes(stack, bytes([STACK_FILL_BYTE]) * (STACK_SIZE - used))
+        priority = i % MAX_PRIORITIES
+        for _, (path, value) in enumerate((('pxStack', stack), ('pxEndOfStack', stack + STACK_SIZE - 1),
+                                           ('pxTopOfStack', stack + STACK_SIZE - used // 2),
+                                           ('pcTaskName', f'task{i}'), ('uxPriority', priority),
+                                           ('uxBasePriority', priority), ('xCoreID', 0x7fffffff),
+                                           ('uxTCBNumber', i + 1), ('uxTaskNumber', i + 1),
+                                           ('ulRunTimeCounter', i * 1000))):
+            target.write('TCB_t', tcb, path, value)
+        state_item = target.field_address('TCB_t', tcb, 'xStateListItem')
+        target.write('ListItem_t', target.field_address('TCB_t', tcb, 'xEventListItem'), 'pvOwner', tcb)
+        if i < queues * waiters or i % 3 == 1:
+            target.list_insert_end(task_lists['xDelayedTaskList1'], state_item, tcb, 1000 + i)
+        elif i % 3 == 2:
+            target.list_insert_end(task_lists['xSuspendedTaskList'], state_item, tcb)
+        else:
+            target.list_insert_end(ready + priority * list_size, state_item, tcb)
+        tcbs.append(tcb)
+    target.add_int_symbol('pxCurrentTCB', tcbs[-1] if tcbs else 0, TypeCode.PTR)
+    target.add_int_symbol('uxTaskNumber', tasks)
+    target.add_int_symbol('uxCurrentNumberOfTasks', tasks)
+    target.add_int_symbol('xTickCount', 1000)
+
+    registry = target.add_symbol('xQueueRegistry', 'QueueRegistryItem_t', max(queues, 1))
+    item_size = target.layouts['QueueRegistryItem_t'].size
+    for i in range(queues):
+        queue = target.alloc_struct('Queue_t')
+        for _, field in enumerate(('xTasksWaitingToSend', 'xTasksWaitingToReceive')):
+            target.list_init(target.field_address('Queue_t', queue, field))
+        if i % 4 == 3:
+            target.write('Queue_t', queue, 'u.xSemaphore.xMutexHolder', tcbs[-1] if tcbs else 0)
+            target.write('Queue_t', queue, 'uxLength', 1)
+        else:
+            storage = target.alloc(4 * 8)
+            target.write('Queue_t', queue, 'pcHead', storage)
+            target.write('Queue_t', queue, 'u.xQueue.pcTail', storage + 4 * 8)
+            # as set by xQueueGenericReset() before i % 8 items were sent
+            target.write('Queue_t', queue, 'pcWriteTo', storage + 4 * (i % 8))
+            target.write('Queue_t', queue, 'u.xQueue.pcReadFrom', storage + 4 * 7)
+            target.write('Queue_t', queue, 'uxLength', 8)
+            target.write('Queue_t', queue, 'uxItemSize', 4)
+            target.write('Queue_t', queue, 'uxMessagesWaiting', i % 8)
+        rcv_list = target.field_address('Queue_t', queue, 'xTasksWaitingToReceive')
+        for waiter in range(waiters):
+            tcb = tcbs[i * waiters + waiter]
+            target.list_insert_end(rcv_list, target.field_address('TCB_t', tcb, 'xEventListItem'), tcb)
+        target.write('QueueRegistryItem_t', registry + i * item_size, 'pcQueueName', target.add_string(f'queue{i}'))
+        target.write('QueueRegistryItem_t', registry + i * item_size, 'xHandle', queue)
+
+    timer_lists = [target.add_symbol('xActiveTimerList1', 'List_t'), target.add_symbol('xActiveTimerList2', 'List_t')]
+    for _, timer_list in enumerate(timer_lists):
+        target.list_init(timer_list)
+    target.add_int_symbol('pxCurrentTimerList', timer_lists[0], TypeCode.PTR)
+    target.add_int_symbol('pxOverflowTimerList', timer_lists[1], TypeCode.PTR)
+    callbacks = [0x400d0000 + i * 0x40 for i in range(4)]
+    for i, callback in enumerate(callbacks):
+        target.add_function(f'timer_callback{i}', callback)
+    for i in range(timers):
+        timer = target.alloc_struct('Timer_t')
+        for _, (path, value) in enumerate((('pcTimerName', target.add_string(f'timer{i}')),
+                                           ('xTimerPeriodInTicks', 100 + i), ('pvTimerID', i),
+                                           ('pxCallbackFunction', callbacks[i % len(callbacks)]),
+                                           ('uxTimerNumber', i + 1), ('ucStatus', 5))):
+            target.write('Timer_t', timer, path, value)
+        target.list_insert_end(timer_lists[i % 2], target.field_address('Timer_t', timer, 'xTimerListItem'), timer,
+                               1100 + i)
+    return target
+
+
+class SimulatedBackend(Backend):
+    """Serves a SyntheticTarget, counting target accesses like a debugger link would see them
+
+    :param target: SyntheticTarget to read
+    :param latency: Delay of every memory read and symbol lookup in seconds
+    """
+
+    def __init__(self, target, latency=0.0):
+        self.target = target
+        self.latency = latency
+        self._functions = sorted(target.functions)
+        self.reads = 0
+        self.read_bytes = 0
+        self.lookups = 0
+
+    def reset_counters(self):
+        self.reads = 0
+        self.read_bytes = 0
+        self.lookups = 0
+
+    def _access(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def read_memory(self, address, size):
+        self.reads += 1
+        self.read_bytes += size
+        self._access()
+        offset = address - self.target.base
+        if offset < 0 or offset + size > len(self.target.memory):
+            raise MemoryReadError(f'Cannot access memory at address {address:#x}')
+        return bytes(self.target.memory[offset:offset + size])
+
+    def get_struct_layout(self, type_name):
+        self.lookups += 1
+        self._access()
+        layout = self.target.layouts.get(type_name)
+        if layout is None:
+            raise TypeNotFound(f'No struct type named {type_name}.')
+        return layout
+
+    def get_type_layout(self, type_name):
+        if type_name in BASE_TYPES:
+            return BASE_TYPES[type_name]
+        return _nested(self.get_struct_layout(type_name))
+
+    def lookup_symbol(self, name):
+        self.lookups += 1
+        self._access()
+        symbol = self.target.symbols.get(name)
+        if symbol is None:
+            raise SymbolNotFound(f'No symbol "{name}" in current context.')
+        return symbol
+
+    def find_variables(self, type_name):
+        # the synthetic target has no other kernel objects than tasks, queues and timers
+        return []
+
+    def lookup_symbol_name(self, address):
+        self.lookups += 1
+        self._access()
+        idx = bisect.bisect_right(self._functions, (address, chr(0x10ffff))) - 1
+        if idx < 0:
+            return None
+        start, name = self._functions[idx]
+        return name if start == address else f'{name}+{address - start}'
+
+
+BENCHMARK_HEADERS = ['COMMAND', 'READS', 'BYTES', 'LOOKUPS', 'TIME_MS']
+
+
+def run_benchmark(backend, commands=COMMANDS, repeat=1, warm=False):
+    """Return a row of BENCHMARK_HEADERS per command. Time is the best of repeat runs, counters are of the last run.
+
+    Every run starts with empty caches, as after loading the program. With warm=True symbol and type caches
+    are filled by a run before the measured ones, as on a later halt. Messages of the commands, e.g. about kernel
+    objects the synthetic target does not have, are discarded.
+    """
+    rows = []
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+        for _, command in enumerate(commands):
+            best = None
+            if warm:
+                set_backend(backend)
+                snapshot.invalidate()
+                run_command(command, output=devnull.name)
+            for _ in range(repeat):
+                if not warm:
+                    set_backend(backend)
+                snapshot.invalidate()
+                backend.reset_counters()
+                start = time.perf_counter()
+                run_command(command, output=devnull.name)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            rows.append([command, backend.reads, backend.read_bytes, backend.lookups, round(best * 1000, 2)])
+    set_backend(None)
+    snapshot.invalidate()
+    return rows
+
+
+def main(argv=None):
+    parser = get_arg_parser('python -m freertos_gdb.benchmark',
+                            'Run freertos commands against a synthetic FreeRTOS heap and count target reads.')
+    parser.add_argument('--tasks', type=int, default=50, help='Number of tasks.')
+    parser.add_argument('--queues', type=int, default=10, help='Number of registered queues.')
+    parser.add_argument('--waiters', type=int, default=1, help='Number of tasks blocked on each queue.')
+    parser.add_argument('--timers', type=int, default=20, help='Number of active timers.')
+    parser.add_argument('--latency-us', type=float, default=0.0,
+                        help='Delay added to every target access in microseconds, e.g. to model JTAG.')
+    parser.add_argument('--repeat', type=int, default=1, help='Report the best time of REPEAT runs.')
+    parser.add_argument('--warm', action='store_true',
+                        help='Keep symbol and type caches between runs, as on a later halt.')
+    parser.add_argument('commands', nargs='*', metavar='COMMAND',
+                        help=f'Commands to run: {", ".join(COMMANDS)}. All by default.')
+    args = parser.parse_args(argv)
+    unknown = set(args.commands) - set(COMMANDS)
+    if unknown:
+        parser.error(f'unknown commands: {", ".join(sorted(unknown))}')
+    try:
+        target = build_target(args.tasks, args.queues, args.waiters, args.timers)
+    except ValueError as err:
+        parser.error(str(err))
+    rows = run_benchmark(SimulatedBackend(target, args.latency_us / 1e6), args.commands or COMMANDS, args.repeat,
+                         args.warm)
+    with open_output(args.output) as stream:
+        write_table(rows, BENCHMARK_HEADERS, args.format, stream, args.fixed_width)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
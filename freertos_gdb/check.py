@@ -0,0 +1,142 @@
+# SPDX-FileCopyrightText: 2022 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+#
+# pylint: disable=import-error
+from collections import namedtuple
+from .common import CommandBase, ListWalk, gdb, get_arg_parser, open_output, parse_args, write_table
+from .memory import Address, TargetError, get_struct_layout, read_string
+from .snapshot import TaskLists, read_queue_registry
+from .symbols import get_kernel_symbols
+
+CHECK_HELP = (
+    ('ITEM', 'List item with the broken link, empty for problems of the list header.'),
+    ('PROBLEM', 'What is broken: NULL, unreadable or cyclic pxNext links, pxPrevious not pointing back, pvContainer '
+                'not pointing to the list, pvOwner not holding the item, uxNumberOfItems or pxIndex not agreeing '
+                'with the items found.'),
+)
+
+# list to check: name, List_t address, owner type name and the ListItem_t field of the owner linked into the list
+KernelList = namedtuple('KernelList', 'name address owner_type item_field')
+ListProblem = namedtuple('ListProblem', 'list address item problem')
+
+
+def get_kernel_lists():
+    """Return KernelLists of tasks, timers and queue registry queues which exist in the program"""
+    symbols = get_kernel_symbols()
+    lists = []
+    for _, task_list in enumerate(TaskLists):
+        if task_list.symbol not in symbols:
+            continue
+        # tasks are moved to the pending ready list by their event list item
+        item_field = 'xEventListItem' if task_list is TaskLists.PEND_READ else 'xStateListItem'
+        addresses = symbols.list_addresses(task_list.symbol)
+        for i, address in enumerate(addresses):
+            name = task_list.symbol if len(addresses) == 1 else f'{task_list.symbol}[{i}]'
+            lists.append(KernelList(name, address, 'TCB_t', item_field))
+    for _, name in enumerate(('xActiveTimerList1', 'xActiveTimerList2')):
+        if name in symbols:
+            lists.append(KernelList(name, symbols.get(name).address, 'Timer_t', 'xTimerListItem'))
+    if 'xQueueRegistry' in symbols:
+        layout = get_struct_layout('Queue_t')
+        for _, item in enumerate(read_queue_registry()):
+            for _, field in enumerate(('xTasksWaitingToSend', 'xTasksWaitingToReceive')):
+                lists.append(KernelList(f'{read_string(item["pcQueueName"])} {field}',
+                                        item['xHandle'] + layout.fields[field].offset, 'TCB_t', 'xEventListItem'))
+    return lists
+
+
+def check_list(kernel_list):
+    """Return ListProblems of a list found in a single bounded walk"""
+    problems = []
+
+    def report(item, problem):
+        problems.append(ListProblem(kernel_list.name, Address(kernel_list.address), item, problem))
+
+    walk = ListWalk(kernel_list.address).walk()
+    header = walk.header
+    end_value = header.layout.field('xListEnd.xItemValue')[1]
+    if header['xListEnd.xItemValue'] != (1 << 8 * end_value.size) - 1:
+        report('', f'xListEnd.xItemValue is {header["xListEnd.xItemValue"]:#x}, expected portMAX_DELAY')
+    owner_offset = get_struct_layout(kernel_list.owner_type).fields[kernel_list.item_field].offset
+    previous = walk.end_marker
+    for i, address in enumerate(walk.addresses):
+        item = Address(address)
+        if walk.field(i, 'pxPrevious') != previous:
+            report(item, f'pxPrevious is {walk.field(i, "pxPrevious"):#x}, expected {walk.describe(i - 1)}')
+        if walk.field(i, 'pvContainer') != kernel_list.address:
+            report(item, f'pvContainer is {walk.field(i, "pvContainer"):#x}, expected the list')
+        owner = walk.field(i, 'pvOwner')
+        if owner + owner_offset != address:
+            report(item, f'pvOwner {owner:#x} is not the {kernel_list.owner_type} holding the item in '
+                         f'{kernel_list.item_field}')
+        previous = address
+    if walk.error is not None:
+        report(Address(walk.addresses[-1]) if walk.addresses else '', walk.error)
+        return problems
+    if header['xListEnd.pxPrevious'] != previous:
+        report('', f'xListEnd.pxPrevious is {header["xListEnd.pxPrevious"]:#x}, expected '
+                   f'{walk.describe(len(walk.addresses) - 1)}')
+    if header['uxNumberOfItems'] != len(walk.addresses):
+        report('', f'uxNumberOfItems is {header["uxNumberOfItems"]}, {len(walk.addresses)} items are linked')
+    if header['pxIndex'] != walk.end_marker and header['pxIndex'] not in walk.addresses:
+        report('', f'pxIndex {header["pxIndex"]:#x} is neither xListEnd nor an item of the list')
+    return problems
+
+
+def check_lists(kernel_lists):
+    """Return ListProblems of lists. An unreadable list header is a problem too"""
+    problems = []
+    for _, kernel_list in enumerate(kernel_lists):
+        try:
+            problems.extend(check_list(kernel_list))
+        except TargetError as err:
+            problems.append(ListProblem(kernel_list.name, Address(kernel_list.address), '', str(err)))
+    return problems
+
+
+def get_table_rows(problems):
+    return [[problem.list, problem.address, problem.item, problem.problem] for _, problem in enumerate(problems)]
+
+
+def get_table_headers():
+    return ['LIST', 'ADDRESS'] + [title for title, _ in CHECK_HELP]
+
+
+def print_help(stream=None):
+    for _, (title, help_) in enumerate(CHECK_HELP):
+        print(title + '\t - ' + help_, file=stream)
+    print('', file=stream)
+
+
+def show(fmt='table', output=None, fixed_width=None):
+    kernel_lists = get_kernel_lists()
+    problems = check_lists(kernel_lists)
+    with open_output(output) as stream:
+        if fmt != 'table':
+            write_table(get_table_rows(problems), get_table_headers(), fmt, stream, fixed_width)
+            return
+        if not problems:
+            print(f'All {len(kernel_lists)} kernel lists are consistent', file=stream)
+            return
+        print_help(stream)
+        write_table(get_table_rows(problems), get_table_headers(), fmt, stream, fixed_width)
+        print(f'\n{len(problems)} problems in {len({problem.list for problem in problems})} of '
+              f'{len(kernel_lists)} kernel lists', file=stream)
+
+
+class FreeRtosCheck(CommandBase):
+    """ Check integrity of kernel lists: links, containers, owners, item counts and cycles.
+    """
+
+    def __init__(self):
+        super().__init__('freertos check', gdb.COMMAND_USER)
+        self._parser = get_arg_parser('freertos check', self.__doc__)
+
+    def invoke(self, arg, _):
+        args = parse_args(self._parser, arg)
+        if args is None:
+            return
+        try:
+            show(args.format, args.output, args.fixed_width)
+        except TargetError as err:
+            print(err)
@@ -2,8 +2,18 @@
 # SPDX-License-Identifier: Apache-2.0
 #
 # pylint: disable=import-error
-import gdb
+import argparse
+import contextlib
+import csv
 import enum
+import itertools
+import json
+import shlex
+import sys
+from .memory import Address, CodeAddress, StructReader, TargetError, gdb
+
+# Commands are registered only inside GDB. Outside of it the show functions are used directly (see offline.py)
+CommandBase = gdb.Command if gdb is not None else object
 
 
 class StructProperty(enum.Enum):
@@ -25,38 +35,32 @@ class StructProperty(enum.Enum):
     def title(self):
         return self.name
 
-    def value_str(self, obj):
+    def get_value(self, obj):
+        """Return typed value: int, Address, str or ''"""
         val_fn = getattr(self, self.get_val_fn if obj else 'get_empty_val')
-        return str(val_fn(obj))
+        return val_fn(obj)
+
+    def value_str(self, obj):
+        return str(self.get_value(obj))
 
-    def exist(self, struct):
+    def exist(self, layout):
         if self.property == '':
             return True
-        return any(item.name == self.property for _, item in enumerate(struct.fields()))
+        return layout.has_field(self.property)
 
-    def print_property_help(self, struct):
-        if not self.exist(struct):
+    def print_property_help(self, layout, stream=None):
+        if not self.exist(layout):
             return
         if self._help == '':
             return
-        print(self.title + '\t - ' + self._help)
+        print(self.title + '\t - ' + self._help, file=stream)
 
     def get_val(self, obj):
         if obj is None:
             return ''
         if self.property == '':
             return ''
-        try:
-            type_code = obj[self.property].type.strip_typedefs().code
-            # convert gdb.value to int to avoid gdb default printing
-            # https://sourceware.org/gdb/onlinedocs/gdb/Output-Formats.html
-            if type_code == gdb.TYPE_CODE_INT:
-                val = int(obj[self.property])
-            else:
-                val = obj[self.property]
-        except (ValueError, gdb.error):
-            val = 'N/A?'
-        return val
+        return obj[self.property]
 
     @staticmethod
     def get_val_as_is(val):
@@ -70,73 +74,312 @@ class StructProperty(enum.Enum):
         if obj is None:
             return ''
         try:
-            name = obj[self.property].string()
-        except ValueError:
+            name = obj.string(self.property)
+        except TargetError:
             name = 'N/A?'
         return name
 
 
-def print_table(table, headers=None):
-    if headers:
-        table.insert(0, headers)
+def expand_row(row):
+    """Split a row with list cells (e.g. waiting tasks) into several table lines"""
+    lines = max([len(cell) for cell in row if isinstance(cell, list)] + [1])
+    for i in range(lines):
+        yield [(cell[i] if i < len(cell) else '') if isinstance(cell, list) else (cell if i == 0 else '')
+               for cell in row]
+
+
+class LineWriter:
+    """Buffered output. Lines are collected and written to the stream in large chunks
+
+    :param stream: Stream to write to
+    :param chunk_size: Flush when that many characters are collected. 0 writes every line at once.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, stream, chunk_size: int = CHUNK_SIZE):
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._lines = []
+        self._size = 0
+
+    def write(self, line):
+        self._lines.append(line)
+        self._size += len(line)
+        if self._size >= self._chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self._lines:
+            self._stream.write(''.join(self._lines))
+            self._lines = []
+            self._size = 0
+        self._stream.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.flush()
+
+
+def format_line(cells, widths):
+    return ''.join(cell.rjust(width) + ' ' for cell, width in zip(cells, widths)) + '\n'
+
+
+def print_table(table, headers=None, stream=None, fixed_width=None):
+    """Print rows as a text table with right-justified columns
+
+    Every cell is converted to a string once and every line is written with one call.
+
+    :param table: Iterable of rows
+    :param headers: Column titles
+    :param stream: Stream to write to, sys.stdout by default
+    :param fixed_width: Minimal width of all columns. If set, rows are printed as soon as they are produced,
+        otherwise column widths are fitted to the whole table.
+    """
+    stream = stream or sys.stdout
+    lines = ([str(cell) for cell in line] for row in table for line in expand_row(row))
+    if fixed_width and headers:
+        widths = [max(len(title), fixed_width) for title in headers]
+    else:
+        lines = list(lines)
+        if not lines and not headers:
+            return
+        widths = [len(title) for title in headers] if headers else [0] * len(lines[0])
+        for _, line in enumerate(lines):
+            widths = list(map(max, widths, map(len, line)))
+
+    with LineWriter(stream, 0 if fixed_width else LineWriter.CHUNK_SIZE) as writer:
+        if headers:
+            writer.write(format_line(headers, widths))
+            # header separator
+            writer.write(' '.join('-' * width for width in widths) + '\n')
+        for _, line in enumerate(lines):
+            writer.write(format_line(line, widths))
+
+
+def json_value(val):
+    """Convert a table cell to a JSON compatible value"""
+    if isinstance(val, CodeAddress):
+        return {'address': hex(val), 'symbol': val.symbol}
+    if isinstance(val, Address):
+        return hex(val)
+    if hasattr(val, '_asdict'):
+        return {k: json_value(v) for k, v in val._asdict().items()}
+    if isinstance(val, list):
+        return [json_value(v) for v in val]
+    if val == '':
+        return None
+    return val
+
+
+def json_row(headers, row):
+    return {h: json_value(v) for h, v in zip(headers, row)}
+
+
+def write_json(table, headers, stream):
+    with LineWriter(stream) as writer:
+        writer.write('[')
+        for i, row in enumerate(table):
+            writer.write((',\n ' if i else '\n ') + json.dumps(json_row(headers, row)))
+        writer.write('\n]\n')
+
 
-    max_column = [0] * len(table[0])
-    for _, row in enumerate(table):
-        for k, _ in enumerate(max_column):
-            max_column[k] = max(len(str(row[k])), max_column[k])
+def write_csv(table, headers, stream):
+    with LineWriter(stream) as writer:
+        csv_writer = csv.writer(writer)
+        csv_writer.writerow(headers)
+        for _, row in enumerate(table):
+            csv_writer.writerow([';'.join(str(v) for v in cell) if isinstance(cell, list) else str(cell)
+                                 for cell in row])
 
-    # print formatted
-    for i, row in enumerate(table):
-        # print row
-        for k, _ in enumerate(max_column):
-            print(str(row[k]).rjust(max_column[k]), end=' ')
-        print(end='\n')
-        # print header separator
-        if headers and i == 0:
-            header_separator = ' '.join([''.rjust(max_column[i], '-') for i in range(len(max_column))])
-            print(header_separator)
+
+def write_table(table, headers, fmt='table', stream=None, fixed_width=None):
+    """Write rows in one of OUTPUT_FORMATS. Rows may be a generator, json and csv are always streamed"""
+    stream = stream or sys.stdout
+    if fmt == 'json':
+        write_json(table, headers, stream)
+    elif fmt == 'csv':
+        write_csv(table, headers, stream)
+    else:
+        print_table(table, headers, stream, fixed_width)
+
+
+def peek_rows(rows):
+    """Return an iterator over rows or None if there are no rows. The first row of a generator is read ahead"""
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return None
+    return itertools.chain([first], rows)
+
+
+OUTPUT_FORMATS = ('table', 'json', 'csv')
+
+
+def get_arg_parser(prog, description):
+    """Return a parser with arguments shared by all commands which print tables"""
+    parser = argparse.ArgumentParser(prog=prog, description=description)
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='table',
+                        help='Output format. Values are typed (integers, addresses, names) in json and csv formats.')
+    parser.add_argument('--output', metavar='FILE', help='Write output to FILE instead of the console.')
+    parser.add_argument('--fixed-width', metavar='N', type=int, nargs='?', const=12,
+                        help='Use fixed width columns (at least N characters, 12 by default) and print rows '
+                             'as soon as they are read instead of after the whole table is collected.')
+    return parser
+
+
+def parse_args(parser, arg):
+    try:
+        return parser.parse_args(gdb.string_to_argv(arg) if gdb is not None else shlex.split(arg))
+    except SystemExit:
+        # argparse exits on errors and on --help, gdb must keep running
+        return None
+
+
+@contextlib.contextmanager
+def open_output(path, append=False):
+    """Yield a stream to write command output to. None means the console"""
+    if path is None:
+        yield sys.stdout
+        return
+    with open(path, 'a' if append else 'w', encoding='utf-8', newline='') as stream:
+        yield stream
+
+
+class ListWalk:
+    """Bounded, fault tolerant walk over the items of a freertos list (List_t), one memory transfer per item.
+
+    The walk starts at xListEnd.pxNext and ends at the end marker. It stops early, with the reason in error, at a
+    NULL link, an unreadable item, a cycle which does not pass the end marker or after max_length items, so a
+    corrupted list never hangs a command or fails it halfway. Items already read are indexed by address, a cycle
+    is found at the first repeated item, before anything is read or yielded twice.
+
+    :param list_: Address of the List_t to walk
+    :param reader: StructReader of the structures holding the items, ListItem_t by default
+    :param item_field: Name of the ListItem_t field of the structures read by reader, '' for ListItem_t
+    :param max_length: Hard bound of items to read
+    """
+
+    MAX_LENGTH = 10000
+
+    def __init__(self, list_, reader=None, item_field='', max_length=MAX_LENGTH):
+        self.address = int(list_)
+        self.header = StructReader('List_t').read(self.address)
+        self.end_marker = self.address + self.header.layout.fields['xListEnd'].offset
+        self.max_length = max_length
+        self._reader = reader or StructReader('ListItem_t')
+        self._prefix = item_field + '.' if item_field else ''
+        self._item_offset = self._reader.layout.fields[item_field].offset if item_field else 0
+        # item addresses and structures read, in the list order
+        self.addresses = []
+        self._indexes = {}
+        self.items = []
+        self.error = None
+        self.complete = False
+        self._next = self.header['xListEnd.pxNext']
+
+    def field(self, index, name):
+        """Return a ListItem_t field of the item at index"""
+        return self.items[index][self._prefix + name]
+
+    def describe(self, index):
+        return 'xListEnd' if index < 0 else f'item {self.addresses[index]:#x}'
+
+    def read_next(self):
+        """Read the next item. Return False at the end of the list or when the walk stopped at an error"""
+        if self.complete:
+            return False
+        node = self._next
+        count = len(self.addresses)
+        if node == self.end_marker:
+            return self._stop(None)
+        if node == 0:
+            return self._stop(f'pxNext of {self.describe(count - 1)} is NULL')
+        if node in self._indexes:
+            return self._stop(f'pxNext of {self.describe(count - 1)} points back to item {node:#x} '
+                              f'(#{self._indexes[node]}), the end marker is not reached')
+        if count >= self.max_length:
+            return self._stop(f'more than {self.max_length} items, the end marker is not reached')
+        try:
+            item = self._reader.read(node - self._item_offset)
+        except TargetError as err:
+            return self._stop(f'pxNext of {self.describe(count - 1)} points to {node:#x}: {err}')
+        self._indexes[node] = count
+        self.addresses.append(node)
+        self.items.append(item)
+        self._next = item[self._prefix + 'pxNext']
+        return True
+
+    def walk(self):
+        """Read all items. Return self"""
+        while self.read_next():
+            pass
+        return self
+
+    def _stop(self, error):
+        self.complete = True
+        self.error = error
+        return False
 
 
 class FreeRtosList():
     """Enumerator for an freertos list (ListItem_t)
 
-    :param list_: List to enumerate
-    :param cast_type_str: Type name to cast list items as
+    List nodes are read from the target lazily, one memory transfer per node, and kept in a cache, so the list
+    is read only once no matter how many times it is iterated or indexed. Nodes are walked with ListWalk, a
+    corrupted list ends the iteration early, see error.
+
+    :param list_: Address of the List_t to enumerate
+    :param cast_type_str: Type name of list items owners. Items are yielded as owners addresses
     :param check_length: If True check uxNumberOfItems to stop iteration. By default check for reaching xListEnd.
+    :param max_length: Upper bound of nodes to read. Protects from endless walking over a corrupted list.
     """
 
-    def __init__(self, list_, cast_type_str, check_length: bool = False):
-        self.cast_type = gdb.lookup_type(cast_type_str).pointer()
-        self.end_marker = list_['xListEnd']
-        self.head = self.end_marker['pxNext']  # ptr to start item
-        self._length = list_['uxNumberOfItems']
+    MAX_LENGTH = ListWalk.MAX_LENGTH
+
+    def __init__(self, list_, cast_type_str, check_length: bool = False, max_length: int = MAX_LENGTH):
+        self.owner_type = cast_type_str
+        self._walk = ListWalk(list_, max_length=max_length)
+        self.address = self._walk.address
+        self._length = self._walk.header['uxNumberOfItems']
         self.check_length = check_length
+        self._items = []
+        self._complete = False
 
     @property
     def length(self):
         return self._length
 
+    @property
+    def error(self):
+        """Why the walk stopped before the end marker, or None"""
+        return self._walk.error
+
     def __getitem__(self, idx):
-        for i, item in enumerate(self):
-            if i == idx:
-                return item
+        while len(self._items) <= idx and self._read_next():
+            pass
+        if idx < len(self._items):
+            return self._items[idx]
         return None
 
     def __iter__(self):
-        curr_node = self.head
         index = 0
-        while True:
-            if curr_node == self.end_marker.address:
-                break
-            if self.check_length and index >= self._length:
-                break
-            tmp_node = curr_node.dereference()
-            data = tmp_node['pvOwner'].cast(self.cast_type)
-            yield data
+        while index < len(self._items) or self._read_next():
+            yield self._items[index]
             index += 1
-            curr_node = tmp_node['pxNext']
+
+    def _read_next(self):
+        if self._complete:
+            return False
+        if (self.check_length and len(self._items) >= self._length) or not self._walk.read_next():
+            self._complete = True
+            return False
+        self._items.append(self._walk.field(-1, 'pvOwner'))
+        return True
 
 
-class FreeRtos(gdb.Command):
+class FreeRtos(CommandBase):
     def __init__(self):
         super().__init__('freertos', gdb.COMMAND_USER, gdb.COMPLETE_NONE, True)
@@ -0,0 +1,208 @@
+# SPDX-FileCopyrightText: 2022 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+#
+# pylint: disable=import-error
+from .common import CommandBase, gdb, get_arg_parser, open_output, parse_args, write_table
+from .memory import StructReader, TargetError, read_variables
+from .snapshot import TaskLists, get_snapshot
+from .symbols import get_kernel_symbols
+from .task import TaskProperty, get_task_ref
+
+# per-core state: column -> names of the variable in kernel variants and ports. An array holds a value per core,
+# a single variable is shared by all cores
+CORE_VARIABLES = {
+    'YIELD': ('xYieldPendings', 'xYieldPending'),
+    'SUSPENDED': ('uxSchedulerSuspended',),
+    'CRITICAL': ('port_uxCriticalNesting', 'uxCriticalNesting', 'ulCriticalNesting'),
+}
+
+CORES_HELP = (
+    ('RUNNING', 'Task the core runs.'),
+    ('PRI', 'Priority of the running task.'),
+    ('AF', 'CPU affinity of the running task.'),
+    ('YIELD', 'xYieldPending: a context switch is pending on the core.'),
+    ('SUSPENDED', 'uxSchedulerSuspended: nesting of vTaskSuspendAll(), no task switches while non zero.'),
+    ('CRITICAL', 'Critical section nesting of the core.'),
+    ('CONFLICT', 'The running task is not allowed on the core by its affinity.'),
+    ('HELD_OFF', 'Ready tasks allowed on the core with a higher priority than the running task: the core does not '
+                 'switch to them, e.g. because of a suspended scheduler, a critical section or a pending yield.'),
+)
+
+# xCoreID of tasks without affinity
+NO_AFFINITY = 0x7FFFFFFF
+
+
+def read_core_state(symbols):
+    """Return {variable name: value} of the per-core state and ready list headers.
+
+    The variables are statics of tasks.c and the port, they are read in a batch of a few transfers.
+    """
+    names = [symbols.current_tcb.name, 'uxTopReadyPriority', 'pxReadyTasksLists']
+    for _, variable_names in enumerate(CORE_VARIABLES.values()):
+        names.extend(variable_names)
+    return read_variables(names)
+
+
+def get_core_value(values, column, core):
+    """Return the value of a per-core variable for a core, or '' if the port has no such variable"""
+    for _, name in enumerate(CORE_VARIABLES[column]):
+        if name in values:
+            value = values[name]
+            if isinstance(value, list):
+                return value[core] if core < len(value) else ''
+            return value
+    return ''
+
+
+def get_allowed_cores(tcb, cores):
+    """Return cores the task may run on: from uxCoreAffinityMask of the SMP kernel or xCoreID of ESP-IDF"""
+    if tcb.layout.has_field('uxCoreAffinityMask'):
+        mask = tcb['uxCoreAffinityMask']
+        return {core for core in range(cores) if mask & (1 << core)}
+    if tcb.layout.has_field('xCoreID'):
+        core = tcb['xCoreID']
+        if 0 <= core < cores and core != NO_AFFINITY:
+            return {core}
+    return set(range(cores))
+
+
+def get_affinity(tcb, cores):
+    if TaskProperty.AF.exist(tcb.layout):
+        return TaskProperty.AF.get_value(tcb)
+    allowed = get_allowed_cores(tcb, cores)
+    return '-' if len(allowed) == cores else ','.join(f'CPU{core}' for core in sorted(allowed))
+
+
+def get_ready_counts(symbols, values):
+    """Return [number of ready tasks] per priority from the ready list headers read with the core state"""
+    data = values.get('pxReadyTasksLists')
+    if data is None:
+        return []
+    reader = StructReader('List_t')
+    start = symbols.get('pxReadyTasksLists').address
+    counts = []
+    for _, address in enumerate(symbols.list_addresses('pxReadyTasksLists')):
+        offset = address - start
+        counts.append(reader.decode(address, data[offset:offset + reader.layout.size])['uxNumberOfItems'])
+    return counts
+
+
+class Cores:
+    """Per-core scheduling state of one snapshot.
+
+    Ready tasks are taken from the task lists walked once by the snapshot, not per core.
+    """
+
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+        self.symbols = get_kernel_symbols()
+        if self.symbols.current_tcb is None:
+            raise TargetError('No symbol "pxCurrentTCB" or "pxCurrentTCBs" in current context.')
+        self.cores = self.symbols.num_cores
+        self.values = read_core_state(self.symbols)
+        current = self.values[self.symbols.current_tcb.name]
+        self.current = current if isinstance(current, list) else [current]
+        self.running = {core: snapshot.get_task(address) for core, address in enumerate(self.current) if address}
+        running = set(self.current)
+        self.ready = [record.tcb for record in snapshot.iter_tasks()
+                      if record.state in (TaskLists.READY.state, TaskLists.PEND_READ.state)
+                      and record.tcb.address not in running]
+
+    def get_running_priority(self, core):
+        tcb = self.running.get(core)
+        return tcb['uxPriority'] if tcb is not None else -1
+
+    def get_held_off(self, core):
+        priority = self.get_running_priority(core)
+        return [tcb for tcb in self.ready
+                if tcb['uxPriority'] > priority and core in get_allowed_cores(tcb, self.cores)]
+
+    def get_critical_nesting(self, core):
+        value = get_core_value(self.values, 'CRITICAL', core)
+        tcb = self.running.get(core)
+        if value == '' and tcb is not None and tcb.layout.has_field('uxCriticalNesting'):
+            # portCRITICAL_NESTING_IN_TCB
+            return tcb['uxCriticalNesting']
+        return value
+
+    def get_table_rows(self):
+        rows = []
+        for core in range(self.cores):
+            tcb = self.running.get(core)
+            if tcb is None:
+                row = ['', '', '']
+                conflict = ''
+            else:
+                row = [get_task_ref(tcb), tcb['uxPriority'], get_affinity(tcb, self.cores)]
+                conflict = 'yes' if core not in get_allowed_cores(tcb, self.cores) else ''
+            rows.append([f'CPU{core}'] + row + [get_core_value(self.values, 'YIELD', core),
+                                                get_core_value(self.values, 'SUSPENDED', core),
+                                                self.get_critical_nesting(core), conflict,
+                                                [get_task_ref(ready) for ready in self.get_held_off(core)]])
+        return rows
+
+    def get_starved(self):
+        """Return [(ready TCB, cores running a lower priority task the task is not allowed on)].
+
+        The task would run on such a core by its priority, but its affinity keeps it on cores busy with tasks of
+        the same or a higher priority.
+        """
+        starved = []
+        for _, tcb in enumerate(self.ready):
+            allowed = get_allowed_cores(tcb, self.cores)
+            priority = tcb['uxPriority']
+            if any(self.get_running_priority(core) < priority for core in allowed):
+                continue
+            lower = [core for core in range(self.cores) if core not in allowed and
+                     self.get_running_priority(core) < priority]
+            if lower:
+                starved.append((tcb, lower))
+        return starved
+
+    def print_summary(self, stream=None):
+        counts = get_ready_counts(self.symbols, self.values)
+        occupied = ', '.join(f'pri {priority}: {count}' for priority, count in reversed(list(enumerate(counts)))
+                             if count)
+        top = self.values.get('uxTopReadyPriority')
+        print(f'Ready lists{f" (uxTopReadyPriority {top})" if top is not None else ""}: {occupied or "empty"}',
+              file=stream)
+        for _, (tcb, cores) in enumerate(self.get_starved()):
+            print(f'Starvation candidate: {get_task_ref(tcb)} (pri {tcb["uxPriority"]}, '
+                  f'AF {get_affinity(tcb, self.cores)}) is ready, lower priority tasks run on '
+                  f'{", ".join(f"CPU{core}" for core in cores)}', file=stream)
+
+
+def print_help(stream=None):
+    for _, (title, help_) in enumerate(CORES_HELP):
+        print(title + '\t - ' + help_, file=stream)
+    print('', file=stream)
+
+
+def show(fmt='table', output=None, fixed_width=None):
+    cores = Cores(get_snapshot())
+    rows = cores.get_table_rows()
+    with open_output(output) as stream:
+        if fmt == 'table':
+            print_help(stream)
+        write_table(rows, ['CORE'] + [title for title, _ in CORES_HELP], fmt, stream, fixed_width)
+        if fmt == 'table':
+            print('', file=stream)
+            cores.print_summary(stream)
+
+
+class FreeRtosCores(CommandBase):
+    """ Generate a print out of what every core runs, its scheduler state and tasks held off from it.
+    """
+
+    def __init__(self):
+        super().__init__('freertos cores', gdb.COMMAND_USER)
+        self._parser = get_arg_parser('freertos cores', self.__doc__)
+
+    def invoke(self, arg, _):
+        args = parse_args(self._parser, arg)
+        if args is None:
+            return
+        try:
+            show(args.format, args.output, args.fixed_width)
+        except TargetError as err:
+            print(err)
@@ -0,0 +1,110 @@
+# SPDX-FileCopyrightText: 2022 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+#
+# pylint: disable=import-error
+from .heap import Heap
+from .memory import Address, MemoryReadError, StructReader, TargetError, find_variables, get_cached, \
+    get_struct_layout, lookup_symbol, lookup_symbol_name, read_variable
+
+# bytes pvPortMalloc() may add to a request, besides the block header, for portBYTE_ALIGNMENT
+MAX_ALIGNMENT_PADDING = 32
+
+
+class ObjectDiscovery:
+    """Finds kernel objects which are not linked into kernel lists, e.g. event groups and stream buffers.
+
+    Candidates are static variables of the storage types, objects pointed to by global handle variables and
+    allocated heap blocks which hold a structure of the type. Variables are found once per objfile, the heap is
+    scanned on the first find() and on rescan(). Candidates are read and validated on every find(), so deleted
+    objects drop out, but objects created after the heap scan are found only by a handle variable or a rescan.
+
+    :param type_name: Name of the object structure type, e.g. 'EventGroup_t'
+    :param storage_types: Type names of static storage of the object, e.g. 'StaticEventGroup_t'
+    :param handle_types: Type names of handles of the object, e.g. 'EventGroupHandle_t'
+    :param is_valid: Function(StructSnapshot) checking a candidate
+    :param in_block: Function(StructSnapshot, payload size) checking a candidate found in a heap block
+    """
+
+    def __init__(self, type_name, storage_types, handle_types, is_valid, in_block):
+        self.reader = StructReader(type_name)
+        self._is_valid = is_valid
+        self._in_block = in_block
+        # {address: variable name} of static objects
+        self._statics = {}
+        for _, storage_type in enumerate(storage_types):
+            for _, name in enumerate(find_variables(storage_type)):
+                try:
+                    addresses = lookup_symbol(name).element_addresses()
+                except TargetError:
+                    continue
+                for i, address in enumerate(addresses):
+                    self._statics[address] = name if len(addresses) == 1 else f'{name}[{i}]'
+        self._handles = [name for storage_type in handle_types for name in find_variables(storage_type)]
+        self._heap = None
+
+    def rescan(self):
+        self._heap = None
+
+    def _scan_heap(self):
+        """Return addresses of allocated heap blocks which hold a valid object"""
+        try:
+            get_struct_layout('BlockLink_t')
+            heap = Heap()
+        except TargetError:
+            return []
+        found = []
+        for _, block in enumerate(heap.blocks):
+            size = block.size - heap.header_size
+            if not block.allocated or size < self.reader.layout.size:
+                continue
+            address = heap.payload(block)
+            # blocks were read with the heap, candidates are decoded without transfers
+            obj = self.reader.decode(address, heap.read(address, self.reader.layout.size))
+            if self._in_block(obj, size) and self._is_valid(obj):
+                found.append(address)
+        return found
+
+    def _get_candidates(self, extra):
+        candidates = dict(self._statics)
+        for _, name in enumerate(self._handles):
+            try:
+                value = read_variable(name)
+            except TargetError:
+                continue
+            values = value if isinstance(value, list) else [value]
+            for i, address in enumerate(values):
+                if address and address not in candidates:
+                    candidates[Address(address)] = name if len(values) == 1 else f'{name}[{i}]'
+        if self._heap is None:
+            self._heap = self._scan_heap()
+        for _, address in enumerate(self._heap):
+            candidates.setdefault(Address(address), '')
+        for _, address in enumerate(extra):
+            candidates.setdefault(Address(address), None)
+        return candidates
+
+    def find(self, extra=()):
+        """Return [(StructSnapshot, name)] of valid objects. Objects in the heap have no name
+
+        :param extra: More candidate addresses, e.g. objects tasks are blocked on
+        """
+        found = []
+        for _, (address, name) in enumerate(self._get_candidates(extra).items()):
+            try:
+                obj = self.reader.read(address)
+            except MemoryReadError:
+                continue
+            if self._is_valid(obj):
+                found.append((obj, name if name is not None else lookup_symbol_name(address) or ''))
+        return found
+
+
+def get_discovery(type_name, storage_types, handle_types, is_valid, in_block):
+    """Return ObjectDiscovery of a type, kept until a new objfile is loaded"""
+    return get_cached(('discovery', type_name),
+                      lambda: ObjectDiscovery(type_name, storage_types, handle_types, is_valid, in_block))
+
+
+def fits_block(obj, size):
+    """Check that a heap block was allocated for the structure alone"""
+    return size < obj.layout.size + MAX_ALIGNMENT_PADDING
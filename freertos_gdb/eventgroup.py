@@ -0,0 +1,114 @@
+# SPDX-FileCopyrightText: 2022 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+#
+# pylint: disable=import-error
+from collections import namedtuple
+from .common import CommandBase, FreeRtosList, gdb, get_arg_parser, open_output, parse_args, write_table
+from .discovery import fits_block, get_discovery
+from .memory import Address, TargetError, get_struct_layout
+from .snapshot import get_snapshot, is_valid_list
+from .task import get_task_ref
+
+EVENTGROUP_HELP = (
+    ('BITS', 'Event bits currently set, uxEventBits.'),
+    ('WAITERS', 'Tasks blocked in xEventGroupWaitBits() or xEventGroupSync(): bits waited for, all or any of them, '
+                'and "clear" if the bits are cleared on exit.'),
+)
+
+
+class EventWaiter(namedtuple('EventWaiter', 'task bits mode')):
+    """Task waiting for event bits and how it waits: 'all' or 'any', with ' clear' if the bits are cleared on exit"""
+
+    def __str__(self):
+        return f'{self.task} {self.bits:#x} {self.mode}'
+
+
+def get_control_bits(layout):
+    """Return (control byte mask, clear on exit bit, wait for all bit) of EventBits_t, see event_groups.c
+
+    The top byte of EventBits_t (and of xItemValue of waiting tasks) is reserved for control bits.
+    """
+    shift = 8 * layout.field('uxEventBits')[1].size - 8
+    return 0xff << shift, 0x01 << shift, 0x04 << shift
+
+
+def is_event_group(group):
+    control_mask = get_control_bits(group.layout)[0]
+    return not group['uxEventBits'] & control_mask and is_valid_list(group, 'xTasksWaitingForBits')
+
+
+def get_event_group_discovery():
+    return get_discovery('EventGroup_t', ('StaticEventGroup_t', 'EventGroup_t'), ('EventGroupHandle_t',),
+                         is_event_group, fits_block)
+
+
+def get_event_groups(snapshot):
+    """Return [(EventGroup_t StructSnapshot, name)] of event groups found in variables, in the heap and blocking
+    tasks"""
+    blocking = []
+    for _, record in enumerate(snapshot.iter_tasks()):
+        blocked_on = snapshot.blocked_on(record.tcb)
+        if blocked_on is not None and blocked_on.kind == 'bits':
+            blocking.append(blocked_on.address)
+    return get_event_group_discovery().find(blocking)
+
+
+def get_waiters(snapshot, group):
+    """Return EventWaiters of the tasks waiting for bits of the group, from their xEventListItem.xItemValue"""
+    control_mask, clear_on_exit, wait_for_all = get_control_bits(group.layout)
+    waiters = []
+    for _, address in enumerate(FreeRtosList(group.field_address('xTasksWaitingForBits'), 'TCB_t')):
+        tcb = snapshot.get_task(address)
+        value = tcb['xEventListItem.xItemValue']
+        mode = 'all' if value & wait_for_all else 'any'
+        if value & clear_on_exit:
+            mode += ' clear'
+        waiters.append(EventWaiter(get_task_ref(tcb), value & ~control_mask, mode))
+    return waiters
+
+
+def get_table_rows(snapshot):
+    rows = []
+    for _, (group, name) in enumerate(get_event_groups(snapshot)):
+        rows.append([Address(group.address), name, Address(group['uxEventBits']), get_waiters(snapshot, group)])
+    return rows
+
+
+def print_help(stream=None):
+    for _, (title, help_) in enumerate(EVENTGROUP_HELP):
+        print(title + '\t - ' + help_, file=stream)
+    print('', file=stream)
+
+
+def show(fmt='table', output=None, fixed_width=None, rescan=False):
+    try:
+        get_struct_layout('EventGroup_t')
+    except TargetError as err:
+        raise TargetError('No event groups in the program: EventGroup_t is not found') from err
+    if rescan:
+        get_event_group_discovery().rescan()
+    rows = get_table_rows(get_snapshot())
+    with open_output(output) as stream:
+        if fmt == 'table':
+            print_help(stream)
+        write_table(rows, ['ID', 'NAME'] + [title for title, _ in EVENTGROUP_HELP], fmt, stream, fixed_width)
+
+
+class FreeRtosEventGroup(CommandBase):
+    """ Generate a print out of event groups, their bits and waiting tasks.
+    """
+
+    def __init__(self):
+        super().__init__('freertos eventgroup', gdb.COMMAND_USER)
+        self._parser = get_arg_parser('freertos eventgroup', self.__doc__)
+        self._parser.add_argument('--rescan', action='store_true',
+                                  help='Scan the heap again for event groups created since the previous scan.')
+
+    def invoke(self, arg, _):
+        args = parse_args(self._parser, arg)
+        if args is None:
+            return
+        try:
+            show(args.format, args.output, args.fixed_width, args.rescan)
+        except TargetError as err:
+            print(err)
@@ -0,0 +1,317 @@
+# SPDX-FileCopyrightText: 2022 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+#
+# pylint: disable=import-error
+from collections import namedtuple
+from .common import CommandBase, gdb, get_arg_parser, open_output, parse_args, write_table
+from .memory import Address, StructReader, StructSnapshot, TargetError, get_struct_layout, lookup_symbol, \
+    read_memory, read_variable, target_byteorder
+from .snapshot import get_snapshot
+from .task import get_task_ref
+
+# heap regions are read with transfers of this size
+READ_CHUNK = 64 * 1024
+# bound of free list walks of heap_5, the list may be corrupted
+MAX_FREE_BLOCKS = 10000
+# candidates of portBYTE_ALIGNMENT
+ALIGNMENTS = (4, 8, 16, 32)
+
+HEAP_HELP = (
+    ('TYPE', 'Kind of the owner: task (TCB and stack), queue or semaphore (Queue_t and storage), event group, '
+             'timer, or unknown.'),
+    ('BLOCKS', 'Number of allocated blocks.'),
+    ('BYTES', 'Allocated bytes, block headers included.'),
+)
+
+ESP_HEAP_HELP = (
+    ('SIZE', 'Size of the heap region in bytes.'),
+    ('FREE', 'Free bytes now.'),
+    ('MIN_FREE', 'Minimum of free bytes since boot.'),
+)
+
+HeapBlock = namedtuple('HeapBlock', 'address size allocated')
+Owner = namedtuple('Owner', 'type name')
+
+
+def align_up(address, alignment):
+    return (address + alignment - 1) & ~(alignment - 1)
+
+
+class Heap:
+    """Blocks of a heap_4 or heap_5 heap.
+
+    Every block starts with a BlockLink_t whose xBlockSize has the top bit set while the block is allocated. The
+    heap regions are read with a few large transfers and the block chain is decoded from them.
+
+    portBYTE_ALIGNMENT is not in the debug info. Unless given, it is probed: the largest candidate all block
+    addresses and sizes are aligned to, see _probe(). xHeapStructSize narrows the candidates if it is not optimized
+    out.
+
+    :param alignment: portBYTE_ALIGNMENT of the port, probed if None
+    """
+
+    def __init__(self, alignment=None):
+        self.reader = StructReader('BlockLink_t')
+        size_field = self.reader.layout.fields['xBlockSize']
+        self.allocated_bit = 1 << (8 * size_field.size - 1)
+        self.alignments = (alignment,) if alignment else ALIGNMENTS
+        try:
+            header_size = read_variable('xHeapStructSize')
+            self.alignments = [candidate for candidate in self.alignments
+                               if align_up(self.reader.layout.size, candidate) == header_size] or self.alignments
+        except TargetError:
+            pass
+        self.alignment = None
+        # xHeapStructSize, sizeof(BlockLink_t) rounded up to portBYTE_ALIGNMENT, set by _probe()
+        self.header_size = None
+        self.end = read_variable('pxEnd')
+        # (start address, bytes) of heap regions read from the target
+        self.regions = []
+        try:
+            lookup_symbol('ucHeap')
+            self.variant = 'heap_4'
+            self.blocks = self._walk_heap_4()
+        except TargetError:
+            self.variant = 'heap_5'
+            self.blocks = self._walk_heap_5()
+
+    def _read_region(self, start, end):
+        data = b''.join(read_memory(address, min(READ_CHUNK, end - address))
+                        for address in range(start, end, READ_CHUNK))
+        self.regions.append((start, data))
+        return data
+
+    def read(self, address, size):
+        """Return heap memory from the regions already read, without a target transfer"""
+        for _, (start, data) in enumerate(self.regions):
+            if start <= address and address + size <= start + len(data):
+                return data[address - start:address - start + size]
+        return read_memory(address, size)
+
+    def _walk(self, start, end, data, data_start):
+        """Return blocks from start to the end marker at end, decoded from data read at data_start"""
+        blocks = []
+        address = start
+        header_size = self.reader.layout.size
+        while address < end:
+            offset = address - data_start
+            header = self.reader.decode(address, data[offset:offset + header_size])
+            size = header['xBlockSize']
+            allocated = bool(size & self.allocated_bit)
+            size &= ~self.allocated_bit
+            if size < self.header_size or address + size > end:
+                raise TargetError(f'Heap block at {address:#x} is corrupted, size: {size}')
+            blocks.append(HeapBlock(Address(address), size, allocated))
+            address += size
+        return blocks
+
+    def _probe(self, walk):
+        """Return blocks of walk(alignment) with the largest alignment candidate the blocks agree with.
+
+        heap_4 and heap_5 align every block address and size to portBYTE_ALIGNMENT.
+        """
+        error = None
+        for _, alignment in enumerate(sorted(self.alignments, reverse=True)):
+            self.header_size = align_up(self.reader.layout.size, alignment)
+            try:
+                blocks = walk(alignment)
+            except TargetError as err:
+                error = error or err
+                continue
+            if len(self.alignments) == 1 or \
+                    all(block.address % alignment == 0 and block.size % alignment == 0 for block in blocks):
+                self.alignment = alignment
+                return blocks
+        raise error or TargetError('Heap blocks are not aligned to any of '
+                                   f'{", ".join(str(alignment) for alignment in self.alignments)} bytes')
+
+    def _walk_heap_4(self):
+        heap = lookup_symbol('ucHeap')
+        data = self._read_region(heap.address, self.end)
+        # the first block is ucHeap aligned to portBYTE_ALIGNMENT
+        return self._probe(lambda alignment: self._walk(align_up(heap.address, alignment), self.end, data,
+                                                        heap.address))
+
+    def _walk_heap_5(self):
+        """Walk every region from its first free block. Allocated blocks before it are not found.
+
+        Regions are found from the free list: end markers of all regions but the last one are in the list.
+        """
+        regions = []
+        block = self.reader.read(lookup_symbol('xStart').address)['pxNextFreeBlock']
+        start = block
+        for _ in range(MAX_FREE_BLOCKS):
+            if block == 0:
+                break
+            header = self.reader.read(block)
+            if block == self.end or header['xBlockSize'] == 0:
+                regions.append((start, block, self._read_region(start, block)))
+                start = header['pxNextFreeBlock']
+            block = header['pxNextFreeBlock']
+        return self._probe(lambda _: [block for start, end, data in regions
+                                      for block in self._walk(start, end, data, start)])
+
+    @property
+    def partial(self):
+        """True if allocated blocks may be missing, see _walk_heap_5()"""
+        return self.variant == 'heap_5'
+
+    @property
+    def free_blocks(self):
+        return [block for block in self.blocks if not block.allocated]
+
+    def payload(self, block):
+        """Address returned by pvPortMalloc() for the block"""
+        return Address(block.address + self.header_size)
+
+
+def get_owners(snapshot):
+    """Return {heap allocation address: Owner} of kernel objects"""
+    owners = {}
+    for _, record in enumerate(snapshot.iter_tasks()):
+        owner = Owner('task', get_task_ref(record.tcb))
+        owners[record.tcb.address] = owner
+        owners[record.tcb['pxStack']] = owner
+        blocked_on = snapshot.blocked_on(record.tcb)
+        obj = snapshot.containers.get_object(blocked_on.address) if blocked_on is not None else None
+        if obj is not None:
+            owners[obj.address] = Owner(get_object_type(obj), blocked_on.name or Address(obj.address))
+    try:
+        for _, record in enumerate(snapshot.iter_queues()):
+            owners[record.queue.address] = Owner(get_object_type(record.queue), record.name)
+    except TargetError:
+        pass
+    try:
+        for _, record in enumerate(snapshot.iter_timers()):
+            owners[record.timer.address] = Owner('timer', record.timer.string('pcTimerName'))
+    except TargetError:
+        pass
+    return owners
+
+
+def get_object_type(obj):
+    if obj.layout.name == 'EventGroup_t':
+        return 'event group'
+    return 'semaphore' if obj['uxItemSize'] == 0 else 'queue'
+
+
+def get_owner_rows(heap, owners):
+    totals = {}
+    for _, block in enumerate(heap.blocks):
+        if not block.allocated:
+            continue
+        owner = owners.get(heap.payload(block), Owner('unknown', ''))
+        blocks, size = totals.get(owner, (0, 0))
+        totals[owner] = (blocks + 1, size + block.size)
+    rows = [[owner.name, owner.type, blocks, size] for owner, (blocks, size) in totals.items()]
+    return sorted(rows, key=lambda row: -row[3])
+
+
+def get_block_rows(heap, owners):
+    rows = []
+    for _, block in enumerate(heap.blocks):
+        owner = owners.get(heap.payload(block), Owner('unknown', '')) if block.allocated else Owner('', '')
+        rows.append([heap.payload(block), block.size, 'used' if block.allocated else 'free', owner.name, owner.type])
+    return rows
+
+
+def print_partial_note(heap, stream=None):
+    if heap.partial:
+        print('Note: heap_5 regions are walked from their first free block, blocks allocated before it are not '
+              'found. Allocated bytes and per-owner totals are partial.', file=stream)
+
+
+def print_summary(heap, stream=None):
+    free = sum(block.size for block in heap.free_blocks)
+    largest = max((block.size for block in heap.free_blocks), default=0)
+    print(f'Heap: {heap.variant}, alignment: {heap.alignment}, blocks: {len(heap.blocks)}, '
+          f'allocated{" (partial)" if heap.partial else ""}: '
+          f'{sum(block.size for block in heap.blocks if block.allocated)}', file=stream)
+    print(f'Free: {free} in {len(heap.free_blocks)} blocks, largest free block: {largest}, '
+          f'fragmentation: {round(100 * (1 - largest / free), 1) if free else 0}%', file=stream)
+    for _, name in enumerate(('xFreeBytesRemaining', 'xMinimumEverFreeBytesRemaining')):
+        try:
+            print(f'{name}: {read_variable(name)}', file=stream)
+        except TargetError:
+            pass
+    print('', file=stream)
+
+
+def print_help(help_, stream=None):
+    for _, (title, text) in enumerate(help_):
+        print(title + '\t - ' + text, file=stream)
+    print('', file=stream)
+
+
+def get_esp_heap_rows():
+    """Return rows of heap regions registered with ESP-IDF heap_caps. Only totals kept by multi_heap are read"""
+    symbol = lookup_symbol('registered_heaps')
+    heap_reader = StructReader('struct heap_t_')
+    info_reader = StructReader('struct multi_heap_info')
+    registered = StructSnapshot(symbol.type.layout, symbol.address, read_memory(symbol.address, symbol.type.size),
+                                target_byteorder())
+    rows = []
+    address = registered['slh_first']
+    while address != 0 and len(rows) < MAX_FREE_BLOCKS:
+        heap = heap_reader.read(address)
+        info = info_reader.read(heap['heap'])
+        rows.append([Address(heap['start']), Address(heap['end']), heap['end'] - heap['start'], info['free_bytes'],
+                     info['minimum_free_bytes']])
+        address = heap['next.sle_next']
+    return rows
+
+
+def show_esp_heaps(fmt='table', output=None, fixed_width=None):
+    rows = get_esp_heap_rows()
+    with open_output(output) as stream:
+        if fmt == 'table':
+            print_help(ESP_HEAP_HELP, stream)
+        write_table(rows, ['START', 'END'] + [title for title, _ in ESP_HEAP_HELP], fmt, stream, fixed_width)
+
+
+def show(fmt='table', output=None, fixed_width=None, blocks=False, alignment=None):
+    try:
+        get_struct_layout('BlockLink_t')
+    except TargetError:
+        try:
+            lookup_symbol('registered_heaps')
+        except TargetError as err:
+            raise TargetError('No heap found: neither BlockLink_t of heap_4/heap_5 nor registered_heaps of '
+                              'ESP-IDF heap_caps is in the program') from err
+        show_esp_heaps(fmt, output, fixed_width)
+        return
+    heap = Heap(alignment)
+    owners = get_owners(get_snapshot())
+    with open_output(output) as stream:
+        if fmt == 'table':
+            print_partial_note(heap, stream)
+        if blocks:
+            write_table(get_block_rows(heap, owners), ['ADDRESS', 'SIZE', 'STATE', 'OWNER', 'TYPE'], fmt, stream,
+                        fixed_width)
+            return
+        if fmt == 'table':
+            print_summary(heap, stream)
+            print_help(HEAP_HELP, stream)
+        write_table(get_owner_rows(heap, owners), ['OWNER'] + [title for title, _ in HEAP_HELP], fmt, stream,
+                    fixed_width)
+
+
+class FreeRtosHeap(CommandBase):
+    """ Generate a print out of heap usage per owner, free space and fragmentation.
+    """
+
+    def __init__(self):
+        super().__init__('freertos heap', gdb.COMMAND_USER)
+        self._parser = get_arg_parser('freertos heap', self.__doc__)
+        self._parser.add_argument('--blocks', action='store_true', help='Print every heap block instead of totals.')
+        self._parser.add_argument('--alignment', type=int, choices=ALIGNMENTS,
+                                  help='portBYTE_ALIGNMENT of the port. Default: probed from the heap blocks.')
+
+    def invoke(self, arg, _):
+        args = parse_args(self._parser, arg)
+        if args is None:
+            return
+        try:
+            show(args.format, args.output, args.fixed_width, args.blocks, args.alignment)
+        except TargetError as err:
+            print(err)
@@ -0,0 +1,397 @@
+# SPDX-FileCopyrightText: 2022 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+#
+# Recording of kernel objects at every stop into a compact binary file, and comparison of any two stops:
+#
+#   (gdb) freertos record session.frh
+#   (gdb) freertos diff session.frh 10 11
+#   python -m freertos_gdb.history session.frh diff 10 11
+#
+# The file is a header followed by frames. A frame is a 4 byte tag, the payload size and the payload:
+#
+#   STRS  strings added to the string table: (u16 size, UTF-8 bytes)...; string ids are table indexes
+#   STOP  one stop: STOP_HEADER, then TASK, QUEUE and TIMER structures, names and states are string ids
+#
+# All numbers are little endian. Frames are only appended, a session may be continued in the same file. A frame
+# cut by a crash is ignored by readers and overwritten when recording continues.
+# pylint: disable=import-error
+import struct
+import sys
+import time
+from collections import namedtuple
+from .common import CommandBase, gdb, get_arg_parser, open_output, parse_args, write_table
+from .memory import Address, TargetError, read_string
+from .snapshot import get_snapshot
+from .task import TaskProperty
+from .watch import WATCH_HEADERS, Watcher, start, stop
+
+MAGIC = b'FRTOSREC'
+VERSION = 2
+FILE_HEADER = struct.Struct('<8sH')
+FRAME_HEADER = struct.Struct('<4sI')
+STRING_SIZE = struct.Struct('<H')
+# host time, tick count, number of tasks, queues and timers
+STOP_HEADER = struct.Struct('<dQHHH')
+# priorities and list lengths are UBaseType_t, 32 bits on all ports
+TASK = struct.Struct('<QIIIIbIIQ')
+QUEUE = struct.Struct('<QIIIIIIIQ')
+TIMER = struct.Struct('<QIQQBB')
+
+StopHeader = namedtuple('StopHeader', 'time tick_count tasks queues timers')
+# name, state, type and blocked_on are string ids in the file and strings once read
+TaskState = namedtuple('TaskState', 'address name state priority base_priority cpu blocked_on stack_free run_time')
+QueueState = namedtuple('QueueState', 'address name type waiting length item_size senders receivers holder')
+TimerState = namedtuple('TimerState', 'address name period expiry overflow status')
+Stop = namedtuple('Stop', 'header tasks queues timers')
+
+# fields compared by diff, reported in the CHANGE column like the changes printed by --watch
+TASK_CHANGES = ('state', 'priority', 'base_priority', 'cpu', 'blocked_on', 'stack_free', 'run_time')
+QUEUE_CHANGES = ('waiting', 'senders', 'receivers', 'holder')
+TIMER_CHANGES = ('period', 'expiry', 'overflow', 'status')
+
+
+class StringTable:
+    """Interned strings of a history file. Id 0 is the empty string"""
+
+    def __init__(self):
+        self.strings = ['']
+        self._ids = {'': 0}
+        self._pending = []
+
+    def intern(self, string):
+        string_id = self._ids.get(string)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.add(string)
+            self._pending.append(string)
+        return string_id
+
+    def add(self, string):
+        self._ids[string] = len(self.strings)
+        self.strings.append(string)
+
+    def pop_frame(self):
+        """Return the STRS frame of strings interned since the previous call, or b''"""
+        if not self._pending:
+            return b''
+        payload = b''
+        for _, string in enumerate(self._pending):
+            data = string.encode('utf-8')[:0xffff]
+            payload += STRING_SIZE.pack(len(data)) + data
+        self._pending = []
+        return FRAME_HEADER.pack(b'STRS', len(payload)) + payload
+
+    def load_frame(self, payload):
+        offset = 0
+        while offset < len(payload):
+            size = STRING_SIZE.unpack_from(payload, offset)[0]
+            offset += STRING_SIZE.size
+            self.add(payload[offset:offset + size].decode('utf-8', errors='replace'))
+            offset += size
+
+
+class HistoryFile:
+    """Index of a history file: the string table and offsets of STOP frames. Stops are decoded on demand.
+
+    end is the offset after the last complete frame, data beyond it is a frame cut by a crash.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.strings = StringTable()
+        self.stops = []
+        with open(path, 'rb') as stream:
+            self.data = stream.read()
+        if len(self.data) < FILE_HEADER.size or FILE_HEADER.unpack_from(self.data)[0] != MAGIC:
+            raise TargetError(f'{path} is not a freertos history file')
+        version = FILE_HEADER.unpack_from(self.data)[1]
+        if version != VERSION:
+            raise TargetError(f'{path} has format version {version}, {VERSION} is supported')
+        offset = FILE_HEADER.size
+        while offset + FRAME_HEADER.size <= len(self.data):
+            tag, size = FRAME_HEADER.unpack_from(self.data, offset)
+            payload = offset + FRAME_HEADER.size
+            if payload + size > len(self.data):
+                # the last frame was not written completely
+                break
+            if tag == b'STRS':
+                self.strings.load_frame(self.data[payload:payload + size])
+            elif tag == b'STOP':
+                self.stops.append(payload)
+            offset = payload + size
+        self.end = offset
+
+    def get_stop(self, index):
+        """Return the Stop by its index, negative indexes count from the last stop"""
+        try:
+            offset = self.stops[index]
+        except IndexError:
+            raise TargetError(f'No stop {index} in {self.path}, it has {len(self.stops)} stops') from None
+        header = StopHeader(*STOP_HEADER.unpack_from(self.data, offset))
+        offset += STOP_HEADER.size
+        strings = self.strings.strings
+        tasks = []
+        for _ in range(header.tasks):
+            task = TaskState(*TASK.unpack_from(self.data, offset))
+            tasks.append(task._replace(name=strings[task.name], state=strings[task.state],
+                                       blocked_on=strings[task.blocked_on]))
+            offset += TASK.size
+        queues = []
+        for _ in range(header.queues):
+            queue = QueueState(*QUEUE.unpack_from(self.data, offset))
+            queues.append(queue._replace(name=strings[queue.name], type=strings[queue.type]))
+            offset += QUEUE.size
+        timers = []
+        for _ in range(header.timers):
+            timer = TimerState(*TIMER.unpack_from(self.data, offset))
+            timers.append(timer._replace(name=strings[timer.name]))
+            offset += TIMER.size
+        return Stop(header, tasks, queues, timers)
+
+    def get_list_rows(self):
+        rows = []
+        for index in range(len(self.stops)):
+            header = StopHeader(*STOP_HEADER.unpack_from(self.data, self.stops[index]))
+            rows.append([index, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(header.time)), header.tick_count,
+                         header.tasks, header.queues, header.timers])
+        return rows
+
+
+def pack_record(record, kind, address, *values):
+    """Return a packed record, or None if a value does not fit its field, e.g. of a corrupted structure"""
+    try:
+        return record.pack(address, *values)
+    except struct.error as err:
+        print(f'Record: {kind} at {address:#x} is not recorded, a value is out of range: {err}')
+        return None
+
+
+def get_queue_type(queue):
+    if queue['pcHead'] == 0:
+        # queueQUEUE_IS_MUTEX
+        return 'mutex'
+    return 'semaphore' if queue['uxItemSize'] == 0 else 'queue'
+
+
+class Recorder(Watcher):
+    """Appends a STOP frame of the current snapshot to a history file on every halt.
+
+    Prints only objects which cannot be recorded.
+    """
+
+    title = 'Record'
+
+    def __init__(self, path):
+        self.path = path
+        self.strings = StringTable()
+        # timer names by pcTimerName, names are not read again on every stop
+        self._timer_names = {}
+        try:
+            history = HistoryFile(path)
+        except FileNotFoundError:
+            with open(path, 'wb') as stream:
+                stream.write(FILE_HEADER.pack(MAGIC, VERSION))
+        else:
+            # continue the string table of the file, after its last complete frame
+            self.strings = history.strings
+            if history.end < len(history.data):
+                with open(path, 'r+b') as stream:
+                    stream.truncate(history.end)
+        self.stops = 0
+
+    def _get_task_records(self, snapshot):
+        current_tcbs = snapshot.current_tcbs
+        records = []
+        for _, record in enumerate(snapshot.iter_tasks()):
+            tcb = record.tcb
+            blocked_on = snapshot.blocked_on(tcb)
+            records.append(pack_record(TASK, 'task', tcb.address,
+                                       self.strings.intern(TaskProperty.NAME.get_string_val(tcb)),
+                                       self.strings.intern(record.state), tcb['uxPriority'],
+                                       tcb['uxBasePriority'] if tcb.layout.has_field('uxBasePriority') else 0,
+                                       current_tcbs.index(tcb.address) if tcb.address in current_tcbs else -1,
+                                       self.strings.intern(str(blocked_on) if blocked_on is not None else ''),
+                                       TaskProperty.SL.get_sl_val(tcb),
+                                       tcb['ulRunTimeCounter'] if tcb.layout.has_field('ulRunTimeCounter') else 0))
+        return [record for record in records if record is not None]
+
+    def _get_queue_records(self, snapshot):
+        records = []
+        try:
+            for _, record in enumerate(snapshot.iter_queues()):
+                queue = record.queue
+                queue_type = get_queue_type(queue)
+                records.append(pack_record(QUEUE, 'queue', queue.address, self.strings.intern(record.name),
+                                           self.strings.intern(queue_type), queue['uxMessagesWaiting'],
+                                           queue['uxLength'], queue['uxItemSize'], record.snd_list.length,
+                                           record.rcv_list.length,
+                                           queue['u.xSemaphore.xMutexHolder'] if queue_type == 'mutex' else 0))
+        except TargetError:
+            pass
+        return [record for record in records if record is not None]
+
+    def _get_timer_records(self, snapshot):
+        records = []
+        try:
+            for _, record in enumerate(snapshot.iter_timers()):
+                timer = record.timer
+                pointer = timer['pcTimerName']
+                if pointer not in self._timer_names:
+                    self._timer_names[pointer] = read_string(pointer) if pointer else ''
+                records.append(pack_record(TIMER, 'timer', timer.address,
+                                           self.strings.intern(self._timer_names[pointer]),
+                                           timer['xTimerPeriodInTicks'], timer['xTimerListItem.xItemValue'],
+                                           record.overflow,
+                                           timer['ucStatus'] if timer.layout.has_field('ucStatus') else 0))
+        except TargetError:
+            pass
+        return [record for record in records if record is not None]
+
+    def poll(self):
+        snapshot = get_snapshot()
+        tasks = self._get_task_records(snapshot)
+        queues = self._get_queue_records(snapshot)
+        timers = self._get_timer_records(snapshot)
+        try:
+            tick_count = snapshot.tick_count
+        except TargetError:
+            tick_count = 0
+        payload = b''.join([STOP_HEADER.pack(time.time(), tick_count, len(tasks), len(queues), len(timers))] +
+                           tasks + queues + timers)
+        # strings go first, a reader knows them before the stop which uses them
+        with open(self.path, 'ab') as stream:
+            stream.write(self.strings.pop_frame() + FRAME_HEADER.pack(b'STOP', len(payload)) + payload)
+        self.stops += 1
+        return []
+
+
+def diff_objects(kind, old, new, changes):
+    """Return change rows of objects of one kind, matched by address"""
+    rows = []
+    old_objects = {obj.address: obj for obj in old}
+    new_objects = {obj.address: obj for obj in new}
+    for _, obj in enumerate(new):
+        previous = old_objects.get(obj.address)
+        if previous is None:
+            rows.append([Address(obj.address), obj.name, f'{kind} created', '', ''])
+            continue
+        for _, field in enumerate(changes):
+            old_value = getattr(previous, field)
+            new_value = getattr(obj, field)
+            if old_value != new_value:
+                if field == 'holder':
+                    old_value, new_value = Address(old_value), Address(new_value)
+                rows.append([Address(obj.address), obj.name, field, old_value, new_value])
+    for _, obj in enumerate(old):
+        if obj.address not in new_objects:
+            rows.append([Address(obj.address), obj.name, f'{kind} deleted', '', ''])
+    return rows
+
+
+def get_diff_rows(old, new):
+    return (diff_objects('task', old.tasks, new.tasks, TASK_CHANGES) +
+            diff_objects('queue', old.queues, new.queues, QUEUE_CHANGES) +
+            diff_objects('timer', old.timers, new.timers, TIMER_CHANGES))
+
+
+def show_diff(path, first, second=None, fmt='table', output=None, fixed_width=None):
+    """Print changes from stop first to stop second, by default to the stop after first"""
+    history = HistoryFile(path)
+    if second is None:
+        # -1 has no stop after it, len(stops) is reported as a missing stop
+        second = first % max(len(history.stops), 1) + 1
+    old = history.get_stop(first)
+    new = history.get_stop(second)
+    rows = get_diff_rows(old, new)
+    with open_output(output) as stream:
+        if fmt == 'table':
+            print(f'Stop {first} (tick {old.header.tick_count}) -> stop {second} (tick {new.header.tick_count}): '
+                  f'{new.header.tick_count - old.header.tick_count} ticks, '
+                  f'{round(new.header.time - old.header.time, 3)} s', file=stream)
+            if not rows:
+                print('No changes', file=stream)
+                return
+        write_table(rows, WATCH_HEADERS, fmt, stream, fixed_width)
+
+
+def show_stops(path, fmt='table', output=None, fixed_width=None):
+    history = HistoryFile(path)
+    with open_output(output) as stream:
+        if fmt == 'table':
+            print(f'{path}: {len(history.stops)} stops, {len(history.strings.strings)} strings, '
+                  f'{len(history.data)} bytes', file=stream)
+        write_table(history.get_list_rows(), ['STOP', 'TIME', 'TICK', 'TASKS', 'QUEUES', 'TIMERS'], fmt, stream,
+                    fixed_width)
+
+
+class FreeRtosRecord(CommandBase):
+    """ Append tasks, queues and timers to a history file on every halt, for freertos diff.
+    """
+
+    def __init__(self):
+        super().__init__('freertos record', gdb.COMMAND_USER)
+        self._parser = get_arg_parser('freertos record', self.__doc__)
+        group = self._parser.add_mutually_exclusive_group(required=True)
+        group.add_argument('file', nargs='?', help='History file. Created if it does not exist, appended otherwise.')
+        group.add_argument('--stop', action='store_true', help='Stop recording.')
+
+    def invoke(self, arg, _):
+        args = parse_args(self._parser, arg)
+        if args is None:
+            return
+        if args.stop:
+            stop('record')
+            return
+        try:
+            recorder = Recorder(args.file)
+        except (OSError, TargetError) as err:
+            print(err)
+            return
+        # the current stop is recorded too
+        start('record', recorder)
+        print(f'Recording to {args.file}')
+
+
+class FreeRtosDiff(CommandBase):
+    """ Compare tasks, queues and timers of two stops of a history file written by freertos record.
+    """
+
+    def __init__(self):
+        super().__init__('freertos diff', gdb.COMMAND_USER)
+        self._parser = get_arg_parser('freertos diff', self.__doc__)
+        add_diff_arguments(self._parser)
+
+    def invoke(self, arg, _):
+        args = parse_args(self._parser, arg)
+        if args is None:
+            return
+        run_diff(args)
+
+
+def add_diff_arguments(parser):
+    parser.add_argument('file', help='History file.')
+    parser.add_argument('first', type=int, nargs='?', help='Index of the older stop, negative counts from the end.')
+    parser.add_argument('second', type=int, nargs='?', help='Index of the newer stop. Default: the stop after FIRST.')
+
+
+def run_diff(args):
+    """List the stops of the file, or print changes between two of them"""
+    try:
+        if args.first is None:
+            show_stops(args.file, args.format, args.output, args.fixed_width)
+        else:
+            show_diff(args.file, args.first, args.second, args.format, args.output, args.fixed_width)
+    except (OSError, TargetError) as err:
+        print(err)
+
+
+def main(argv=None):
+    parser = get_arg_parser('python -m freertos_gdb.history',
+                            'List the stops of a history file written by "freertos record", or compare two of them.')
+    add_diff_arguments(parser)
+    run_diff(parser.parse_args(argv))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,513 @@
+# SPDX-FileCopyrightText: 2022 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+#
+# pylint: disable=import-error
+import enum
+import struct
+from collections import namedtuple
+
+try:
+    import gdb
+except ImportError:
+    # running outside of GDB, memory and types come from an offline backend (see offline.py)
+    gdb = None
+
+
+class TargetError(Exception):
+    """Base class of errors raised by memory backends"""
+
+
+class SymbolNotFound(TargetError):
+    pass
+
+
+class TypeNotFound(TargetError):
+    pass
+
+
+class MemoryReadError(TargetError):
+    pass
+
+
+class Address(int):
+    """Target memory address. Printed in hex like gdb prints pointers"""
+
+    def __str__(self):
+        return hex(self)
+
+
+class CodeAddress(Address):
+    """Address of a function. Printed with its symbol like gdb prints function pointers"""
+
+    def __new__(cls, value, symbol=None):
+        obj = super().__new__(cls, value)
+        obj.symbol = symbol
+        return obj
+
+    def __str__(self):
+        if self.symbol:
+            return f'{hex(self)} <{self.symbol}>'
+        return hex(self)
+
+
+class TypeCode(enum.Enum):
+    INT = 'int'
+    FLT = 'float'
+    PTR = 'pointer'
+    ARRAY = 'array'
+    STRUCT = 'struct'
+    OTHER = 'other'
+
+
+class FieldLayout:
+    """Describes how to find and decode a structure field in a raw memory block
+
+    :param name: Field name
+    :param offset: Offset of the field in bytes from the beginning of the structure
+    :param size: Size of the field in bytes
+    :param code: Decoding class of the field
+    :param signed: True if the integer field is signed
+    :param element: Layout of an array element (arrays only)
+    :param layout: Layout of a nested structure or union (structs only)
+    :param bitpos: Bit offset inside the first byte (bitfields only)
+    :param bitsize: Width in bits (bitfields only)
+    """
+
+    def __init__(self, name, offset, size, code, signed=False, element=None, layout=None, bitpos=0, bitsize=0):
+        self.name = name
+        self.offset = offset
+        self.size = size
+        self.code = code
+        self.signed = signed
+        self.element = element
+        self.layout = layout
+        self.bitpos = bitpos
+        self.bitsize = bitsize
+
+    @property
+    def count(self):
+        """Number of array elements"""
+        if self.code is not TypeCode.ARRAY or not self.element.size:
+            return 0
+        return self.size // self.element.size
+
+    def decode(self, data, offset, byteorder):
+        start = offset + self.offset
+        raw = data[start:start + self.size]
+        if self.code is TypeCode.INT:
+            val = int.from_bytes(raw, byteorder, signed=self.signed and not self.bitsize)
+            if self.bitsize:
+                val = (val >> self.bitpos) & ((1 << self.bitsize) - 1)
+                if self.signed and val >> (self.bitsize - 1):
+                    val -= 1 << self.bitsize
+            return val
+        if self.code is TypeCode.PTR:
+            return Address(int.from_bytes(raw, byteorder))
+        if self.code is TypeCode.FLT:
+            fmt = ('>' if byteorder == 'big' else '<') + ('f' if self.size == 4 else 'd')
+            return struct.unpack(fmt, raw)[0]
+        if self.code is TypeCode.ARRAY and self.element.size and self.element.code in (TypeCode.INT, TypeCode.PTR):
+            return [self.element.decode(data, start + i, byteorder)
+                    for i in range(0, self.size - self.element.size + 1, self.element.size)]
+        return bytes(raw)
+
+
+class StructLayout:
+    """Field offsets, sizes and decoding classes of a structure type.
+
+    Nested fields are accessed with a dotted path, e.g. 'xStateListItem.pvContainer'.
+    """
+
+    def __init__(self, name, size, fields):
+        self.name = name
+        self.size = size
+        self.fields = fields
+
+    def field(self, path):
+        """Return (absolute offset, FieldLayout) of a field or raise KeyError"""
+        layout = self
+        offset = 0
+        names = path.split('.')
+        for i, name in enumerate(names):
+            field = layout.fields[name]
+            if i == len(names) - 1:
+                return offset, field
+            if field.layout is None:
+                raise KeyError(path)
+            offset += field.offset
+            layout = field.layout
+        raise KeyError(path)
+
+    def has_field(self, path):
+        if '.' not in path:
+            return path in self.fields
+        try:
+            self.field(path)
+        except KeyError:
+            return False
+        return True
+
+
+class StructSnapshot:
+    """Structure read from target memory as one block. Fields are decoded locally without target access
+
+    :param layout: StructLayout of the structure
+    :param address: Address the structure was read from
+    :param data: Raw structure bytes
+    :param byteorder: Target byte order, 'little' or 'big'
+    """
+
+    def __init__(self, layout, address, data, byteorder):
+        self.layout = layout
+        self.address = Address(address)
+        self.data = data
+        self.byteorder = byteorder
+
+    def __getitem__(self, path):
+        offset, field = self.layout.field(path)
+        return field.decode(self.data, offset, self.byteorder)
+
+    def field_address(self, path):
+        offset, field = self.layout.field(path)
+        return Address(self.address + offset + field.offset)
+
+    def raw(self, path):
+        offset, field = self.layout.field(path)
+        start = offset + field.offset
+        return self.data[start:start + field.size]
+
+    def string(self, path):
+        """Decode a NUL terminated char array field or read the string a char pointer field points to"""
+        _, field = self.layout.field(path)
+        if field.code is TypeCode.PTR:
+            address = self[path]
+            return read_string(address) if address else ''
+        return self.raw(path).split(b'\0', 1)[0].decode('utf-8', errors='replace')
+
+
+class Symbol(namedtuple('Symbol', 'name address type')):
+    """Global variable of the target program
+
+    :param name: Variable name
+    :param address: Variable address
+    :param type: FieldLayout of the variable type
+    """
+
+    def element_addresses(self):
+        """Addresses of array elements. A non-array variable is a single element"""
+        if self.type.code is not TypeCode.ARRAY:
+            return [Address(self.address)]
+        return [Address(self.address + i * self.type.element.size) for i in range(self.type.count)]
+
+
+class Backend:
+    """Source of target memory, types and symbols. Everything in freertos_gdb reads the target through it"""
+
+    byteorder = 'little'
+
+    def read_memory(self, address, size):
+        raise NotImplementedError
+
+    def get_struct_layout(self, type_name):
+        raise NotImplementedError
+
+    def get_type_layout(self, type_name):
+        """Return FieldLayout of any type: an integer, float, pointer, array or structure"""
+        raise NotImplementedError
+
+    def lookup_symbol(self, name):
+        raise NotImplementedError
+
+    def lookup_symbol_name(self, address):
+        raise NotImplementedError
+
+    def find_variables(self, type_name):
+        """Return names of global variables (or arrays of them) declared with a type name, e.g. a typedef"""
+        raise NotImplementedError
+
+
+_GDB_TYPE_CODES = {
+    'TYPE_CODE_INT': TypeCode.INT,
+    'TYPE_CODE_CHAR': TypeCode.INT,
+    'TYPE_CODE_BOOL': TypeCode.INT,
+    'TYPE_CODE_ENUM': TypeCode.INT,
+    'TYPE_CODE_FLT': TypeCode.FLT,
+    'TYPE_CODE_PTR': TypeCode.PTR,
+    'TYPE_CODE_ARRAY': TypeCode.ARRAY,
+    'TYPE_CODE_STRUCT': TypeCode.STRUCT,
+    'TYPE_CODE_UNION': TypeCode.STRUCT,
+}
+
+
+class GdbBackend(Backend):
+    """Reads the inferior of the running GDB"""
+
+    def __init__(self):
+        self._type_codes = {getattr(gdb, name): code for name, code in _GDB_TYPE_CODES.items()}
+        endian = gdb.execute('show endian', to_string=True)
+        self.byteorder = 'big' if 'big endian' in endian else 'little'
+
+    @staticmethod
+    def _is_signed(gdb_type):
+        signed = getattr(gdb_type, 'is_signed', None)  # available since GDB 12
+        if signed is not None:
+            return signed
+        return int(gdb.Value(-1).cast(gdb_type)) < 0
+
+    def _field_layout(self, name, offset, gdb_type, bitpos=0, bitsize=0):
+        gdb_type = gdb_type.strip_typedefs()
+        code = self._type_codes.get(gdb_type.code, TypeCode.OTHER)
+        signed = code is TypeCode.INT and self._is_signed(gdb_type)
+        element = None
+        layout = None
+        if code is TypeCode.ARRAY:
+            element = self._field_layout('', 0, gdb_type.target())
+        elif code is TypeCode.STRUCT:
+            layout = self._struct_layout(gdb_type)
+        return FieldLayout(name, offset, gdb_type.sizeof, code, signed, element, layout, bitpos, bitsize)
+
+    def _struct_layout(self, gdb_type):
+        name = str(gdb_type)
+        gdb_type = gdb_type.strip_typedefs()
+        fields = {}
+        for _, field in enumerate(gdb_type.fields()):
+            bitsize = field.bitsize
+            layout = self._field_layout(field.name or '', field.bitpos // 8, field.type,
+                                        field.bitpos % 8 if bitsize else 0, bitsize)
+            if field.name:
+                fields[field.name] = layout
+            elif layout.layout is not None:
+                # members of anonymous structs and unions are accessed as members of the parent, as offline
+                for _, sub_field in enumerate(layout.layout.fields.values()):
+                    fields[sub_field.name] = FieldLayout(sub_field.name, layout.offset + sub_field.offset,
+                                                         sub_field.size, sub_field.code, sub_field.signed,
+                                                         sub_field.element, sub_field.layout, sub_field.bitpos,
+                                                         sub_field.bitsize)
+        return StructLayout(name, gdb_type.sizeof, fields)
+
+    def read_memory(self, address, size):
+        try:
+            return bytes(gdb.selected_inferior().read_memory(address, size))
+        except gdb.MemoryError as err:
+            raise MemoryReadError(str(err)) from err
+
+    def get_struct_layout(self, type_name):
+        try:
+            gdb_type = gdb.lookup_type(type_name)
+        except gdb.error as err:
+            raise TypeNotFound(str(err)) from err
+        if self._type_codes.get(gdb_type.strip_typedefs().code) is not TypeCode.STRUCT:
+            raise TypeNotFound(f'No struct type named {type_name}.')
+        return self._struct_layout(gdb_type)
+
+    def get_type_layout(self, type_name):
+        try:
+            return self._field_layout(type_name, 0, gdb.lookup_type(type_name))
+        except gdb.error as err:
+            raise TypeNotFound(str(err)) from err
+
+    def lookup_symbol(self, name):
+        try:
+            value = gdb.parse_and_eval(name)
+            return Symbol(name, Address(int(value.address)), self._field_layout(name, 0, value.type))
+        except gdb.error as err:
+            raise SymbolNotFound(str(err)) from err
+
+    def lookup_symbol_name(self, address):
+        info = gdb.execute(f'info symbol {int(address):#x}', to_string=True)
+        if info.startswith('No symbol matches'):
+            return None
+        return info.split(' in section ', 1)[0].replace(' + ', '+').strip()
+
+    def find_variables(self, type_name):
+        info = gdb.execute(f'info variables -q -t ^{type_name}$', to_string=True)
+        names = []
+        for _, line in enumerate(info.splitlines()):
+            # e.g. '12:\tstatic StaticEventGroup_t xEventGroups[2];'
+            declaration = line.split('\t')[-1].strip()
+            if not declaration.endswith(';'):
+                continue
+            names.append(declaration[:-1].split('[', 1)[0].split()[-1].lstrip('*'))
+        return names
+
+
+_cache = {}
+
+# variables closer to each other than this number of bytes are read with a single transfer, see read_variables()
+READ_MERGE_GAP = 256
+
+
+def clear_type_cache(_=None):
+    """Drop cached type layouts and symbols. Connected to objfile (re)load events"""
+    backend = _cache.get('backend')
+    _cache.clear()
+    if backend is not None and not isinstance(backend, GdbBackend):
+        _cache['backend'] = backend
+
+
+def set_backend(backend):
+    """Select the source of target memory, types and symbols. None selects the GDB inferior"""
+    _cache.clear()
+    if backend is not None:
+        _cache['backend'] = backend
+
+
+def get_backend():
+    backend = _cache.get('backend')
+    if backend is None:
+        if gdb is None:
+            raise TargetError('No backend selected. Use memory.set_backend() outside of GDB')
+        backend = GdbBackend()
+        _cache['backend'] = backend
+    return backend
+
+
+if gdb is not None:
+    gdb.events.new_objfile.connect(clear_type_cache)
+    gdb.events.clear_objfiles.connect(clear_type_cache)
+
+
+def target_byteorder():
+    return get_backend().byteorder
+
+
+def get_struct_layout(type_name):
+    """Return StructLayout of a type. Layouts are cached by type name until a new objfile is loaded"""
+    layouts = _cache.setdefault('layouts', {})
+    layout = layouts.get(type_name)
+    if layout is None:
+        layout = get_backend().get_struct_layout(type_name)
+        layouts[type_name] = layout
+    return layout
+
+
+def get_type_layout(type_name):
+    """Return FieldLayout of a type of any kind. Cached like struct layouts"""
+    layouts = _cache.setdefault('type_layouts', {})
+    layout = layouts.get(type_name)
+    if layout is None:
+        layout = get_backend().get_type_layout(type_name)
+        layouts[type_name] = layout
+    return layout
+
+
+def lookup_symbol(name):
+    """Return Symbol of a global variable. Symbols are cached by name until a new objfile is loaded"""
+    symbols = _cache.setdefault('symbols', {})
+    if name not in symbols:
+        try:
+            symbols[name] = get_backend().lookup_symbol(name)
+        except SymbolNotFound as err:
+            # missing symbols are remembered too, optional kernel variables are looked up on every command
+            symbols[name] = str(err)
+    symbol = symbols[name]
+    if isinstance(symbol, str):
+        raise SymbolNotFound(symbol)
+    return symbol
+
+
+def get_cached(key, factory):
+    """Return a value computed by factory() once until a new objfile is loaded or the backend is changed"""
+    if key not in _cache:
+        _cache[key] = factory()
+    return _cache[key]
+
+
+def find_variables(type_name):
+    """Return names of global variables declared with a type name. Cached until a new objfile is loaded"""
+    variables = _cache.setdefault('variables', {})
+    if type_name not in variables:
+        variables[type_name] = get_backend().find_variables(type_name)
+    return variables[type_name]
+
+
+def read_memory(address, size):
+    return get_backend().read_memory(int(address), size)
+
+
+def read_variable(name):
+    """Read and decode a global variable: int, Address, list of them for arrays or bytes for structures"""
+    symbol = lookup_symbol(name)
+    return symbol.type.decode(read_memory(symbol.address, symbol.type.size), 0, target_byteorder())
+
+
+def read_variables(names):
+    """Read and decode global variables like read_variable() with as few transfers as possible.
+
+    Variables which lie close to each other, e.g. static variables of one source file, are read with a single
+    transfer. Variables missing in the program are left out of the result.
+    """
+    symbols = []
+    for _, name in enumerate(names):
+        try:
+            symbols.append(lookup_symbol(name))
+        except SymbolNotFound:
+            pass
+    symbols.sort(key=lambda symbol: symbol.address)
+    byteorder = target_byteorder()
+    values = {}
+    first = 0
+    while first < len(symbols):
+        start = symbols[first].address
+        end = start + symbols[first].type.size
+        last = first + 1
+        while last < len(symbols) and symbols[last].address <= end + READ_MERGE_GAP:
+            end = max(end, symbols[last].address + symbols[last].type.size)
+            last += 1
+        try:
+            data = read_memory(start, end - start)
+        except MemoryReadError:
+            # the gap between variables may be not readable, e.g. not a part of a core dump
+            data = None
+        for _, symbol in enumerate(symbols[first:last]):
+            if data is None:
+                values[symbol.name] = read_variable(symbol.name)
+            else:
+                values[symbol.name] = symbol.type.decode(data, symbol.address - start, byteorder)
+        first = last
+    return values
+
+
+def read_string(address, max_len=64):
+    """Read a NUL terminated string from target memory"""
+    try:
+        data = read_memory(address, max_len)
+    except MemoryReadError:
+        # the string may end close to the end of a memory region
+        data = b''
+        try:
+            while len(data) < max_len and not data.endswith(b'\0'):
+                data += read_memory(address + len(data), 1)
+        except MemoryReadError:
+            if not data:
+                raise
+    return data.split(b'\0', 1)[0].decode('utf-8', errors='replace')
+
+
+def lookup_symbol_name(address):
+    """Return 'symbol' or 'symbol+offset' for an address, or None if there is no symbol"""
+    names = _cache.setdefault('symbol_names', {})
+    if address not in names:
+        names[address] = get_backend().lookup_symbol_name(address)
+    return names[address]
+
+
+class StructReader:
+    """Reads whole structures of a type from target memory with a single transfer per structure.
+
+    Field offsets are taken from the type layout cache, see get_struct_layout()
+
+    :param type_name: Name of the structure type, e.g. 'TCB_t'
+    """
+
+    def __init__(self, type_name):
+        self.layout = get_struct_layout(type_name)
+        self.byteorder = target_byteorder()
+
+    def read(self, address):
+        address = int(address)
+        return StructSnapshot(self.layout, address, read_memory(address, self.layout.size), self.byteorder)
+
+    def decode(self, address, data):
+        """Decode a structure already read as a part of a bigger memory block"""
+        return StructSnapshot(self.layout, address, data, self.byteorder)
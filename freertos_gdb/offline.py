@@ -0,0 +1,478 @@
+# SPDX-FileCopyrightText: 2022 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+#
+# Offline backend: types and symbols come from the ELF DWARF info, memory from an ELF core dump or raw RAM images.
+# Allows running freertos_gdb in a plain python process, without GDB:
+#
+#   python -m freertos_gdb.offline firmware.elf --core core.elf task --format=json
+#
+# pylint: disable=import-error
+import bisect
+import sys
+from collections import namedtuple
+from .common import get_arg_parser
+from .memory import Address, Backend, FieldLayout, MemoryReadError, StructLayout, Symbol, SymbolNotFound, \
+    TargetError, TypeCode, TypeNotFound, set_backend
+
+try:
+    from elftools.elf.elffile import ELFFile
+    from elftools.elf.sections import SymbolTableSection
+except ImportError:
+    ELFFile = None
+
+DW_ATE_BOOLEAN = 0x02
+DW_ATE_FLOAT = 0x04
+DW_ATE_SIGNED = 0x05
+DW_ATE_SIGNED_CHAR = 0x06
+DW_OP_ADDR = 0x03
+DW_OP_PLUS_UCONST = 0x23
+
+# compile units which define FreeRTOS kernel types and variables are indexed first
+KERNEL_UNITS = ('tasks.c', 'queue.c', 'timers.c', 'list.c', 'event_groups.c', 'stream_buffer.c', 'heap_')
+
+
+class MemoryImage:
+    """Target memory assembled from layers of regions. A read is served by the first layer which covers it,
+    so core dump contents take precedence over initial values from the program ELF.
+    """
+
+    def __init__(self, layers=2):
+        self._layers = [([], []) for _ in range(layers)]
+
+    def add_region(self, address, data, layer=0):
+        starts, regions = self._layers[layer]
+        idx = bisect.bisect(starts, address)
+        starts.insert(idx, address)
+        regions.insert(idx, (address, data))
+
+    @staticmethod
+    def _read_layer(layer, address, size):
+        starts, regions = layer
+        result = b''
+        while size > 0:
+            idx = bisect.bisect_right(starts, address) - 1
+            if idx < 0:
+                return None
+            start, data = regions[idx]
+            chunk = data[address - start:address - start + size]
+            if not chunk:
+                return None
+            result += chunk
+            address += len(chunk)
+            size -= len(chunk)
+        return result
+
+    def clear(self, layer=0):
+        self._layers[layer] = ([], [])
+
+    def read(self, address, size):
+        for _, layer in enumerate(self._layers):
+            data = self._read_layer(layer, address, size)
+            if data is not None:
+                return data
+        raise MemoryReadError(f'Cannot access memory at address {address:#x}')
+
+
+def _uleb128(data):
+    val = 0
+    for i, byte in enumerate(data):
+        val |= (byte & 0x7f) << (7 * i)
+        if not byte & 0x80:
+            break
+    return val
+
+
+# words of C integer type names, which may be spelled in any order, e.g. 'unsigned long' is 'long unsigned int'
+C_INTEGER_WORDS = ('signed', 'unsigned', 'char', 'short', 'int', 'long')
+
+
+def get_base_type_key(name):
+    """Return the index key of a C integer type name, the same for all spellings of the type, or None"""
+    words = name.split()
+    if not words or any(word not in C_INTEGER_WORDS for word in words):
+        return None
+    if 'char' in words:
+        # char, signed char and unsigned char are three distinct types
+        key = [word for word in ('signed', 'unsigned') if word in words] + ['char']
+    else:
+        key = (['unsigned'] if 'unsigned' in words else []) + ['long'] * words.count('long') + \
+            ['short'] * words.count('short') + ['int']
+    return '<' + ' '.join(key) + '>'
+
+
+def _attr(die, name, default=None):
+    attr = die.attributes.get(name)
+    if attr is None:
+        return default
+    val = attr.value
+    return val.decode('utf-8', errors='replace') if isinstance(val, bytes) else val
+
+
+class DwarfTypes:
+    """Lazy index of named types and variables in DWARF info.
+
+    Only top level DIEs of compile units are indexed, and a unit is indexed only when a requested name
+    is not found in already indexed ones. FreeRTOS kernel units go first.
+    """
+
+    def __init__(self, dwarf):
+        self._pending = sorted(dwarf.iter_CUs(), key=self._unit_priority, reverse=True)
+        self._types = {}
+        self._variables = {}
+        self._structs = {}
+
+    @staticmethod
+    def _unit_priority(cu):
+        name = _attr(cu.get_top_DIE(), 'DW_AT_name', '')
+        return any(unit in name for unit in KERNEL_UNITS)
+
+    def _index_next_unit(self):
+        if not self._pending:
+            return False
+        cu = self._pending.pop(0)
+        for die in cu.get_top_DIE().iter_children():
+            if die.tag == 'DW_TAG_variable':
+                self._index_variable(die)
+                continue
+            name = _attr(die, 'DW_AT_name')
+            if name is None or _attr(die, 'DW_AT_declaration'):
+                continue
+            if die.tag in ('DW_TAG_structure_type', 'DW_TAG_union_type'):
+                name = ('struct ' if die.tag == 'DW_TAG_structure_type' else 'union ') + name
+            elif die.tag == 'DW_TAG_base_type' and get_base_type_key(name):
+                self._types.setdefault(get_base_type_key(name), die)
+            elif die.tag not in ('DW_TAG_typedef', 'DW_TAG_base_type', 'DW_TAG_enumeration_type'):
+                continue
+            self._types.setdefault(name, die)
+        return True
+
+    def _index_variable(self, die):
+        spec = die
+        if 'DW_AT_specification' in die.attributes:
+            spec = die.get_DIE_from_attribute('DW_AT_specification')
+        name = _attr(spec, 'DW_AT_name')
+        if name is None or 'DW_AT_type' not in spec.attributes:
+            return
+        if name not in self._variables or 'DW_AT_location' in die.attributes:
+            self._variables[name] = (die, spec)
+
+    def _find(self, table, name):
+        while name not in table and self._index_next_unit():
+            pass
+        return table.get(name)
+
+    def find_type(self, name):
+        return self._find(self._types, name)
+
+    def find_variable(self, name):
+        """Return (definition DIE, DIE with name and type) of a variable or None"""
+        return self._find(self._variables, name)
+
+    def find_variables_of_type(self, type_name):
+        """Return names of variables (or arrays of them) declared with a type name. Indexes all units"""
+        while self._index_next_unit():
+            pass
+        names = []
+        for _, (name, (_, spec)) in enumerate(self._variables.items()):
+            die = spec.get_DIE_from_attribute('DW_AT_type')
+            while die.tag in ('DW_TAG_array_type', 'DW_TAG_const_type', 'DW_TAG_volatile_type') and \
+                    'DW_AT_type' in die.attributes:
+                die = die.get_DIE_from_attribute('DW_AT_type')
+            if _attr(die, 'DW_AT_name') == type_name:
+                names.append(name)
+        return names
+
+    def strip_type(self, die):
+        while die is not None and die.tag in ('DW_TAG_typedef', 'DW_TAG_const_type', 'DW_TAG_volatile_type',
+                                              'DW_TAG_restrict_type', 'DW_TAG_atomic_type'):
+            if 'DW_AT_type' not in die.attributes:
+                return None
+            die = die.get_DIE_from_attribute('DW_AT_type')
+        if die is not None and _attr(die, 'DW_AT_declaration') and _attr(die, 'DW_AT_name'):
+            # incomplete struct type, take the definition from another unit
+            prefix = 'struct ' if die.tag == 'DW_TAG_structure_type' else 'union '
+            die = self.find_type(prefix + _attr(die, 'DW_AT_name')) or die
+        return die
+
+    def field_layout(self, name, offset, type_die, bitpos=0, bitsize=0):
+        die = self.strip_type(type_die)
+        if die is None:
+            return FieldLayout(name, offset, 0, TypeCode.OTHER)
+        size = _attr(die, 'DW_AT_byte_size', 0)
+        if die.tag == 'DW_TAG_base_type':
+            encoding = _attr(die, 'DW_AT_encoding')
+            code = TypeCode.FLT if encoding == DW_ATE_FLOAT else TypeCode.INT
+            signed = encoding in (DW_ATE_SIGNED, DW_ATE_SIGNED_CHAR)
+            return FieldLayout(name, offset, size, code, signed, bitpos=bitpos, bitsize=bitsize)
+        if die.tag == 'DW_TAG_enumeration_type':
+            signed = any(_attr(child, 'DW_AT_const_value', 0) < 0 for child in die.iter_children())
+            return FieldLayout(name, offset, size, TypeCode.INT, signed, bitpos=bitpos, bitsize=bitsize)
+        if die.tag in ('DW_TAG_pointer_type', 'DW_TAG_reference_type'):
+            return FieldLayout(name, offset, size or die.cu['address_size'], TypeCode.PTR)
+        if die.tag == 'DW_TAG_array_type':
+            element = self.field_layout('', 0, die.get_DIE_from_attribute('DW_AT_type'))
+            count = 1
+            for _, subrange in enumerate(die.iter_children()):
+                if subrange.tag != 'DW_TAG_subrange_type':
+                    continue
+                upper_bound = _attr(subrange, 'DW_AT_upper_bound')
+                dim = _attr(subrange, 'DW_AT_count', upper_bound + 1 if isinstance(upper_bound, int) else 0)
+                count *= dim if isinstance(dim, int) else 0
+            return FieldLayout(name, offset, count * element.size, TypeCode.ARRAY, element=element)
+        if die.tag in ('DW_TAG_structure_type', 'DW_TAG_union_type'):
+            return FieldLayout(name, offset, size, TypeCode.STRUCT, layout=self.struct_layout(die))
+        return FieldLayout(name, offset, size, TypeCode.OTHER)
+
+    def _member_offset(self, member):
+        location = _attr(member, 'DW_AT_data_member_location', 0)
+        if isinstance(location, list):
+            # location expression, GCC emits DW_OP_plus_uconst only
+            return _uleb128(location[1:]) if location and location[0] == DW_OP_PLUS_UCONST else 0
+        return location
+
+    def struct_layout(self, die, name=None):
+        layout = self._structs.get(die.offset)
+        if layout is not None:
+            return layout
+        fields = {}
+        for _, member in enumerate(die.iter_children()):
+            if member.tag != 'DW_TAG_member':
+                continue
+            offset = self._member_offset(member)
+            bitsize = _attr(member, 'DW_AT_bit_size', 0)
+            bitpos = 0
+            if bitsize:
+                if 'DW_AT_data_bit_offset' in member.attributes:
+                    abs_bitpos = _attr(member, 'DW_AT_data_bit_offset')
+                else:
+                    # DWARF 2/3 counts bits from the most significant bit of the storage unit
+                    unit_size = _attr(member, 'DW_AT_byte_size') or \
+                        _attr(self.strip_type(member.get_DIE_from_attribute('DW_AT_type')), 'DW_AT_byte_size', 0)
+                    abs_bitpos = offset * 8 + unit_size * 8 - _attr(member, 'DW_AT_bit_offset', 0) - bitsize
+                offset, bitpos = divmod(abs_bitpos, 8)
+            field = self.field_layout(_attr(member, 'DW_AT_name', ''), offset,
+                                      member.get_DIE_from_attribute('DW_AT_type'), bitpos, bitsize)
+            if field.name:
+                fields[field.name] = field
+            elif field.layout is not None:
+                # members of anonymous structs and unions are accessed as members of the parent
+                for _, sub_field in enumerate(field.layout.fields.values()):
+                    fields[sub_field.name] = FieldLayout(sub_field.name, offset + sub_field.offset, sub_field.size,
+                                                         sub_field.code, sub_field.signed, sub_field.element,
+                                                         sub_field.layout, sub_field.bitpos, sub_field.bitsize)
+        layout = StructLayout(name or _attr(die, 'DW_AT_name', ''), _attr(die, 'DW_AT_byte_size', 0), fields)
+        self._structs[die.offset] = layout
+        return layout
+
+
+class TypeInfo(namedtuple('TypeInfo', 'layouts symbols')):
+    """Struct layouts and variables resolved from DWARF, by name. None marks a name which was not found.
+
+    Picklable, so DWARF is parsed once and the result is shared with other processes (see batch.py)
+    """
+
+
+class ElfBackend(Backend):
+    """Reads memory of a stopped target from an ELF core dump and/or raw RAM images.
+
+    Types and symbols are taken from the program ELF. Memory not present in the dump falls back to the
+    loadable sections of the program ELF (e.g. constant strings in flash).
+
+    :param elf_path: Program ELF with DWARF info
+    :param core_path: ELF core dump (e.g. ESP-IDF core dump in ELF format)
+    :param ram_images: List of (path, load address) of raw memory images
+    :param type_info: TypeInfo exported by another ElfBackend of the same ELF, see type_info()
+    """
+
+    def __init__(self, elf_path, core_path=None, ram_images=(), type_info=None):
+        if ELFFile is None:
+            raise TargetError('pyelftools is required for offline analysis: pip install pyelftools')
+        self._stream = open(elf_path, 'rb')  # pylint: disable=consider-using-with  # DWARF is parsed lazily
+        elf = ELFFile(self._stream)
+        self.byteorder = 'little' if elf.little_endian else 'big'
+        self.memory = MemoryImage()
+        self._symbols = {}
+        self._symbol_starts = []
+        self._symbol_ranges = []
+        self._load_symbols(elf)
+        self._elf = elf
+        self._dwarf_types = None
+        self._layouts = dict(type_info.layouts) if type_info else {}
+        self._variables = dict(type_info.symbols) if type_info else {}
+        self.load_dump(core_path, ram_images)
+        for _, section in enumerate(elf.iter_sections()):
+            if section['sh_flags'] & 0x2 and section['sh_type'] != 'SHT_NOBITS' and section['sh_addr']:  # SHF_ALLOC
+                self.memory.add_region(section['sh_addr'], section.data(), layer=1)
+
+    def load_dump(self, core_path=None, ram_images=()):
+        """Replace target memory with another core dump and/or RAM images. Types and symbols are kept"""
+        self.memory.clear(layer=0)
+        if core_path is not None:
+            with open(core_path, 'rb') as core_stream:
+                for _, segment in enumerate(ELFFile(core_stream).iter_segments()):
+                    if segment['p_type'] == 'PT_LOAD' and segment['p_filesz']:
+                        self.memory.add_region(segment['p_vaddr'], segment.data(), layer=0)
+        for _, (path, address) in enumerate(ram_images):
+            with open(path, 'rb') as image:
+                self.memory.add_region(address, image.read(), layer=0)
+
+    def type_info(self):
+        """Export layouts and variables resolved so far"""
+        return TypeInfo(dict(self._layouts), dict(self._variables))
+
+    @property
+    def _types(self):
+        if self._dwarf_types is None and self._elf.has_dwarf_info():
+            self._dwarf_types = DwarfTypes(self._elf.get_dwarf_info())
+        return self._dwarf_types
+
+    def close(self):
+        self._stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _load_symbols(self, elf):
+        ranges = []
+        for _, section in enumerate(elf.iter_sections()):
+            if not isinstance(section, SymbolTableSection):
+                continue
+            for _, sym in enumerate(section.iter_symbols()):
+                if sym['st_info']['type'] not in ('STT_OBJECT', 'STT_FUNC') or not sym.name:
+                    continue
+                self._symbols.setdefault(sym.name, sym['st_value'])
+                ranges.append((sym['st_value'], sym['st_size'], sym.name))
+        ranges.sort()
+        self._symbol_starts = [start for start, _, _ in ranges]
+        self._symbol_ranges = ranges
+
+    def read_memory(self, address, size):
+        return self.memory.read(address, size)
+
+    def get_struct_layout(self, type_name):
+        # a missing type is remembered too, searching for it again would index all remaining DWARF units
+        if type_name not in self._layouts:
+            self._layouts[type_name] = self._find_struct_layout(type_name)
+        layout = self._layouts[type_name]
+        if layout is None:
+            raise TypeNotFound(f'No struct type named {type_name}.')
+        return layout
+
+    def _find_struct_layout(self, type_name):
+        types = self._types
+        die = types.find_type(type_name) if types else None
+        die = types.strip_type(die) if die is not None else None
+        if die is None or die.tag not in ('DW_TAG_structure_type', 'DW_TAG_union_type'):
+            return None
+        return types.struct_layout(die, type_name)
+
+    def get_type_layout(self, type_name):
+        types = self._types
+        die = types.find_type(get_base_type_key(type_name) or type_name) if types else None
+        if die is None:
+            raise TypeNotFound(f'No type named {type_name}.')
+        return types.field_layout(type_name, 0, die)
+
+    def lookup_symbol(self, name):
+        if name not in self._variables:
+            self._variables[name] = self._find_symbol(name)
+        symbol = self._variables[name]
+        if symbol is None:
+            raise SymbolNotFound(f'No symbol "{name}" in current context.')
+        return symbol
+
+    def _find_symbol(self, name):
+        if self._symbols and name not in self._symbols:
+            # not in the symbol table, do not search all DWARF units for it
+            return None
+        types = self._types
+        found = types.find_variable(name) if types else None
+        if found is None:
+            return None
+        die, spec = found
+        address = self._symbols.get(name)
+        location = _attr(die, 'DW_AT_location')
+        if address is None and isinstance(location, list) and location and location[0] == DW_OP_ADDR:
+            address = int.from_bytes(bytes(location[1:]), self.byteorder)
+        if address is None:
+            return None
+        return Symbol(name, Address(address), types.field_layout(name, 0, spec.get_DIE_from_attribute('DW_AT_type')))
+
+    def find_variables(self, type_name):
+        types = self._types
+        return types.find_variables_of_type(type_name) if types else []
+
+    def lookup_symbol_name(self, address):
+        idx = bisect.bisect_right(self._symbol_starts, address) - 1
+        if idx < 0:
+            return None
+        # several symbols may start at the same address
+        nearest = self._symbol_starts[idx]
+        while idx >= 0 and self._symbol_starts[idx] == nearest:
+            start, size, name = self._symbol_ranges[idx]
+            if start == address:
+                return name
+            if address < start + size:
+                return f'{name}+{address - start}'
+            idx -= 1
+        return None
+
+
+def parse_ram_image(spec):
+    path, _, address = spec.rpartition('@')
+    if not path:
+        raise ValueError(f'RAM image must be given as FILE@ADDRESS, got "{spec}"')
+    return path, int(address, 0)
+
+
+COMMANDS = ('task', 'queue', 'semaphore', 'timer', 'stack', 'heap', 'eventgroup', 'streambuffer', 'cores', 'check')
+
+
+def run_command(command, fmt='table', output=None, fixed_width=None):
+    """Run a freertos subcommand against the selected backend"""
+    # imported here, command modules are not needed to use the backend itself
+    # pylint: disable=import-outside-toplevel
+    from . import check, cores, eventgroup, heap, queue, stack, streambuffer, task, timer
+    if command == 'task':
+        task.show(fmt, output, fixed_width)
+    elif command in ('queue', 'semaphore'):
+        queue.show_queues_list(command == 'semaphore', fmt, output, fixed_width)
+    elif command == 'timer':
+        timer.show(fmt, output, fixed_width)
+    elif command == 'stack':
+        stack.show(fmt, output, fixed_width)
+    else:
+        # commands which fail with a message if the program lacks their kernel objects
+        module = {'heap': heap, 'eventgroup': eventgroup, 'streambuffer': streambuffer, 'cores': cores,
+                  'check': check}[command]
+        try:
+            module.show(fmt, output, fixed_width)
+        except TargetError as err:
+            print(err)
+
+
+def main(argv=None):
+    parser = get_arg_parser('python -m freertos_gdb.offline',
+                            'Print FreeRTOS kernel objects from a core dump or RAM images without GDB.')
+    parser.add_argument('elf', help='Program ELF file with debug info.')
+    parser.add_argument('command', choices=COMMANDS)
+    parser.add_argument('--core', help='ELF core dump.')
+    parser.add_argument('--ram', metavar='FILE@ADDRESS', action='append', default=[], type=parse_ram_image,
+                        help='Raw memory image and its load address. May be given several times.')
+    args = parser.parse_args(argv)
+    if args.core is None and not args.ram:
+        parser.error('at least one of --core or --ram is required')
+    with ElfBackend(args.elf, args.core, args.ram) as backend:
+        set_backend(backend)
+        try:
+            run_command(args.command, args.format, args.output, args.fixed_width)
+        finally:
+            set_backend(None)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
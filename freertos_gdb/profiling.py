@@ -0,0 +1,239 @@
+# SPDX-FileCopyrightText: 2022 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+#
+# pylint: disable=import-error
+import functools
+import sys
+import time
+from collections import deque
+from . import common, memory
+from .common import CommandBase, FreeRtosList, StructProperty, gdb, get_arg_parser, open_output, parse_args, \
+    write_table
+
+# owner object, attribute name, probe name. Functions are patched in every freertos_gdb module which imported them
+PROBES = (
+    (FreeRtosList, '__iter__', 'FreeRtosList.__iter__'),
+    (FreeRtosList, '_read_next', 'FreeRtosList.read_node'),
+    (StructProperty, 'get_val', 'StructProperty.get_val'),
+    (StructProperty, 'get_string_val', 'StructProperty.get_string_val'),
+    (memory, 'read_string', 'read_string'),
+    (common, 'print_table', 'print_table'),
+    (common, 'write_json', 'write_json'),
+    (common, 'write_csv', 'write_csv'),
+)
+# methods of every memory backend class, symbol and type lookups are gdb.parse_and_eval/lookup_type in GDB
+BACKEND_PROBES = ('read_memory', 'lookup_symbol', 'get_struct_layout', 'lookup_symbol_name')
+MAX_INVOCATIONS = 100
+
+
+class Invocation:
+    """Statistics of one command invocation
+
+    :param command: Command name, e.g. 'freertos task'
+    """
+
+    def __init__(self, command, args=''):
+        self.command = command
+        self.args = args
+        self.probes = {}
+        self.reads = 0
+        self.read_bytes = 0
+        self.time = 0.0
+
+    def add(self, probe, elapsed):
+        stats = self.probes.setdefault(probe, [0, 0.0])
+        stats[0] += 1
+        stats[1] += elapsed
+
+
+_state = {'patched': [], 'current': None, 'invocations': deque(maxlen=MAX_INVOCATIONS), 'totals': {}}
+
+
+def _current():
+    """Invocation of the running command. Code run outside of commands (e.g. stop handlers) is summed up directly"""
+    if _state['current'] is None:
+        return _state['totals'].setdefault('<event>', Invocation('<event>'))
+    return _state['current']
+
+
+def _wrap_function(func, probe):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current().add(probe, time.perf_counter() - start)
+    return wrapper
+
+
+def _wrap_generator(func, probe):
+    """Time spent inside the generator is summed over all its steps, one call per generator"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        gen = func(*args, **kwargs)
+        elapsed = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(gen)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - start
+                yield item
+        finally:
+            _current().add(probe, elapsed)
+    return wrapper
+
+
+def _wrap_read_memory(func, probe):
+    @functools.wraps(func)
+    def wrapper(self, address, size):
+        invocation = _current()
+        invocation.reads += 1
+        invocation.read_bytes += size
+        start = time.perf_counter()
+        try:
+            return func(self, address, size)
+        finally:
+            invocation.add(probe, time.perf_counter() - start)
+    return wrapper
+
+
+def _wrap_command(func, command):
+    @functools.wraps(func)
+    def wrapper(self, arg, from_tty):
+        previous = _state['current']
+        invocation = Invocation(command, arg)
+        _state['current'] = invocation
+        _state['invocations'].append(invocation)
+        start = time.perf_counter()
+        try:
+            return func(self, arg, from_tty)
+        finally:
+            invocation.time = time.perf_counter() - start
+            _state['current'] = previous
+            _add_totals(invocation)
+    return wrapper
+
+
+def _add_totals(invocation):
+    totals = _state['totals'].setdefault(invocation.command, Invocation(invocation.command))
+    totals.time += invocation.time
+    totals.reads += invocation.reads
+    totals.read_bytes += invocation.read_bytes
+    for _, (probe, (calls, elapsed)) in enumerate(invocation.probes.items()):
+        stats = totals.probes.setdefault(probe, [0, 0.0])
+        stats[0] += calls
+        stats[1] += elapsed
+
+
+def _patch(owner, name, wrapper):
+    original = owner.__dict__[name]
+    _state['patched'].append((owner, name, original))
+    setattr(owner, name, wrapper)
+    if isinstance(owner, type):
+        return
+    # the function was imported by name into other modules
+    for _, module in enumerate(list(sys.modules.values())):
+        if module is not owner and getattr(module, '__name__', '').startswith(__package__ + '.') and \
+                module.__dict__.get(name) is original:
+            _state['patched'].append((module, name, original))
+            setattr(module, name, wrapper)
+
+
+def _subclasses(cls):
+    for _, sub in enumerate(cls.__subclasses__()):
+        yield sub
+        yield from _subclasses(sub)
+
+
+def enable():
+    if _state['patched']:
+        return
+    for _, (owner, name, probe) in enumerate(PROBES):
+        original = owner.__dict__[name]
+        wrap = _wrap_generator if name == '__iter__' else _wrap_function
+        _patch(owner, name, wrap(original, probe))
+    for _, cls in enumerate([memory.Backend] + list(_subclasses(memory.Backend))):
+        for _, name in enumerate(BACKEND_PROBES):
+            if name in cls.__dict__:
+                wrap = _wrap_read_memory if name == 'read_memory' else _wrap_function
+                _patch(cls, name, wrap(cls.__dict__[name], f'backend.{name}'))
+    if CommandBase is not object:
+        for _, cls in enumerate(_subclasses(CommandBase)):
+            if 'invoke' in cls.__dict__ and cls is not FreeRtosProfile:
+                command = 'freertos ' + cls.__name__[len('FreeRtos'):].lower()
+                _patch(cls, 'invoke', _wrap_command(cls.__dict__['invoke'], command))
+
+
+def disable():
+    while _state['patched']:
+        owner, name, original = _state['patched'].pop()
+        setattr(owner, name, original)
+    _state['current'] = None
+
+
+def reset():
+    _state['invocations'].clear()
+    _state['totals'].clear()
+    _state['current'] = None
+
+
+def get_report_rows():
+    """Per command: total row with reads, then one row per probe"""
+    rows = []
+    for _, (command, totals) in enumerate(sorted(_state['totals'].items())):
+        calls = sum(1 for invocation in _state['invocations'] if invocation.command == command)
+        rows.append([command, '<total>', calls or '', round(totals.time * 1000, 3), totals.reads, totals.read_bytes])
+        for _, (probe, (count, elapsed)) in enumerate(sorted(totals.probes.items(), key=lambda item: -item[1][1])):
+            rows.append([command, probe, count, round(elapsed * 1000, 3), '', ''])
+    return rows
+
+
+def get_invocation_rows():
+    return [[invocation.command, invocation.args, round(invocation.time * 1000, 3), invocation.reads,
+             invocation.read_bytes] for invocation in _state['invocations']]
+
+
+REPORT_HEADERS = ['COMMAND', 'PROBE', 'CALLS', 'TIME_MS', 'READS', 'BYTES']
+INVOCATION_HEADERS = ['COMMAND', 'ARGS', 'TIME_MS', 'READS', 'BYTES']
+
+
+def show_report(fmt='table', output=None, invocations=False):
+    if invocations:
+        rows, headers = get_invocation_rows(), INVOCATION_HEADERS
+    else:
+        rows, headers = get_report_rows(), REPORT_HEADERS
+    if not rows:
+        print('No profile data. Run "freertos profile on" and then freertos commands.')
+        return
+    with open_output(output) as stream:
+        write_table(rows, headers, fmt, stream)
+
+
+class FreeRtosProfile(CommandBase):
+    """ Profile freertos commands: call counts, cumulative time and target reads of their hot paths.
+    """
+
+    def __init__(self):
+        super().__init__('freertos profile', gdb.COMMAND_USER)
+        self._parser = get_arg_parser('freertos profile', self.__doc__)
+        self._parser.add_argument('action', choices=('on', 'off', 'report', 'reset'))
+        self._parser.add_argument('--invocations', action='store_true',
+                                  help=f'Report the last {MAX_INVOCATIONS} invocations instead of totals.')
+
+    def invoke(self, arg, _):
+        args = parse_args(self._parser, arg)
+        if args is None:
+            return
+        if args.action == 'on':
+            enable()
+        elif args.action == 'off':
+            disable()
+        elif args.action == 'reset':
+            reset()
+        else:
+            show_report(args.format, args.output, args.invocations)
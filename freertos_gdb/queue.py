@@ -2,9 +2,14 @@
 # SPDX-License-Identifier: Apache-2.0
 #
 # pylint: disable=import-error
-import gdb
-from .common import StructProperty, FreeRtosList, print_table
-from .task import TaskProperty
+from collections import namedtuple
+from .common import CommandBase, FreeRtosList, StructProperty, gdb, get_arg_parser, open_output, parse_args, \
+    peek_rows, write_table
+from .task import get_task_ref
+from .memory import StructReader, StructSnapshot, TargetError, get_struct_layout, get_type_layout, read_memory, \
+    read_string, target_byteorder
+from .snapshot import get_snapshot, read_queue_registry
+from .watch import Watcher, add_watch_arguments, start, stop
 
 
 class QueueProperty(StructProperty):
@@ -39,29 +44,51 @@ class QueueProperty(StructProperty):
     TYPE = ('Queue type.', 'ucQueueType', 'get_val')
 
 
+def read_queue_items(queue):
+    """Return raw items waiting in a queue, oldest first. The queue storage is read with a single transfer"""
+    item_size = queue['uxItemSize']
+    head = queue['pcHead']
+    if item_size == 0 or head == 0:
+        # semaphores and mutexes have no storage
+        return []
+    size = queue['u.xQueue.pcTail'] - head
+    if size != queue['uxLength'] * item_size or queue['uxMessagesWaiting'] > queue['uxLength']:
+        raise TargetError(f'Queue at {queue.address:#x} is corrupted: storage size {size}, '
+                          f'{queue["uxMessagesWaiting"]} of {queue["uxLength"]} items of {item_size} bytes')
+    # pcReadFrom points to the item read last
+    offset = queue['u.xQueue.pcReadFrom'] - head
+    if not 0 <= offset < size or offset % item_size:
+        raise TargetError(f'Queue at {queue.address:#x} is corrupted: pcReadFrom {queue["u.xQueue.pcReadFrom"]:#x} '
+                          f'is not an item of the storage at {head:#x}')
+    data = read_memory(head, size)
+    items = []
+    for _ in range(queue['uxMessagesWaiting']):
+        offset += item_size
+        if offset >= size:
+            offset = 0
+        items.append(data[offset:offset + item_size])
+    return items
+
+
 class Queues:
-    def __init__(self, is_semaphore):
-        self._queues = []
+    def __init__(self, is_semaphore, snapshot):
         self._is_sem = is_semaphore
-        self._queue_type = gdb.lookup_type("Queue_t")
-        self._queue_ptr_type = self._queue_type.pointer()
-        self._tcb_ptr_type = gdb.lookup_type('TCB_t').pointer()
+        self._snapshot = snapshot
+        self._queue_layout = get_struct_layout('Queue_t')
 
-    def print_table_help(self):
+    def print_table_help(self, stream=None):
         for _, item in enumerate(QueueProperty):
             if self.queue_sem_field_filter(item):
                 continue
-            if not item.exist(self._queue_type):
-                continue
-            item.print_property_help(self._queue_type)
-        print('')
+            item.print_property_help(self._queue_layout, stream)
+        print('', file=stream)
 
     def get_table_headers(self):
         row = []
         for _, item in enumerate(QueueProperty):
             if self.queue_sem_field_filter(item):
                 continue
-            if not item.exist(self._queue_type):
+            if not item.exist(self._queue_layout):
                 continue
             row.append(item.title)
         return row
@@ -84,110 +111,258 @@ class Queues:
                 return True
         return False
 
-    def add_queue(self, queue_registery):
-        if queue_registery['xHandle'] == 0:
-            return
-        name = queue_registery['pcQueueName'].string()
-        queue = queue_registery['xHandle'].cast(self._queue_ptr_type).dereference()
-        if (not self._is_sem and queue['uxItemSize'] == 0) or \
-                (self._is_sem and queue['uxItemSize'] != 0):
-            return
-        self._queues.append((name, queue))
+    def is_shown(self, queue_record):
+        item_size = queue_record.queue['uxItemSize']
+        return (self._is_sem and item_size == 0) or (not self._is_sem and item_size != 0)
 
-    def show(self):
-        table = []
-        for idx, _ in enumerate(self._queues):
-            table.extend(self.get_table_rows(idx))
-        if len(table) == 0:
+    def get_table_rows(self, queue_records):
+        for _, queue_record in enumerate(queue_records):
+            if self.is_shown(queue_record):
+                yield self.get_table_row(queue_record)
+
+    def show(self, queue_records, fmt='table', output=None, fixed_width=None):
+        table = peek_rows(self.get_table_rows(queue_records))
+        if table is None:
             return
-        self.print_table_help()
-        print_table(table, self.get_table_headers())
-
-    def get_table_rows(self, q_id):
-        table = []
-        name, queue = self._queues[q_id]
-        rcv_list = FreeRtosList(queue['xTasksWaitingToReceive'], 'TCB_t')
-        snd_list = FreeRtosList(queue['xTasksWaitingToSend'], 'TCB_t')
-
-        for list_id in range(max(rcv_list.length, snd_list.length, 1)):
-            row = []
-            if list_id != 0:
-                name, queue = ('', None)
-            for _, item in enumerate(QueueProperty):
-
-                if self.queue_sem_field_filter(item):
-                    continue
+        with open_output(output) as stream:
+            if fmt == 'table':
+                self.print_table_help(stream)
+            write_table(table, self.get_table_headers(), fmt, stream, fixed_width)
 
-                if item == QueueProperty.NAME:
-                    row.append(name)
-                    continue
-                if item in (QueueProperty.TASKS_WAITING_TO_RECEIVE, QueueProperty.TASKS_WAITING_TO_TAKE):
-                    row.append(get_task_id_name_str(rcv_list[list_id]))
-                    continue
-                if item in (QueueProperty.TASKS_WAITING_TO_SEND, QueueProperty.TASKS_WAITING_TO_GIVE):
-                    row.append(get_task_id_name_str(snd_list[list_id]))
-                    continue
+    def get_table_row(self, queue_record):
+        row = []
+        name, queue, rcv_list, snd_list = queue_record
+        for _, item in enumerate(QueueProperty):
 
-                # if queue is mutex
-                if queue is not None and queue['pcHead'] == 0:
-                    if item == QueueProperty.MUTEX_HOLDER:
-                        task_ptr = queue['u']['xSemaphore']['xMutexHolder'].cast(self._tcb_ptr_type)
-                        row.append(get_task_id_name_str(None if task_ptr == 0 else task_ptr))
-                        continue
-                    if item == QueueProperty.RCALLCOUNT:
-                        row.append(queue['u']['xSemaphore']['uxRecursiveCallCount'])
-                        continue
-
-                if not item.exist(self._queue_type.target()):
-                    continue
+            if self.queue_sem_field_filter(item):
+                continue
 
-                row.append(item.value_str(queue))
-            table.append(row)
-        return table
+            if item == QueueProperty.NAME:
+                row.append(name)
+                continue
+            if item in (QueueProperty.TASKS_WAITING_TO_RECEIVE, QueueProperty.TASKS_WAITING_TO_TAKE):
+                row.append([get_task_ref(self._snapshot.get_task(task_ptr)) for task_ptr in rcv_list])
+                continue
+            if item in (QueueProperty.TASKS_WAITING_TO_SEND, QueueProperty.TASKS_WAITING_TO_GIVE):
+                row.append([get_task_ref(self._snapshot.get_task(task_ptr)) for task_ptr in snd_list])
+                continue
+
+            # if queue is mutex
+            if queue['pcHead'] == 0:
+                if item == QueueProperty.MUTEX_HOLDER:
+                    task_ptr = queue['u.xSemaphore.xMutexHolder']
+                    row.append(get_task_ref(self._snapshot.get_task(task_ptr)) if task_ptr != 0 else '')
+                    continue
+                if item == QueueProperty.RCALLCOUNT:
+                    row.append(queue['u.xSemaphore.uxRecursiveCallCount'])
+                    continue
 
+            if not item.exist(self._queue_layout):
+                continue
 
-def get_task_id_name_str(task):
-    task_id = TaskProperty.ID.get_val_as_is(task)
-    task_name = TaskProperty.NAME.get_string_val(task)
-    return f'{task_id} {task_name}'
+            row.append(item.get_value(queue))
+        return row
 
 
-def show_queues_list(is_semaphore):
+def show_queues_list(is_semaphore, fmt='table', output=None, fixed_width=None):
     queue_registry_help = """Set configQUEUE_REGISTRY_SIZE > 0
 
     And call \"vQueueAddToRegistry()\" from a code to track your queue"""
 
+    snapshot = get_snapshot()
     try:
-        queue_registry = gdb.parse_and_eval('xQueueRegistry')
-    except gdb.error as err:
+        Queues(is_semaphore, snapshot).show(snapshot.iter_queues(), fmt, output, fixed_width)
+    except TargetError as err:
         print(f'{err}\n{queue_registry_help}')
+
+
+def find_queue(snapshot, name):
+    """Return Queue_t of a registered queue by its name or of a queue by its address"""
+    try:
+        return StructReader('Queue_t').read(int(name, 0))
+    except ValueError:
+        pass
+    for _, record in enumerate(snapshot.iter_queues()):
+        if record.name == name:
+            return record.queue
+    raise TargetError(f'No queue named "{name}" in the queue registry')
+
+
+def get_field_paths(layout, prefix=''):
+    """Return dotted paths of fields of a structure. Nested structures are expanded, unions are not"""
+    paths = []
+    for _, (name, field) in enumerate(layout.fields.items()):
+        nested = field.layout
+        is_union = nested is not None and len(nested.fields) > 1 and \
+            all(member.offset == 0 for member in nested.fields.values())
+        if nested is not None and not is_union:
+            paths.extend(get_field_paths(nested, prefix + name + '.'))
+        else:
+            paths.append(prefix + name)
+    return paths
+
+
+def get_item_decoder(type_name, item_size):
+    """Return (headers, function returning the row values of a raw item) for items of a type, or hex if None"""
+    if type_name is None:
+        return ['DATA'], lambda data: [data.hex()]
+    byteorder = target_byteorder()
+    item_type = get_type_layout(type_name)
+    if item_type.size != item_size:
+        raise TargetError(f'Size of {type_name} is {item_type.size}, queue items are {item_size} bytes')
+    layout = item_type.layout
+    if layout is None:
+        def decode_value(data):
+            value = item_type.decode(data, 0, byteorder)
+            return [value.hex() if isinstance(value, bytes) else value]
+
+        return ['VALUE'], decode_value
+    paths = get_field_paths(layout)
+
+    def decode(data):
+        item = StructSnapshot(layout, 0, data, byteorder)
+        values = [item[path] for path in paths]
+        return [val.hex() if isinstance(val, bytes) else val for val in values]
+
+    return paths, decode
+
+
+def show_queue_items(name, type_name=None, fmt='table', output=None, fixed_width=None):
+    try:
+        queue = find_queue(get_snapshot(), name)
+        headers, decode = get_item_decoder(type_name, queue['uxItemSize'])
+        table = [[index] + decode(data) for index, data in enumerate(read_queue_items(queue))]
+    except TargetError as err:
+        print(err)
         return
-    queues = Queues(is_semaphore)
-    for idx in range(queue_registry.type.range()[1] + 1):
-        queues.add_queue(queue_registry[idx])
+    with open_output(output) as stream:
+        if fmt == 'table':
+            print(f'Items: {len(table)} of {queue["uxLength"]}, {queue["uxItemSize"]} bytes each\n', file=stream)
+            if not table:
+                return
+        write_table(table, ['INDEX'] + headers, fmt, stream, fixed_width)
+
 
-    queues.show()
+QueueState = namedtuple('QueueState', 'queue name count mutex_holder snd_list rcv_list')
 
 
-class FreeRtosQueue(gdb.Command):
+class QueueWatcher(Watcher):
+    """Reports changes of registered queues (or semaphores): item count, mutex holder, blocked tasks.
+
+    A queue is decoded only if its Queue_t changed, waiting lists are walked only if their headers changed
+    """
+
+    def __init__(self, is_semaphore):
+        self._is_sem = is_semaphore
+        self.title = 'Semaphores' if is_semaphore else 'Queues'
+        self._queues = None
+        self._names = {}
+
+    def _get_name(self, name_ptr):
+        if name_ptr not in self._names:
+            self._names[name_ptr] = read_string(name_ptr)
+        return self._names[name_ptr]
+
+    @staticmethod
+    def _get_waiters(queue, old, field):
+        if old is not None and old.queue.raw(field) == queue.raw(field):
+            return old.snd_list if field == 'xTasksWaitingToSend' else old.rcv_list
+        snapshot = get_snapshot()
+        return [get_task_ref(snapshot.get_task(ptr)) for ptr in FreeRtosList(queue.field_address(field), 'TCB_t')]
+
+    def _get_state(self, name, queue, old):
+        holder = ''
+        if queue['pcHead'] == 0 and queue['u.xSemaphore.xMutexHolder'] != 0:
+            holder = get_task_ref(get_snapshot().get_task(queue['u.xSemaphore.xMutexHolder']))
+        return QueueState(queue, name, queue['uxMessagesWaiting'], holder,
+                          self._get_waiters(queue, old, 'xTasksWaitingToSend'),
+                          self._get_waiters(queue, old, 'xTasksWaitingToReceive'))
+
+    def poll(self):
+        reader = StructReader('Queue_t')
+        previous = self._queues
+        queues = {}
+        for _, item in enumerate(read_queue_registry()):
+            queue = reader.read(item['xHandle'])
+            if (queue['uxItemSize'] == 0) != self._is_sem:
+                continue
+            old = previous.get(queue.address) if previous else None
+            if old is not None and old.queue.data == queue.data:
+                queues[queue.address] = old
+            else:
+                queues[queue.address] = self._get_state(self._get_name(item['pcQueueName']), queue, old)
+        self._queues = queues
+        if previous is None:
+            return []
+        return self._get_changes(previous, queues)
+
+    def _get_changes(self, previous, queues):
+        snd_item, rcv_item = (QueueProperty.TASKS_WAITING_TO_GIVE, QueueProperty.TASKS_WAITING_TO_TAKE) \
+            if self._is_sem else (QueueProperty.TASKS_WAITING_TO_SEND, QueueProperty.TASKS_WAITING_TO_RECEIVE)
+        rows = []
+        for _, (address, state) in enumerate(queues.items()):
+            old = previous.get(address)
+            if old is None:
+                rows.append([address, state.name, 'created', '', state.count])
+                continue
+            if old is state:
+                continue
+            for _, (change, old_val, new_val) in enumerate((('count', old.count, state.count),
+                                                            ('mutex_holder', old.mutex_holder, state.mutex_holder),
+                                                            (snd_item.title.lower(), old.snd_list, state.snd_list),
+                                                            (rcv_item.title.lower(), old.rcv_list, state.rcv_list))):
+                if old_val != new_val:
+                    rows.append([address, state.name, change, old_val, new_val])
+        for _, (address, old) in enumerate(previous.items()):
+            if address not in queues:
+                rows.append([address, old.name, 'deleted', old.count, ''])
+        return rows
+
+
+class FreeRtosQueue(CommandBase):
     """ Generate a print out of the current queues info.
     """
 
     def __init__(self):
         super().__init__('freertos queue', gdb.COMMAND_USER)
+        self._parser = get_arg_parser('freertos queue', self.__doc__)
+        self._parser.add_argument('--items', metavar='NAME',
+                                  help='Print items waiting in the queue with registry name or address NAME.')
+        self._parser.add_argument('--type', metavar='T',
+                                  help='Decode --items as C type T: a structure, integer or float type. Default: hex.')
+        add_watch_arguments(self._parser)
 
-    @staticmethod
-    def invoke(_, __):
-        show_queues_list(False)
+    def invoke(self, arg, _):
+        args = parse_args(self._parser, arg)
+        if args is None:
+            return
+        if args.unwatch:
+            stop('queue')
+            return
+        if args.items is not None:
+            show_queue_items(args.items, args.type, args.format, args.output, args.fixed_width)
+            return
+        show_queues_list(False, args.format, args.output, args.fixed_width)
+        if args.watch:
+            start('queue', QueueWatcher(False), args.format, args.output)
 
 
-class FreeRtosSemaphore(gdb.Command):
+class FreeRtosSemaphore(CommandBase):
     """ Generate a print out of the current semaphores info.
     """
 
     def __init__(self):
         super().__init__('freertos semaphore', gdb.COMMAND_USER)
+        self._parser = get_arg_parser('freertos semaphore', self.__doc__)
+        add_watch_arguments(self._parser)
 
-    @staticmethod
-    def invoke(_, __):
-        show_queues_list(True)
+    def invoke(self, arg, _):
+        args = parse_args(self._parser, arg)
+        if args is None:
+            return
+        if args.unwatch:
+            stop('semaphore')
+            return
+        show_queues_list(True, args.format, args.output, args.fixed_width)
+        if args.watch:
+            start('semaphore', QueueWatcher(True), args.format, args.output)
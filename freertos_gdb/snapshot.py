@@ -0,0 +1,478 @@
+# SPDX-FileCopyrightText: 2022 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+#
+# pylint: disable=import-error
+import argparse
+import contextlib
+import enum
+import io
+from collections import namedtuple
+from .common import CommandBase, FreeRtosList, ListWalk, gdb, parse_args
+from .memory import Address, StructReader, TargetError, lookup_symbol_name, read_memory, read_string, \
+    read_variable, target_byteorder
+from .symbols import get_kernel_symbols
+
+
+class TaskLists(enum.Enum):
+    READY = 'pxReadyTasksLists'
+    PEND_READ = 'xPendingReadyList'
+    SUSPENDED = 'xSuspendedTaskList'
+    DELAYED_1 = 'xDelayedTaskList1'
+    DELAYED_2 = 'xDelayedTaskList2'
+    WAIT_TERM = 'xTasksWaitingTermination'
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+
+    @property
+    def state(self):
+        return self.name.lower()
+
+
+TaskRecord = namedtuple('TaskRecord', 'tcb state')
+QueueRecord = namedtuple('QueueRecord', 'name queue rcv_list snd_list')
+TimerRecord = namedtuple('TimerRecord', 'timer overflow')
+
+
+class BlockedOn(namedtuple('BlockedOn', 'kind name address')):
+    """Object a task waits for: kind of the wait, object name (may be empty) and object address"""
+
+    def __str__(self):
+        return f'{self.kind} {self.name or self.address}'
+
+
+# kernel object types with event lists: type name -> ((List_t field, kind of the wait), ...)
+WAIT_LISTS = {
+    'Queue_t': (('xTasksWaitingToReceive', 'receive'), ('xTasksWaitingToSend', 'send')),
+    'EventGroup_t': (('xTasksWaitingForBits', 'bits'),),
+}
+SEMAPHORE_WAITS = {'receive': 'take', 'send': 'give'}
+
+
+def get_current_tcbs():
+    symbol = get_kernel_symbols().current_tcb
+    if symbol is None:
+        print('No symbol "pxCurrentTCB" or "pxCurrentTCBs" in current context.', end='\n\n')
+        return []
+    try:
+        current_tcb = symbol.type.decode(read_memory(symbol.address, symbol.type.size), 0, target_byteorder())
+    except TargetError as err:
+        print(err, end='\n\n')
+        return []
+
+    if isinstance(current_tcb, list):
+        return current_tcb
+    return [current_tcb]
+
+
+def get_list_addresses(symbol):
+    """Return addresses of the List_t variable. Arrays of lists are expanded"""
+    return get_kernel_symbols().list_addresses(symbol)
+
+
+def iter_list_owners(list_address, reader, item_field):
+    """Yield owners of a list whose items are embedded in their owners, e.g. timers of an active timer list.
+
+    Every owner is read with a single transfer which holds its list item too, instead of reading the item first
+    and its owner after it. The list is walked with ListWalk.
+
+    :param list_address: Address of the List_t
+    :param reader: StructReader of the owner type
+    :param item_field: Name of the ListItem_t field of the owner linked into the list
+    """
+    walk = ListWalk(list_address, reader, item_field)
+    while walk.read_next():
+        owner = walk.items[-1]
+        if walk.field(-1, 'pvOwner') != owner.address:
+            # the item is not embedded in its owner
+            owner = reader.read(walk.field(-1, 'pvOwner'))
+        yield owner
+    if walk.error is not None:
+        print(f'List at {list_address:#x} is corrupted: {walk.error}. Run "freertos check" for details.')
+
+
+def read_queue_registry():
+    """Yield used QueueRegistryItem_t entries. The whole registry is read with a single transfer"""
+    registry = get_kernel_symbols().get('xQueueRegistry')
+    item_reader = StructReader('QueueRegistryItem_t')
+    item_size = item_reader.layout.size
+    data = read_memory(registry.address, registry.type.size)
+    for _, address in enumerate(registry.element_addresses()):
+        offset = address - registry.address
+        item = item_reader.decode(address, data[offset:offset + item_size])
+        if item['xHandle'] != 0:
+            yield item
+
+
+def is_valid_list(obj, path):
+    """Check the end marker and the index of a List_t field of a structure, e.g. of a possible kernel object"""
+    end_value = obj.layout.field(path + '.xListEnd.xItemValue')[1]
+    if obj[path + '.xListEnd.xItemValue'] != (1 << 8 * end_value.size) - 1:
+        return False
+    if obj[path + '.uxNumberOfItems'] == 0:
+        # an empty list points to its end marker only
+        end_marker = obj.field_address(path + '.xListEnd')
+        return obj[path + '.pxIndex'] == end_marker and obj[path + '.xListEnd.pxNext'] == end_marker
+    return obj[path + '.pxIndex'] != 0
+
+
+def get_wait_kind(obj, kind):
+    if obj.layout.name == 'Queue_t' and obj['uxItemSize'] == 0:
+        return SEMAPHORE_WAITS[kind]
+    return kind
+
+
+class ContainerIndex:
+    """Maps event lists to the kernel objects they belong to, for the xEventListItem.pvContainer of blocked tasks.
+
+    Waiting lists of registered queues are indexed up front. Any other list is resolved once, by reading the
+    object types which have event lists at the offsets of their waiting lists and keeping the type whose lists
+    look valid. Resolving all tasks takes time linear in the number of tasks.
+
+    :param queues: QueueRecords of registered queues
+    """
+
+    def __init__(self, queues):
+        self._lists = {}
+        self._objects = {}
+        for _, record in enumerate(queues):
+            self._add(record.queue, record.name)
+        # event list items of tasks readied while the scheduler was suspended, the task is not blocked
+        index = get_kernel_symbols()
+        if 'xPendingReadyList' in index:
+            self._lists.update((address, None) for address in index.list_addresses('xPendingReadyList'))
+        self._readers = []
+        for _, (type_name, lists) in enumerate(WAIT_LISTS.items()):
+            try:
+                reader = StructReader(type_name)
+            except TargetError:
+                # e.g. event_groups.c is not linked
+                continue
+            self._readers.append((reader, lists))
+
+    def _add(self, obj, name):
+        self._objects[obj.address] = obj
+        for _, (field, kind) in enumerate(WAIT_LISTS[obj.layout.name]):
+            self._lists[obj.field_address(field)] = BlockedOn(get_wait_kind(obj, kind), name, Address(obj.address))
+
+    def resolve(self, container):
+        """Return BlockedOn for the list a task waits in, or None if the task does not wait"""
+        if container == 0:
+            return None
+        if container not in self._lists:
+            self._lists[container] = self._find_owner(container)
+        return self._lists[container]
+
+    def get_object(self, address):
+        """Return the StructSnapshot of a resolved object by its address, or None"""
+        return self._objects.get(address)
+
+    def _find_owner(self, container):
+        for _, (reader, lists) in enumerate(self._readers):
+            for _, (field, _) in enumerate(lists):
+                try:
+                    obj = reader.read(container - reader.layout.fields[field].offset)
+                except TargetError:
+                    continue
+                if self._is_valid(obj, field):
+                    name = lookup_symbol_name(obj.address) or ''
+                    self._add(obj, name)
+                    return self._lists[container]
+        return BlockedOn('wait', '', Address(container))
+
+    @staticmethod
+    def _is_valid(obj, field):
+        """Check all waiting lists of the object. The list of the task is not empty"""
+        for _, (list_field, _) in enumerate(WAIT_LISTS[obj.layout.name]):
+            if not is_valid_list(obj, list_field):
+                return False
+        if obj[field + '.uxNumberOfItems'] == 0:
+            return False
+        if obj.layout.name == 'Queue_t' and obj['uxMessagesWaiting'] > obj['uxLength']:
+            return False
+        return True
+
+
+class SystemSnapshot:
+    """FreeRTOS kernel objects captured at one target stop.
+
+    Each part (tasks, queue registry, timers, current TCBs, tick count) is read from the target on first access
+    and then reused by all commands until the target resumes. A section read partially, e.g. by Prefetch, is
+    resumed where it stopped.
+    """
+
+    def __init__(self):
+        self._current_tcbs = None
+        self._tick_count = None
+        self._sections = {}
+        # {section name: (items read so far, generator reading the rest)}
+        self._partial = {}
+        self._tcbs = {}
+        self._containers = None
+        # output of reads done by Prefetch, printed by the next command
+        self.messages = []
+
+    @property
+    def current_tcbs(self):
+        if self._current_tcbs is None:
+            self._current_tcbs = get_current_tcbs()
+        return self._current_tcbs
+
+    @property
+    def tick_count(self):
+        if self._tick_count is None:
+            self._tick_count = read_variable('xTickCount')
+        return self._tick_count
+
+    @property
+    def tasks(self):
+        return self._get_section('tasks')
+
+    @property
+    def queues(self):
+        return self._get_section('queues')
+
+    @property
+    def timers(self):
+        return self._get_section('timers')
+
+    def iter_tasks(self):
+        return self._iter_section('tasks')
+
+    def iter_queues(self):
+        return self._iter_section('queues')
+
+    def iter_timers(self):
+        return self._iter_section('timers')
+
+    def _get_section(self, name):
+        if name not in self._sections:
+            self._sections[name] = list(self._iter_section(name))
+        return self._sections[name]
+
+    def _iter_section(self, name):
+        """Yield items of a section. Items not captured yet are yielded as soon as they are read from the target"""
+        if name in self._sections:
+            yield from self._sections[name]
+            return
+        if name not in self._partial:
+            self._partial[name] = ([], getattr(self, '_read_' + name)())
+        items, reader = self._partial[name]
+        index = 0
+        while True:
+            if index == len(items):
+                try:
+                    item = next(reader, None)
+                except Exception:
+                    # the next reader starts over instead of taking the failed one as complete
+                    self._partial.pop(name, None)
+                    raise
+                if item is None:
+                    break
+                items.append(item)
+            yield items[index]
+            index += 1
+        self._sections[name] = items
+        self._partial.pop(name, None)
+
+    def get_task(self, address):
+        """Return TCB by its address. A TCB which was not captured yet is read from the target"""
+        tcb = self._tcbs.get(int(address))
+        if tcb is None:
+            tcb = StructReader('TCB_t').read(address)
+            self._tcbs[int(address)] = tcb
+        return tcb
+
+    @property
+    def containers(self):
+        """ContainerIndex of the snapshot. Built on first access"""
+        if self._containers is None:
+            try:
+                queues = self.queues
+            except TargetError:
+                # unregistered objects are still found, only without registry names
+                queues = []
+            self._containers = ContainerIndex(queues)
+        return self._containers
+
+    def blocked_on(self, tcb):
+        """Return BlockedOn of a task, or None if the task does not wait for an object"""
+        return self.containers.resolve(tcb['xEventListItem.pvContainer'])
+
+    def _read_tasks(self):
+        tcb_reader = StructReader('TCB_t')
+        for _, tl in enumerate(TaskLists):
+            try:
+                list_addresses = get_list_addresses(tl.symbol)
+            except TargetError as err:
+                print(err)
+                continue
+            for _, list_address in enumerate(list_addresses):
+                tasks = FreeRtosList(list_address, 'TCB_t', check_length=True)
+                for _, task_ptr in enumerate(tasks):
+                    if task_ptr == 0:
+                        print('SEEMS STACK WAS CORRUPTED. TASK POINTER IS NULL.')
+                        continue
+                    tcb = self._tcbs.get(task_ptr)
+                    if tcb is None:
+                        try:
+                            tcb = tcb_reader.read(task_ptr)
+                        except TargetError as err:
+                            print(f'{tl.symbol} at {list_address:#x}: {err}')
+                            continue
+                    self._tcbs[task_ptr] = tcb
+                    yield TaskRecord(tcb, tl.state)
+                if tasks.error is not None:
+                    print(f'{tl.symbol} at {list_address:#x} is corrupted: {tasks.error}. '
+                          'Run "freertos check" for details.')
+
+    def _read_queues(self):
+        queue_reader = StructReader('Queue_t')
+        for _, item in enumerate(read_queue_registry()):
+            queue = queue_reader.read(item['xHandle'])
+            yield QueueRecord(read_string(item['pcQueueName']), queue,
+                              FreeRtosList(queue.field_address('xTasksWaitingToReceive'), 'TCB_t'),
+                              FreeRtosList(queue.field_address('xTasksWaitingToSend'), 'TCB_t'))
+
+    def _read_timers(self):
+        index = get_kernel_symbols()
+        lists = [index.get('xActiveTimerList1').address, index.get('xActiveTimerList2').address]
+        # the timer daemon swaps the lists when the tick count overflows
+        if 'pxCurrentTimerList' in index and read_variable('pxCurrentTimerList') == lists[1]:
+            lists.reverse()
+        timer_reader = StructReader('Timer_t')
+        for _, (lst, is_overflow) in enumerate(zip(lists, (False, True))):
+            for _, timer in enumerate(iter_list_owners(lst, timer_reader, 'xTimerListItem')):
+                yield TimerRecord(timer, is_overflow)
+
+
+_state = {}
+
+
+def get_snapshot():
+    """Return the snapshot of the current stop, creating it if needed"""
+    snapshot = _state.get('snapshot')
+    if snapshot is None:
+        snapshot = SystemSnapshot()
+        _state['snapshot'] = snapshot
+    if snapshot.messages:
+        print(''.join(snapshot.messages), end='')
+        snapshot.messages.clear()
+    return snapshot
+
+
+def invalidate(_=None):
+    _state.pop('snapshot', None)
+
+
+if gdb is not None:
+    gdb.events.stop.connect(invalidate)
+    gdb.events.cont.connect(invalidate)
+    gdb.events.memory_changed.connect(invalidate)
+    gdb.events.new_objfile.connect(invalidate)
+    gdb.events.clear_objfiles.connect(invalidate)
+
+
+class Prefetch:
+    """Reads the snapshot of a stop ahead of commands, in small steps posted to the gdb event loop.
+
+    GDB may be used from its main thread only, so instead of a worker thread every step reads one list item or
+    object and posts the next step. The prompt stays responsive between steps, and a command typed before the
+    prefetch completes continues the sections from where the prefetch stopped. The prefetch stops as soon as its
+    snapshot is dropped, i.e. when the target resumes or memory is written.
+    """
+
+    SECTIONS = ('tasks', 'queues', 'timers')
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self._steps = self._iter_steps()
+
+    def _iter_steps(self):
+        snapshot = self.snapshot
+        yield snapshot.current_tcbs
+        for _, name in enumerate(self.SECTIONS):
+            try:
+                yield from getattr(snapshot, 'iter_' + name)()
+            except TargetError as err:
+                if name == 'tasks':
+                    print(err)
+        # objects tasks are blocked on, for the BLOCKED_ON column of freertos task
+        for _, record in enumerate(snapshot.iter_tasks()):
+            yield snapshot.blocked_on(record.tcb)
+
+    def step(self):
+        if _state.get('snapshot') is not self.snapshot:
+            return
+        messages = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(messages):
+                next(self._steps)
+        except (StopIteration, TargetError):
+            return
+        except Exception as err:  # pylint: disable=broad-except  # must not escape into the gdb event loop
+            print(f'Prefetch stopped: {type(err).__name__}: {err}')
+            return
+        finally:
+            if messages.getvalue():
+                self.snapshot.messages.append(messages.getvalue())
+        gdb.post_event(self.step)
+
+
+def start_prefetch(_=None):
+    """Create the snapshot of the current stop and prefetch it once gdb is idle"""
+    # the snapshot is read by the posted event, so the stop handler returns at once and gdb prints the stop
+    # location and runs other stop handlers (e.g. watchers) before the prefetch starts
+    gdb.post_event(lambda: Prefetch(get_snapshot()).step())
+
+
+def set_prefetch(enabled):
+    if enabled == bool(_state.get('prefetch')):
+        return
+    _state['prefetch'] = enabled
+    if enabled:
+        gdb.events.stop.connect(start_prefetch)
+        thread = gdb.selected_thread()
+        if thread is not None and thread.is_stopped():
+            start_prefetch()
+    else:
+        gdb.events.stop.disconnect(start_prefetch)
+
+
+class FreeRtosPrefetch(CommandBase):
+    """ Read FreeRTOS kernel objects in the background on every halt, so following freertos commands print at once.
+    """
+
+    def __init__(self):
+        super().__init__('freertos prefetch', gdb.COMMAND_USER)
+        # prints no table, so no --format or --output
+        self._parser = argparse.ArgumentParser(prog='freertos prefetch', description=self.__doc__)
+        self._parser.add_argument('action', choices=('on', 'off', 'status'))
+
+    def invoke(self, arg, _):
+        args = parse_args(self._parser, arg)
+        if args is None:
+            return
+        if args.action != 'status':
+            set_prefetch(args.action == 'on')
+        print(f'Prefetch is {"on" if _state.get("prefetch") else "off"}')
+
+
+class FreeRtosSnapshot(CommandBase):
+    """ Re-read FreeRTOS kernel objects from the target. Following freertos commands render from this snapshot.
+    """
+
+    def __init__(self):
+        super().__init__('freertos snapshot', gdb.COMMAND_USER)
+
+    @staticmethod
+    def invoke(_, __):
+        invalidate()
+        snapshot = get_snapshot()
+        print(f'Current TCBs: {len(snapshot.current_tcbs)}')
+        print(f'Tasks: {len(snapshot.tasks)}')
+        for name in ('queues', 'timers'):
+            try:
+                print(f'{name.capitalize()}: {len(getattr(snapshot, name))}')
+            except TargetError as err:
+                print(f'{name.capitalize()}: {err}')
@@ -0,0 +1,115 @@
+# SPDX-FileCopyrightText: 2022 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+#
+# pylint: disable=import-error
+from .common import CommandBase, gdb, get_arg_parser, open_output, parse_args, write_table
+from .memory import TargetError, read_memory
+from .snapshot import get_snapshot
+from .task import TaskProperty
+
+# tskSTACK_FILL_BYTE, task stacks are filled with it on creation
+STACK_FILL_BYTE = b'\xa5'
+
+STACK_HELP = (
+    ('SIZE', 'Stack size in bytes (pxEndOfStack - pxStack).'),
+    ('HIGH_WATER', 'Stack bytes never used since the task was created.'),
+    ('FREE', 'Stack bytes free now (pxTopOfStack - pxStack).'),
+    ('PEAK_USAGE', 'Peak stack usage in percent of SIZE.'),
+)
+
+# (TCB address, uxTCBNumber, pxStack) -> high water mark in bytes
+_high_water = {}
+
+
+def clear_cache(_=None):
+    _high_water.clear()
+
+
+if gdb is not None:
+    gdb.events.exited.connect(clear_cache)
+    gdb.events.memory_changed.connect(clear_cache)
+    gdb.events.new_objfile.connect(clear_cache)
+    gdb.events.clear_objfiles.connect(clear_cache)
+
+
+def get_high_water(tcb, rescan=False):
+    """Return the number of stack bytes which still hold the fill pattern, for stacks growing down.
+
+    Only the part of the stack below the current top of stack is read, with a single transfer. The high water
+    mark never grows, so on later halts only the part of the stack still filled at the previous halt is read.
+
+    Without uxTCBNumber a task re-created with the same TCB and stack has the same cache key. The cached mark is used
+    only if the byte above it is not the fill byte, as it would be in the stack of a new task.
+    """
+    stack = tcb['pxStack']
+    numbered = tcb.layout.has_field('uxTCBNumber')
+    key = (tcb.address, tcb['uxTCBNumber'] if numbered else None, stack)
+    limit = tcb['pxTopOfStack'] - stack
+    known = None if rescan else _high_water.get(key)
+    if known is not None and not numbered and known < limit and read_memory(stack + known, 1) == STACK_FILL_BYTE:
+        known = None
+    if known is not None:
+        limit = min(limit, known)
+    high_water = 0
+    if limit > 0:
+        data = read_memory(stack, limit)
+        high_water = len(data) - len(data.lstrip(STACK_FILL_BYTE))
+    _high_water[key] = high_water
+    return high_water
+
+
+def get_table_row(tcb, rescan=False):
+    size = tcb['pxEndOfStack'] - tcb['pxStack'] if tcb.layout.has_field('pxEndOfStack') else ''
+    try:
+        high_water = get_high_water(tcb, rescan)
+    except TargetError:
+        high_water = ''
+    peak_usage = ''
+    if size and high_water != '':
+        peak_usage = round(100 * (size - high_water) / size, 1)
+    return [TaskProperty.ID.get_val_as_is(tcb.address), TaskProperty.NAME.get_string_val(tcb), size, high_water,
+            TaskProperty.SL.get_sl_val(tcb), peak_usage]
+
+
+def risk_key(row):
+    """Highest peak usage first, then the smallest high water mark"""
+    _, _, _, high_water, _, peak_usage = row
+    return (-peak_usage if peak_usage != '' else 0, high_water if high_water != '' else 0)
+
+
+def get_table_headers():
+    return ['ID', 'NAME'] + [title for title, _ in STACK_HELP]
+
+
+def print_help(stream=None):
+    for _, (title, help_) in enumerate(STACK_HELP):
+        print(title + '\t - ' + help_, file=stream)
+    print('', file=stream)
+
+
+def show(fmt='table', output=None, fixed_width=None, rescan=False):
+    snapshot = get_snapshot()
+    table = sorted((get_table_row(task.tcb, rescan) for task in snapshot.iter_tasks()), key=risk_key)
+    if not table:
+        return
+    with open_output(output) as stream:
+        if fmt == 'table':
+            print_help(stream)
+        write_table(table, get_table_headers(), fmt, stream, fixed_width)
+
+
+class FreeRtosStack(CommandBase):
+    """ Generate a print out of task stacks high water marks, most used stacks first.
+    """
+
+    def __init__(self):
+        super().__init__('freertos stack', gdb.COMMAND_USER)
+        self._parser = get_arg_parser('freertos stack', self.__doc__)
+        self._parser.add_argument('--rescan', action='store_true',
+                                  help='Read whole stacks again instead of reusing results of previous halts.')
+
+    def invoke(self, arg, _):
+        args = parse_args(self._parser, arg)
+        if args is None:
+            return
+        show(args.format, args.output, args.fixed_width, args.rescan)
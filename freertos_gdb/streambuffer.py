@@ -0,0 +1,110 @@
+# SPDX-FileCopyrightText: 2022 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+#
+# pylint: disable=import-error
+from .common import CommandBase, gdb, get_arg_parser, open_output, parse_args, write_table
+from .discovery import get_discovery
+from .memory import Address, TargetError, get_struct_layout
+from .snapshot import get_snapshot
+from .task import get_task_ref
+
+# ucFlags bits, see stream_buffer.c
+IS_MESSAGE_BUFFER = 0x01
+KNOWN_FLAGS = 0x07
+
+STREAMBUFFER_HELP = (
+    ('TYPE', 'stream or message buffer.'),
+    ('SIZE', 'Capacity in bytes, one byte of xLength is always kept free.'),
+    ('USED', 'Bytes in the buffer, message lengths included for message buffers.'),
+    ('FILL', 'Percent of the capacity used.'),
+    ('TRIGGER', 'Bytes which must be in the buffer to unblock a waiting receiver, xTriggerLevelBytes.'),
+    ('WAITING_TO_RECEIVE', 'Task blocked waiting for data.'),
+    ('WAITING_TO_SEND', 'Task blocked waiting for space.'),
+)
+
+
+def is_stream_buffer(buffer):
+    length = buffer['xLength']
+    if length < 2 or buffer['xHead'] >= length or buffer['xTail'] >= length or buffer['pucBuffer'] == 0:
+        return False
+    if buffer['xTriggerLevelBytes'] > length:
+        return False
+    return not buffer.layout.has_field('ucFlags') or not buffer['ucFlags'] & ~KNOWN_FLAGS
+
+
+def is_in_block(buffer, size):
+    """Check that the storage follows the structure in the heap block, see xStreamBufferGenericCreate()"""
+    return buffer['pucBuffer'] == buffer.address + buffer.layout.size and \
+        buffer.layout.size + buffer['xLength'] <= size
+
+
+def get_stream_buffer_discovery():
+    return get_discovery('StreamBuffer_t', ('StaticStreamBuffer_t', 'StaticMessageBuffer_t', 'StreamBuffer_t'),
+                         ('StreamBufferHandle_t', 'MessageBufferHandle_t'), is_stream_buffer, is_in_block)
+
+
+def get_used(buffer):
+    """Return bytes in the buffer, see prvBytesInBuffer()"""
+    return (buffer['xLength'] + buffer['xHead'] - buffer['xTail']) % buffer['xLength']
+
+
+def get_task(snapshot, address):
+    if address == 0:
+        return ''
+    try:
+        return get_task_ref(snapshot.get_task(address))
+    except TargetError:
+        return Address(address)
+
+
+def get_table_rows(snapshot):
+    rows = []
+    for _, (buffer, name) in enumerate(get_stream_buffer_discovery().find()):
+        message = buffer.layout.has_field('ucFlags') and buffer['ucFlags'] & IS_MESSAGE_BUFFER
+        size = buffer['xLength'] - 1
+        used = get_used(buffer)
+        rows.append([Address(buffer.address), name, 'message' if message else 'stream', size, used,
+                     round(100 * used / size, 1), buffer['xTriggerLevelBytes'],
+                     get_task(snapshot, buffer['xTaskWaitingToReceive']),
+                     get_task(snapshot, buffer['xTaskWaitingToSend'])])
+    return rows
+
+
+def print_help(stream=None):
+    for _, (title, help_) in enumerate(STREAMBUFFER_HELP):
+        print(title + '\t - ' + help_, file=stream)
+    print('', file=stream)
+
+
+def show(fmt='table', output=None, fixed_width=None, rescan=False):
+    try:
+        get_struct_layout('StreamBuffer_t')
+    except TargetError as err:
+        raise TargetError('No stream or message buffers in the program: StreamBuffer_t is not found') from err
+    if rescan:
+        get_stream_buffer_discovery().rescan()
+    rows = get_table_rows(get_snapshot())
+    with open_output(output) as stream:
+        if fmt == 'table':
+            print_help(stream)
+        write_table(rows, ['ID', 'NAME'] + [title for title, _ in STREAMBUFFER_HELP], fmt, stream, fixed_width)
+
+
+class FreeRtosStreamBuffer(CommandBase):
+    """ Generate a print out of stream and message buffers, their fill levels and waiting tasks.
+    """
+
+    def __init__(self):
+        super().__init__('freertos streambuffer', gdb.COMMAND_USER)
+        self._parser = get_arg_parser('freertos streambuffer', self.__doc__)
+        self._parser.add_argument('--rescan', action='store_true',
+                                  help='Scan the heap again for buffers created since the previous scan.')
+
+    def invoke(self, arg, _):
+        args = parse_args(self._parser, arg)
+        if args is None:
+            return
+        try:
+            show(args.format, args.output, args.fixed_width, args.rescan)
+        except TargetError as err:
+            print(err)
@@ -0,0 +1,90 @@
+# SPDX-FileCopyrightText: 2022 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+#
+# pylint: disable=import-error
+from .common import CommandBase, gdb, get_arg_parser, open_output, parse_args, write_table
+from .memory import SymbolNotFound, TargetError, TypeCode, get_cached, lookup_symbol
+
+KERNEL_SYMBOLS = (
+    # tasks.c
+    'pxCurrentTCB', 'pxCurrentTCBs', 'pxReadyTasksLists', 'xDelayedTaskList1', 'xDelayedTaskList2',
+    'pxDelayedTaskList', 'pxOverflowDelayedTaskList', 'xPendingReadyList', 'xSuspendedTaskList',
+    'xTasksWaitingTermination', 'uxCurrentNumberOfTasks', 'uxTaskNumber', 'xTickCount', 'uxTopReadyPriority',
+    'xSchedulerRunning', 'uxSchedulerSuspended', 'xYieldPending', 'xYieldPendings',
+    # queue.c
+    'xQueueRegistry',
+    # timers.c
+    'xActiveTimerList1', 'xActiveTimerList2', 'pxCurrentTimerList', 'pxOverflowTimerList', 'xTimerQueue',
+    'xTimerTaskHandle',
+)
+
+
+class KernelSymbols:
+    """Addresses, types and array bounds of FreeRTOS kernel globals, resolved once per loaded objfile.
+
+    Detects the kernel variant by the current TCB variable:
+
+    - 'single-core': vanilla FreeRTOS, pxCurrentTCB is a pointer
+    - 'esp-idf': ESP-IDF FreeRTOS, pxCurrentTCB is an array with a TCB per core
+    - 'smp': FreeRTOS SMP kernel, pxCurrentTCBs is an array with a TCB per core
+    """
+
+    def __init__(self):
+        self.symbols = {}
+        for _, name in enumerate(KERNEL_SYMBOLS):
+            try:
+                self.symbols[name] = lookup_symbol(name)
+            except TargetError:
+                pass
+        self.current_tcb = self.symbols.get('pxCurrentTCB') or self.symbols.get('pxCurrentTCBs')
+        if self.current_tcb is None:
+            self.variant = 'unknown'
+            self.num_cores = 0
+        elif self.current_tcb.type.code is not TypeCode.ARRAY:
+            self.variant = 'single-core'
+            self.num_cores = 1
+        else:
+            self.variant = 'smp' if self.current_tcb.name == 'pxCurrentTCBs' else 'esp-idf'
+            self.num_cores = self.current_tcb.type.count
+
+    def __contains__(self, name):
+        return name in self.symbols
+
+    def get(self, name):
+        symbol = self.symbols.get(name)
+        if symbol is None:
+            raise SymbolNotFound(f'No symbol "{name}" in current context.')
+        return symbol
+
+    def list_addresses(self, name):
+        """Return addresses of the List_t variable. Arrays of lists are expanded"""
+        return self.get(name).element_addresses()
+
+
+def get_kernel_symbols():
+    return get_cached('kernel_symbols', KernelSymbols)
+
+
+def show(fmt='table', output=None, fixed_width=None):
+    index = get_kernel_symbols()
+    rows = [[name, symbol.address, symbol.type.code.value, symbol.type.size, symbol.type.count or '']
+            for name, symbol in index.symbols.items()]
+    with open_output(output) as stream:
+        if fmt == 'table':
+            print(f'Kernel: {index.variant}, cores: {index.num_cores}\n', file=stream)
+        write_table(rows, ['NAME', 'ADDRESS', 'TYPE', 'SIZE', 'COUNT'], fmt, stream, fixed_width)
+
+
+class FreeRtosSymbols(CommandBase):
+    """ Generate a print out of resolved FreeRTOS kernel variables and the detected kernel variant.
+    """
+
+    def __init__(self):
+        super().__init__('freertos symbols', gdb.COMMAND_USER)
+        self._parser = get_arg_parser('freertos symbols', self.__doc__)
+
+    def invoke(self, arg, _):
+        args = parse_args(self._parser, arg)
+        if args is None:
+            return
+        show(args.format, args.output, args.fixed_width)
@@ -2,25 +2,12 @@
 # SPDX-License-Identifier: Apache-2.0
 #
 # pylint: disable=import-error
-import gdb
-import enum
-from .common import StructProperty, FreeRtosList, print_table
-
-
-class TaskLists(enum.Enum):
-    READY = 'pxReadyTasksLists'
-    PEND_READ = 'xPendingReadyList'
-    SUSPENDED = 'xSuspendedTaskList'
-    DELAYED_1 = 'xDelayedTaskList1'
-    DELAYED_2 = 'xDelayedTaskList2'
-    WAIT_TERM = 'xTasksWaitingTermination'
-
-    def __init__(self, symbol):
-        self.symbol = symbol
-
-    @property
-    def state(self):
-        return self.name.lower()
+from collections import namedtuple
+from .common import CommandBase, StructProperty, gdb, get_arg_parser, open_output, parse_args, peek_rows, \
+    write_table
+from .memory import TargetError, get_struct_layout, read_variable
+from .snapshot import TaskLists, get_snapshot
+from .watch import ListTracker, Watcher, add_watch_arguments, lookup_symbols, read_list_headers, start, stop
 
 
 class TaskProperty(StructProperty):
@@ -29,6 +16,8 @@ class TaskProperty(StructProperty):
     TCB_NUM = ('Number that increments each time a TCB is created', 'uxTCBNumber', 'get_val')
     NAME = ('', 'pcTaskName', 'get_string_val')
     STATUS = ('', '', 'get_val_as_is')
+    BLOCKED_ON = ('Queue, semaphore, mutex or event group the task waits for. Named by the queue registry or the '
+                  'nearest ELF symbol.', '', 'get_val_as_is')
     AF = ('CPU affinity', 'xCoreID', 'get_af_val')
     PRI = ('Task priority', 'uxPriority', 'get_val')
     B_PRI = ('Base priority.', 'uxPriority', 'get_val')
@@ -51,38 +40,28 @@ class TaskProperty(StructProperty):
         return abs(int(task['pxStack']) - int(task['pxTopOfStack']))
 
 
-def get_current_tcbs():
-    current_tcb_arr = []
-    try:
-        current_tcb = gdb.parse_and_eval('pxCurrentTCB')
-    except gdb.error as err:
-        try:
-            current_tcb = gdb.parse_and_eval('pxCurrentTCBs')
-        except gdb.error as err:
-            print(err, end='\n\n')
-            return current_tcb_arr
+class TaskRef(namedtuple('TaskRef', 'id name')):
+    """Task reference shown in tables of other objects: TCB address and task name"""
 
-    if current_tcb.type.code == gdb.TYPE_CODE_ARRAY:
-        r = current_tcb.type.range()
-        for idx in range(r[0], r[1] + 1):
-            current_tcb_arr.append(current_tcb[idx])
-    else:
-        current_tcb_arr.append(current_tcb)
-    return current_tcb_arr
+    def __str__(self):
+        return f'{self.id} {self.name}'
 
 
-def print_help(tcb_struct):
+def get_task_ref(tcb):
+    return TaskRef(TaskProperty.ID.get_val_as_is(tcb.address), TaskProperty.NAME.get_string_val(tcb))
+
+
+def print_help(tcb_struct, stream=None):
     for _, item in enumerate(TaskProperty):
-        item.print_property_help(tcb_struct)
-    print('')
+        item.print_property_help(tcb_struct, stream)
+    print('', file=stream)
 
 
-def get_table_row(task_ptr, state, current_tcbs):
+def get_table_row(task, state, current_tcbs, blocked_on=None):
     row = []
-    task = task_ptr.referenced_value()
-    fields = task_ptr.type.target()
+    fields = task.layout
     try:
-        cpu_id = current_tcbs.index(task_ptr)
+        cpu_id = current_tcbs.index(task.address)
         cpu_id_str = 'CPU' + str(cpu_id)
     except ValueError:
         cpu_id_str = ''
@@ -95,27 +74,19 @@ def get_table_row(task_ptr, state, current_tcbs):
         if item is TaskProperty.CPU:
             val = cpu_id_str
 
+        if item is TaskProperty.BLOCKED_ON:
+            val = blocked_on
+
         if item is TaskProperty.ID:
-            val = task_ptr
+            val = task.address
 
         if not item.exist(fields):
             continue
 
-        row.append(item.value_str(val))
+        row.append(item.get_value(val))
     return row
 
 
-def get_table_rows(list_, state, current_tcbs):
-    table = []
-    rtos_list = FreeRtosList(list_, 'TCB_t', check_length=True)
-    for _, task_ptr in enumerate(rtos_list):
-        if task_ptr == 0:
-            print('SEEMS STACK WAS CORRUPTED. TASK POINTER IS NULL.')
-        row = get_table_row(task_ptr, state, current_tcbs)
-        table.append(row)
-    return table
-
-
 def get_table_headers(tcb_type):
     row = []
     for _, item in enumerate(TaskProperty):
@@ -125,39 +96,110 @@ def get_table_headers(tcb_type):
     return row
 
 
-def show():
-    table = []
-    current_tcbs = get_current_tcbs()
+def show(fmt='table', output=None, fixed_width=None):
+    snapshot = get_snapshot()
+    table = peek_rows(get_table_row(task.tcb, task.state, snapshot.current_tcbs, snapshot.blocked_on(task.tcb))
+                      for task in snapshot.iter_tasks())
+    if table is None:
+        return
+    tcb_layout = get_struct_layout('TCB_t')
+    with open_output(output) as stream:
+        if fmt == 'table':
+            print_help(tcb_layout, stream)
+        write_table(table, get_table_headers(tcb_layout), fmt, stream, fixed_width)
 
-    for _, tl in enumerate(TaskLists):
+
+TaskState = namedtuple('TaskState', 'name state priority free_stack')
+
+# kernel counters which change when a task is created or deleted
+TASK_COUNTERS = ('uxTaskNumber', 'uxCurrentNumberOfTasks')
+
+
+def read_task_counters():
+    counters = []
+    for _, name in enumerate(TASK_COUNTERS):
         try:
-            tl_value = gdb.parse_and_eval(tl.symbol)
-        except gdb.error as err:
-            print(err)
-            continue
+            counters.append(read_variable(name))
+        except TargetError:
+            counters.append(None)
+    return counters
 
-        if tl_value.type.code == gdb.TYPE_CODE_ARRAY:
-            r = tl_value.type.range()
-            for idx in range(r[0], r[1] + 1):
-                table_rows = get_table_rows(tl_value[idx], tl.state, current_tcbs)
-                table.extend(table_rows)
-        else:
-            table_rows = get_table_rows(tl_value, tl.state, current_tcbs)
-            table.extend(table_rows)
-    if len(table) == 0:
-        return
-    tcb_type = gdb.lookup_type('TCB_t')
-    print_help(tcb_type)
-    print_table(table, get_table_headers(tcb_type))
 
+class TaskWatcher(Watcher):
+    """Reports task state transitions, priority changes, new stack minimums and created or deleted tasks.
 
-class FreeRtosTask(gdb.Command):
+    Task lists are walked again only if their headers or the task creation counters changed
+    """
+
+    title = 'Tasks'
+
+    def __init__(self):
+        self._tracker = ListTracker('TCB_t', 'xStateListItem')
+        self._symbols = lookup_symbols(tl.symbol for tl in TaskLists)
+        self._list_states = {}
+        for _, tl in enumerate(TaskLists):
+            for _, symbol in enumerate(self._symbols):
+                if symbol.name == tl.symbol:
+                    self._list_states.update((address, tl.state) for address in symbol.element_addresses())
+        self._counters = None
+        self._tasks = None
+        self._min_free_stack = {}
+
+    def poll(self):
+        counters = read_task_counters()
+        lists = self._tracker.update(read_list_headers(self._symbols), force=counters != self._counters)
+        self._counters = counters
+        tasks = {}
+        for _, (address, tcbs) in enumerate(lists.items()):
+            for _, tcb in enumerate(tcbs):
+                tasks[tcb.address] = TaskState(TaskProperty.NAME.get_string_val(tcb), self._list_states[address],
+                                               tcb['uxPriority'], TaskProperty.SL.get_sl_val(tcb))
+        previous = self._tasks
+        self._tasks = tasks
+        if previous is None:
+            self._min_free_stack = {address: task.free_stack for address, task in tasks.items()}
+            return []
+        return self._get_changes(previous, tasks)
+
+    def _get_changes(self, previous, tasks):
+        rows = []
+        for _, (address, task) in enumerate(tasks.items()):
+            old = previous.get(address)
+            if old is None:
+                rows.append([address, task.name, 'created', '', task.state])
+                self._min_free_stack[address] = task.free_stack
+                continue
+            if old.state != task.state:
+                rows.append([address, task.name, 'state', old.state, task.state])
+            if old.priority != task.priority:
+                rows.append([address, task.name, 'priority', old.priority, task.priority])
+            if task.free_stack < self._min_free_stack[address]:
+                rows.append([address, task.name, 'stack_min_free', self._min_free_stack[address],
+                             task.free_stack])
+                self._min_free_stack[address] = task.free_stack
+        for _, (address, old) in enumerate(previous.items()):
+            if address not in tasks:
+                rows.append([address, old.name, 'deleted', old.state, ''])
+                self._min_free_stack.pop(address, None)
+        return rows
+
+
+class FreeRtosTask(CommandBase):
     """ Generate a print out of the current tasks and their states.
     """
 
     def __init__(self):
         super().__init__('freertos task', gdb.COMMAND_USER)
-
-    @staticmethod
-    def invoke(_, __):
-        show()
+        self._parser = get_arg_parser('freertos task', self.__doc__)
+        add_watch_arguments(self._parser)
+
+    def invoke(self, arg, _):
+        args = parse_args(self._parser, arg)
+        if args is None:
+            return
+        if args.unwatch:
+            stop('task')
+            return
+        show(args.format, args.output, args.fixed_width)
+        if args.watch:
+            start('task', TaskWatcher(), args.format, args.output)
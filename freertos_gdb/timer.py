@@ -2,8 +2,13 @@
 # SPDX-License-Identifier: Apache-2.0
 #
 # pylint: disable=import-error
-import gdb
-from .common import StructProperty, FreeRtosList, print_table
+from collections import namedtuple
+from .common import CommandBase, StructProperty, gdb, get_arg_parser, open_output, parse_args, write_table
+from .memory import Address, CodeAddress, StructReader, TargetError, get_struct_layout, lookup_symbol_name, \
+    read_string, read_variable
+from .queue import read_queue_items
+from .snapshot import get_snapshot
+from .watch import ListTracker, Watcher, add_watch_arguments, lookup_symbols, read_list_headers, start, stop
 
 
 class TimerProperty(StructProperty):
@@ -11,81 +16,258 @@ class TimerProperty(StructProperty):
     NAME = ('', 'pcTimerName', 'get_string_val')
     NUMBER = ('Timer number', 'uxTimerNumber', 'get_val')
     OVERFLOW = ('True if timer has been overflow', '', 'get_empty_val')
+    EXPIRY = ('Tick count at which the timer fires, beyond the tick count overflow for overflow timers.',
+              'xTimerListItem.xItemValue', 'get_empty_val')
+    TICKS_LEFT = ('Ticks until the timer fires. Negative if the timer is overdue: the timer daemon task is starved.',
+                  'xTimerListItem.xItemValue', 'get_empty_val')
     PERIOD_IN_TICKS = ('How quickly and often the timer expires.', 'xTimerPeriodInTicks', 'get_val')
     STATUS = ('Holds bits to say if the timer was statically allocated or not, and if it is active or not.',
               'ucStatus', 'get_val')
-    CALLBACK_FN = ('', 'pxCallbackFunction', 'get_val')
+    CALLBACK_FN = ('', 'pxCallbackFunction', 'get_fn_val')
 
+    def get_fn_val(self, timer):
+        address = timer[self.property]
+        return CodeAddress(address, lookup_symbol_name(address))
 
-class Timers:
-    def __init__(self):
-        try:
-            self._current = gdb.parse_and_eval('xActiveTimerList1')
-            self._overflow = gdb.parse_and_eval('xActiveTimerList2')
-            self._timer_struct = gdb.lookup_type('Timer_t')
-        except gdb.error as err:
-            raise err
 
-    def show(self):
-        table = []
+def get_ticks_left(timer, overflow, tick_count):
+    """Return ticks until the timer fires, negative if it is overdue"""
+    mask = (1 << 8 * timer.layout.field('xTimerListItem.xItemValue')[1].size) - 1
+    left = (timer['xTimerListItem.xItemValue'] - tick_count) & mask
+    # timers of the current list fire before the tick count overflows, a distance of more than half of the tick
+    # range means the expiry time has passed
+    if not overflow and left > mask >> 1:
+        left -= mask + 1
+    return left
 
-        # extend table with current timers
-        rows = self.get_timer_list_table(self._current)
-        table.extend(rows)
 
-        # extend table with overflow timers
-        rows = self.get_timer_list_table(self._overflow)
-        table.extend(rows)
+class Timers:
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+        self._timer_layout = get_struct_layout('Timer_t')
 
-        if len(table) == 0:
+    def show(self, fmt='table', output=None, fixed_width=None):
+        table = self.get_table_rows()
+        if not table:
             return
 
         # print the table
-        self.print_help()
-        print_table(table, self.get_table_headers())
+        headers = self.get_table_headers()
+        with open_output(output) as stream:
+            if fmt == 'table':
+                self.print_help(stream)
+            write_table(table, headers, fmt, stream, fixed_width)
+            if fmt == 'table':
+                self.print_overdue(table, headers.index(TimerProperty.TICKS_LEFT.title), stream)
+
+    @staticmethod
+    def print_overdue(table, column, stream=None):
+        overdue = [row[column] for row in table if row[column] < 0]
+        if overdue:
+            print(f'\n{len(overdue)} timers are overdue by up to {-min(overdue)} ticks, '
+                  'the timer daemon task is starved.', file=stream)
 
-    def get_timer_list_table(self, lst):
-        table = []
-        rtos_list = FreeRtosList(lst, 'Timer_t')
-        for _, timer_ptr in enumerate(rtos_list):
-            row = self.get_table_row(timer_ptr, lst == self._overflow)
-            table.append(row)
-        return table
+    def get_table_rows(self):
+        """Return rows of active timers merged from the current and overflow lists in the order they fire"""
+        tick_count = self._snapshot.tick_count
+        timers = []
+        for _, record in enumerate(self._snapshot.iter_timers()):
+            timers.append((get_ticks_left(record.timer, record.overflow, tick_count), record))
+        timers.sort(key=lambda item: item[0])
+        return [self.get_table_row(self._timer_layout, record.timer, record.overflow, tick_count, left)
+                for left, record in timers]
 
     def get_table_headers(self):
-        return [item.title for _, item in enumerate(TimerProperty) if item.exist(self._timer_struct)]
+        return [item.title for _, item in enumerate(TimerProperty) if item.exist(self._timer_layout)]
 
-    def print_help(self):
+    def print_help(self, stream=None):
         for _, item in enumerate(TimerProperty):
-            item.print_property_help(self._timer_struct)
-        print('')
+            item.print_property_help(self._timer_layout, stream)
+        print('', file=stream)
 
     @staticmethod
-    def get_table_row(timer_ptr, overflow):
+    def get_table_row(timer_layout, timer, overflow, tick_count, ticks_left):
         row = []
-        timer = timer_ptr.dereference()
         for _, item in enumerate(TimerProperty):
             if item == TimerProperty.OVERFLOW:
                 row.append(int(overflow))
                 continue
 
-            if not item.exist(timer.type.target()):
+            if item == TimerProperty.EXPIRY:
+                row.append(tick_count + ticks_left)
                 continue
 
-            row.append(item.value_str(timer))
+            if item == TimerProperty.TICKS_LEFT:
+                row.append(ticks_left)
+                continue
+
+            if not item.exist(timer_layout):
+                continue
+
+            row.append(item.get_value(timer))
         return row
 
 
-class FreeRtosTimer(gdb.Command):
+def show(fmt='table', output=None, fixed_width=None):
+    try:
+        Timers(get_snapshot()).show(fmt, output, fixed_width)
+    except TargetError as err:
+        print(err)
+
+
+# xMessageID values of DaemonTaskMessage_t, see timers.h
+TIMER_COMMANDS = {
+    -2: 'execute_callback_from_isr',
+    -1: 'execute_callback',
+    0: 'start_dont_trace',
+    1: 'start',
+    2: 'reset',
+    3: 'stop',
+    4: 'change_period',
+    5: 'delete',
+    6: 'start_from_isr',
+    7: 'reset_from_isr',
+    8: 'stop_from_isr',
+    9: 'change_period_from_isr',
+}
+
+PENDING_HELP = (
+    ('COMMAND', 'Command sent to the timer daemon task.'),
+    ('TARGET', 'Timer the command is for, or the function pended by xTimerPendFunctionCall().'),
+    ('PARAMETER', 'Tick count the command was sent at for start and reset, the new period for change_period. '
+                  'pvParameter1 and ulParameter2 of pended functions.'),
+)
+
+
+class PendingTimerCommands:
+    """Commands waiting in xTimerQueue for the timer daemon task, oldest first.
+
+    The queue storage is read with a single transfer and decoded as DaemonTaskMessage_t items. queue is None
+    until the timer queue is created by the scheduler start.
+    """
+
+    def __init__(self):
+        queue_address = read_variable('xTimerQueue')
+        self.queue = StructReader('Queue_t').read(queue_address) if queue_address else None
+        self._reader = StructReader('DaemonTaskMessage_t')
+        self._timer_reader = StructReader('Timer_t')
+        if self.queue is not None and self.queue['uxItemSize'] != self._reader.layout.size:
+            raise TargetError(f'xTimerQueue item size {self.queue["uxItemSize"]} does not match '
+                              f'DaemonTaskMessage_t size {self._reader.layout.size}')
+
+    def get_table_rows(self):
+        rows = []
+        if self.queue is None:
+            return rows
+        for _, data in enumerate(read_queue_items(self.queue)):
+            message = self._reader.decode(0, data)
+            command = message['xMessageID']
+            if command < 0:
+                callback = message['u.xCallbackParameters.pxCallbackFunction']
+                rows.append([TIMER_COMMANDS.get(command, command), CodeAddress(callback, lookup_symbol_name(callback)),
+                             [Address(message['u.xCallbackParameters.pvParameter1']),
+                              message['u.xCallbackParameters.ulParameter2']]])
+                continue
+            timer = message['u.xTimerParameters.pxTimer']
+            try:
+                name = self._timer_reader.read(timer).string('pcTimerName') or Address(timer)
+            except TargetError:
+                name = Address(timer)
+            rows.append([TIMER_COMMANDS.get(command, command), name, message['u.xTimerParameters.xMessageValue']])
+        return rows
+
+
+def show_pending(fmt='table', output=None, fixed_width=None):
+    try:
+        pending = PendingTimerCommands()
+        table = pending.get_table_rows()
+    except TargetError as err:
+        print(err)
+        return
+    with open_output(output) as stream:
+        if fmt == 'table':
+            if pending.queue is None:
+                print('Pending timer commands: 0, xTimerQueue is not created yet\n', file=stream)
+                return
+            print(f'Pending timer commands: {len(table)} of {pending.queue["uxLength"]}\n', file=stream)
+            if not table:
+                return
+            for _, (title, help_) in enumerate(PENDING_HELP):
+                print(title + '\t - ' + help_, file=stream)
+            print('', file=stream)
+        write_table(table, [title for title, _ in PENDING_HELP], fmt, stream, fixed_width)
+
+
+TimerState = namedtuple('TimerState', 'name timer_list period expiry')
+
+
+class TimerWatcher(Watcher):
+    """Reports started and stopped timers, moves between active timer lists, period and expiry changes.
+
+    Active timer lists are walked again only if their headers changed
+    """
+
+    title = 'Timers'
+
+    def __init__(self):
+        self._tracker = ListTracker('Timer_t', 'xTimerListItem')
+        self._symbols = lookup_symbols(('xActiveTimerList1', 'xActiveTimerList2'))
+        self._timers = None
+        self._names = {}
+
+    def _get_name(self, name_ptr):
+        if name_ptr not in self._names:
+            self._names[name_ptr] = read_string(name_ptr) if name_ptr else ''
+        return self._names[name_ptr]
+
+    def poll(self):
+        lists = self._tracker.update(read_list_headers(self._symbols))
+        list_names = {symbol.address: symbol.name for symbol in self._symbols}
+        timers = {}
+        for _, (address, list_timers) in enumerate(lists.items()):
+            for _, timer in enumerate(list_timers):
+                timers[timer.address] = TimerState(self._get_name(timer['pcTimerName']), list_names[address],
+                                                   timer['xTimerPeriodInTicks'], timer['xTimerListItem.xItemValue'])
+        previous = self._timers
+        self._timers = timers
+        if previous is None:
+            return []
+        rows = []
+        for _, (address, state) in enumerate(timers.items()):
+            old = previous.get(address)
+            if old is None:
+                rows.append([address, state.name, 'started', '', state.timer_list])
+                continue
+            for _, field in enumerate(('timer_list', 'period', 'expiry')):
+                if getattr(old, field) != getattr(state, field):
+                    rows.append([address, state.name, field, getattr(old, field), getattr(state, field)])
+        for _, (address, old) in enumerate(previous.items()):
+            if address not in timers:
+                rows.append([address, old.name, 'stopped', old.timer_list, ''])
+        return rows
+
+
+class FreeRtosTimer(CommandBase):
     """ Generate a print out of the current timers info.
     """
 
     def __init__(self):
         super().__init__('freertos timer', gdb.COMMAND_USER)
+        self._parser = get_arg_parser('freertos timer', self.__doc__)
+        self._parser.add_argument('--pending', action='store_true',
+                                  help='Print commands waiting in the timer command queue instead of timers.')
+        add_watch_arguments(self._parser)
 
-    @staticmethod
-    def invoke(_, __):
-        try:
-            Timers().show()
-        except gdb.error as err:
-            print(err)
+    def invoke(self, arg, _):
+        args = parse_args(self._parser, arg)
+        if args is None:
+            return
+        if args.unwatch:
+            stop('timer')
+            return
+        if args.pending:
+            show_pending(args.format, args.output, args.fixed_width)
+            return
+        show(args.format, args.output, args.fixed_width)
+        if args.watch:
+            start('timer', TimerWatcher(), args.format, args.output)
@@ -0,0 +1,229 @@
+# SPDX-FileCopyrightText: 2022 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+#
+# pylint: disable=import-error
+import threading
+from collections import namedtuple
+from .common import CommandBase, gdb, get_arg_parser, open_output, parse_args
+from .memory import TargetError, get_struct_layout, read_memory, target_byteorder
+from .snapshot import get_snapshot
+from .symbols import get_kernel_symbols
+from .task import TaskProperty, read_task_counters
+from .watch import Watcher, show_changes, start, stop
+
+TOP_HELP = (
+    ('AF', 'CPU affinity.'),
+    ('LOAD', 'Percent of one core the task used since the previous sample.'),
+    ('DELTA', 'Increase of ulRunTimeCounter since the previous sample.'),
+    ('RTC', 'ulRunTimeCounter, total run time of the task.'),
+)
+
+SampledTask = namedtuple('SampledTask', 'name affinity')
+
+
+class RunTimeSampler:
+    """Samples ulRunTimeCounter of all tasks.
+
+    The task list is walked only on the first sample and when a task was created or deleted since the previous
+    one. Otherwise only the counter of every known TCB is read.
+    """
+
+    def __init__(self):
+        self.tasks = {}
+        self._counters = None
+        self._samples = None
+
+    def _refresh(self):
+        self.tasks = {}
+        samples = {}
+        for _, record in enumerate(get_snapshot().iter_tasks()):
+            tcb = record.tcb
+            affinity = TaskProperty.AF.get_value(tcb) if TaskProperty.AF.exist(tcb.layout) else ''
+            self.tasks[tcb.address] = SampledTask(TaskProperty.NAME.get_string_val(tcb), affinity)
+            samples[tcb.address] = tcb['ulRunTimeCounter']
+        return samples
+
+    def _read_counters_only(self):
+        offset, field = get_struct_layout('TCB_t').field('ulRunTimeCounter')
+        offset += field.offset
+        byteorder = target_byteorder()
+        return {address: int.from_bytes(read_memory(address + offset, field.size), byteorder)
+                for address in self.tasks}
+
+    def sample(self):
+        """Return {TCB address: (counter, delta since the previous sample)}, or None on the first sample"""
+        counters = read_task_counters()
+        samples = None
+        if self._samples is not None and counters == self._counters:
+            try:
+                samples = self._read_counters_only()
+            except TargetError:
+                samples = None
+        if samples is None:
+            samples = self._refresh()
+        self._counters = counters
+        previous = self._samples
+        self._samples = samples
+        if previous is None:
+            return None
+        # the counters may wrap around between samples
+        mask = (1 << 8 * get_struct_layout('TCB_t').field('ulRunTimeCounter')[1].size) - 1
+        return {address: (value, (value - previous[address]) & mask if address in previous else value)
+                for address, value in samples.items()}
+
+
+class TopWatcher(Watcher):
+    """Reports CPU load of tasks since the previous halt, highest first"""
+
+    title = 'Top'
+
+    def __init__(self, rows=None):
+        self._sampler = RunTimeSampler()
+        self.rows = rows
+        self._summary = ''
+        self.headers = ['ID', 'NAME'] + [title for title, _ in TOP_HELP]
+
+    def poll(self):
+        samples = self._sampler.sample()
+        if samples is None:
+            return []
+        cores = get_kernel_symbols().num_cores or 1
+        # time of one core, all run time is accounted to some task
+        elapsed = sum(delta for _, delta in samples.values()) / cores
+        if not elapsed:
+            self._summary = 'No run time elapsed since the previous sample'
+            return []
+        loads = {address: 100 * delta / elapsed for address, (_, delta) in samples.items()}
+        self._summary = self._get_summary(loads, cores, elapsed)
+        rows = []
+        for _, (address, (counter, delta)) in enumerate(samples.items()):
+            task = self._sampler.tasks[address]
+            rows.append([TaskProperty.ID.get_val_as_is(address), task.name, task.affinity,
+                         round(loads[address], 1), delta, counter])
+        rows.sort(key=lambda row: -row[3])
+        return rows[:self.rows] if self.rows else rows
+
+    def _get_summary(self, loads, cores, elapsed):
+        """Return 'Load: X% of N cores (CPU0 Y%, ...)' computed from the time of idle tasks"""
+        idle = {address: task for address, task in self._sampler.tasks.items() if task.name.startswith('IDLE')}
+        busy = 100 - sum(loads.get(address, 0) for address in idle) / cores
+        per_core = sorted(f'{task.affinity} {round(100 - loads.get(address, 0), 1)}%'
+                          for address, task in idle.items() if task.affinity.startswith('CPU'))
+        summary = f'Load: {round(busy, 1)}% of {cores} core{"s" if cores > 1 else ""}'
+        if per_core and cores > 1:
+            summary += f' ({", ".join(per_core)})'
+        return summary + f', run time: {int(elapsed)}'
+
+    def caption(self):
+        return self._summary
+
+
+class IntervalSampling:
+    """Lets the target run for interval seconds, interrupts it and samples, count times.
+
+    Requires a target which can run in the background ('continue&'), e.g. a remote target.
+    """
+
+    def __init__(self, interval, count):
+        self._interval = interval
+        self._left = count
+
+    def start(self):
+        gdb.events.stop.connect(self._on_stop)
+        self._resume()
+
+    def _finish(self):
+        gdb.events.stop.disconnect(self._on_stop)
+        gdb.post_event(lambda: stop('top'))
+
+    def _resume(self):
+        try:
+            gdb.execute('continue&')
+        except gdb.error as err:
+            print(err)
+            self._finish()
+            return
+        threading.Timer(self._interval, gdb.post_event, (self._interrupt,)).start()
+
+    @staticmethod
+    def _interrupt():
+        try:
+            gdb.execute('interrupt')
+        except gdb.error as err:
+            print(err)
+
+    def _on_stop(self, _):
+        self._left -= 1
+        if self._left > 0:
+            # commands must not be run from inside of the stop event handler
+            gdb.post_event(self._resume)
+        else:
+            self._finish()
+
+
+def print_help(stream=None):
+    for _, (title, help_) in enumerate(TOP_HELP):
+        print(title + '\t - ' + help_, file=stream)
+    print('', file=stream)
+
+
+_sampling = {}
+
+
+def clear_sampling(_=None):
+    _sampling.clear()
+
+
+if gdb is not None:
+    gdb.events.new_objfile.connect(clear_sampling)
+    gdb.events.clear_objfiles.connect(clear_sampling)
+
+
+class FreeRtosTop(CommandBase):
+    """ Generate a print out of tasks CPU load since the previous sample, highest first.
+    """
+
+    def __init__(self):
+        super().__init__('freertos top', gdb.COMMAND_USER)
+        self._parser = get_arg_parser('freertos top', self.__doc__)
+        group = self._parser.add_mutually_exclusive_group()
+        group.add_argument('--watch', action='store_true', help='Sample and print on every following halt.')
+        group.add_argument('--unwatch', action='store_true', help='Stop sampling on halts.')
+        group.add_argument('--interval', type=float, metavar='SECONDS',
+                           help='Run the target for SECONDS, interrupt it and print, --count times.')
+        self._parser.add_argument('--count', type=int, help='Number of --interval samples. Default: 1.')
+        self._parser.add_argument('--rows', type=int, default=None, help='Print only ROWS busiest tasks.')
+
+    def invoke(self, arg, _):
+        args = parse_args(self._parser, arg)
+        if args is None:
+            return
+        if args.unwatch:
+            stop('top')
+            return
+        if args.count is not None and args.interval is None:
+            print('--count is only used with --interval')
+            return
+        if args.format == 'table':
+            # the samples are appended to the output by show_changes()
+            with open_output(args.output, append=True) as stream:
+                print_help(stream)
+        if args.watch or args.interval:
+            # the first sample only records the counters
+            start('top', TopWatcher(args.rows), args.format, args.output)
+            if args.interval:
+                IntervalSampling(args.interval, 1 if args.count is None else args.count).start()
+            return
+        watcher = _sampling.get('watcher')
+        if watcher is None:
+            watcher = TopWatcher(args.rows)
+            _sampling['watcher'] = watcher
+            try:
+                watcher.poll()
+            except TargetError as err:
+                print(err)
+                return
+            print('Run time counters sampled, run "freertos top" again to print the load since now.')
+            return
+        watcher.rows = args.rows
+        show_changes(watcher, args.format, args.output)
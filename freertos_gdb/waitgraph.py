@@ -0,0 +1,179 @@
+# SPDX-FileCopyrightText: 2022 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+#
+# pylint: disable=import-error
+from .common import CommandBase, gdb, get_arg_parser, open_output, parse_args, write_table
+from .memory import TargetError
+from .snapshot import get_snapshot
+from .task import get_task_ref
+
+WAITGRAPH_HELP = (
+    ('WAITS', 'What the task is blocked on: receive/send for queues, take/give for semaphores and mutexes, bits '
+              'for event groups.'),
+    ('OBJECT', 'Queue registry name or the nearest ELF symbol of the object, or its address.'),
+    ('HOLDER', 'Task holding the mutex.'),
+    ('DEADLOCK', 'Number of the wait cycle the task is in.'),
+    ('INVERTED_BY', 'Tasks of a lower base priority the task waits for through a chain of mutexes, also if they '
+                    'inherited the priority of the task.'),
+)
+
+
+def get_base_priority(tcb):
+    """Return the priority of a task without a priority inherited from the mutexes it holds"""
+    return tcb['uxBasePriority'] if tcb.layout.has_field('uxBasePriority') else tcb['uxPriority']
+
+
+class WaitGraph:
+    """Task -> queue/semaphore/mutex -> holder task graph of one snapshot.
+
+    Tasks are linked to objects by the container of their xEventListItem, see ContainerIndex, so every task is
+    visited once and unregistered objects are found too.
+    """
+
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+        self.tasks = {}
+        self.edges = {}
+        for _, record in enumerate(snapshot.iter_tasks()):
+            self.tasks[record.tcb.address] = record.tcb
+            blocked_on = snapshot.blocked_on(record.tcb)
+            if blocked_on is not None:
+                self.edges[record.tcb.address] = blocked_on
+
+    def get_holder(self, task):
+        """Return the address of the task which holds the mutex the task waits for, or None"""
+        edge = self.edges.get(task)
+        obj = self._snapshot.containers.get_object(edge.address) if edge is not None else None
+        if obj is None or obj.layout.name != 'Queue_t' or obj['pcHead'] != 0:
+            return None
+        return obj['u.xSemaphore.xMutexHolder'] or None
+
+    def find_cycles(self):
+        """Return lists of task addresses which wait for each other in a cycle"""
+        cycles = []
+        visited = {}
+        for _, start in enumerate(self.edges):
+            path = []
+            task = start
+            while task is not None and task not in visited:
+                visited[task] = start
+                path.append(task)
+                task = self.get_holder(task)
+            if task is not None and visited[task] == start:
+                cycles.append(path[path.index(task):])
+        return cycles
+
+    def find_inversions(self):
+        """Return {waiting task: [holder tasks of lower priority down the chain of mutexes]}.
+
+        Holders are compared by their base priority, priority inheritance raises uxPriority of a holder to the
+        priority of the waiting task.
+        """
+        inversions = {}
+        for _, task in enumerate(self.edges):
+            priority = self.tasks[task]['uxPriority']
+            seen = {task}
+            holder = self.get_holder(task)
+            while holder is not None and holder not in seen:
+                seen.add(holder)
+                tcb = self.get_tcb(holder)
+                if tcb is not None and get_base_priority(tcb) < priority:
+                    inversions.setdefault(task, []).append(holder)
+                holder = self.get_holder(holder)
+        return inversions
+
+    def get_tcb(self, task):
+        tcb = self.tasks.get(task)
+        if tcb is None:
+            try:
+                tcb = self._snapshot.get_task(task)
+            except TargetError:
+                return None
+            self.tasks[task] = tcb
+        return tcb
+
+    def task_ref(self, task):
+        tcb = self.get_tcb(task)
+        return get_task_ref(tcb) if tcb is not None else task
+
+    def describe_chain(self, tasks):
+        """Return 'task (pri N) -> kind object -> task ...' for a chain of tasks. An inherited priority is shown as
+        'pri N, base M'"""
+        parts = []
+        for i, task in enumerate(tasks):
+            tcb = self.get_tcb(task)
+            if tcb is None:
+                priority = '?'
+            elif get_base_priority(tcb) != tcb['uxPriority']:
+                priority = f'{tcb["uxPriority"]}, base {get_base_priority(tcb)}'
+            else:
+                priority = tcb['uxPriority']
+            parts.append(f'{self.task_ref(task)} (pri {priority})')
+            edge = self.edges.get(task)
+            if edge is not None and i < len(tasks) - 1:
+                parts.append(str(edge))
+        return ' -> '.join(parts)
+
+    def get_table_rows(self, cycles, inversions):
+        cycle_numbers = {task: number for number, cycle in enumerate(cycles, 1) for task in cycle}
+        rows = []
+        for _, (task, edge) in enumerate(self.edges.items()):
+            holder = self.get_holder(task)
+            rows.append([self.task_ref(task), self.tasks[task]['uxPriority'], edge.kind, edge.name or edge.address,
+                         self.task_ref(holder) if holder is not None else '', cycle_numbers.get(task, ''),
+                         [self.task_ref(lower) for lower in inversions.get(task, ())]])
+        return rows
+
+
+def get_table_headers():
+    return ['TASK', 'PRI'] + [title for title, _ in WAITGRAPH_HELP]
+
+
+def print_help(stream=None):
+    for _, (title, help_) in enumerate(WAITGRAPH_HELP):
+        print(title + '\t - ' + help_, file=stream)
+    print('', file=stream)
+
+
+def show(fmt='table', output=None, fixed_width=None):
+    graph = WaitGraph(get_snapshot())
+    cycles = graph.find_cycles()
+    inversions = graph.find_inversions()
+    rows = graph.get_table_rows(cycles, inversions)
+    with open_output(output) as stream:
+        if fmt != 'table':
+            write_table(rows, get_table_headers(), fmt, stream, fixed_width)
+            return
+        if not rows:
+            print('No blocked tasks', file=stream)
+            return
+        print_help(stream)
+        write_table(rows, get_table_headers(), fmt, stream, fixed_width)
+        print('', file=stream)
+        for number, cycle in enumerate(cycles, 1):
+            print(f'Deadlock {number}: {graph.describe_chain(cycle + cycle[:1])}', file=stream)
+        for _, (task, holders) in enumerate(inversions.items()):
+            chain = [task]
+            while chain[-1] != holders[-1]:
+                chain.append(graph.get_holder(chain[-1]))
+            print(f'Priority inversion: {graph.describe_chain(chain)}', file=stream)
+        if not cycles and not inversions:
+            print('No deadlocks or priority inversions found', file=stream)
+
+
+class FreeRtosWaitGraph(CommandBase):
+    """ Generate a print out of blocked tasks, the objects they wait for, deadlocks and priority inversions.
+    """
+
+    def __init__(self):
+        super().__init__('freertos waitgraph', gdb.COMMAND_USER)
+        self._parser = get_arg_parser('freertos waitgraph', self.__doc__)
+
+    def invoke(self, arg, _):
+        args = parse_args(self._parser, arg)
+        if args is None:
+            return
+        try:
+            show(args.format, args.output, args.fixed_width)
+        except TargetError as err:
+            print(err)
@@ -0,0 +1,153 @@
+# SPDX-FileCopyrightText: 2022 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+#
+# pylint: disable=import-error
+from .common import FreeRtosList, gdb, open_output, write_table
+from .memory import MemoryReadError, StructReader, TargetError, get_struct_layout, read_memory
+from .symbols import get_kernel_symbols
+
+WATCH_HEADERS = ['ID', 'NAME', 'CHANGE', 'OLD', 'NEW']
+
+
+def read_list_headers(symbols):
+    """Return {List_t address: raw List_t bytes} of lists (or arrays of lists) stored in global variables.
+
+    Every variable is read with a single transfer.
+    """
+    list_size = get_struct_layout('List_t').size
+    headers = {}
+    for _, symbol in enumerate(symbols):
+        data = read_memory(symbol.address, symbol.type.size)
+        for _, address in enumerate(symbol.element_addresses()):
+            offset = address - symbol.address
+            headers[address] = data[offset:offset + list_size]
+    return headers
+
+
+class ListTracker:
+    """Remembers headers and members of lists between halts.
+
+    A list is walked again only if its header (number of items, index, first and last node) changed, or an
+    owner read back from it is not contained in the list any more. Owners of other lists are only re-read.
+
+    :param owner_type: Type name of list items owners, e.g. 'TCB_t'
+    :param item_field: Name of the ListItem_t field of the owner which links it into the tracked lists
+    """
+
+    def __init__(self, owner_type, item_field):
+        self.owner_type = owner_type
+        self.container_field = item_field + '.pvContainer'
+        self.headers = {}
+        self.members = {}
+
+    def update(self, headers, force=False):
+        """Return {list address: [owner StructSnapshot]} for the current halt
+
+        :param headers: {list address: raw List_t bytes}, see read_list_headers()
+        :param force: Walk all lists, e.g. if a task was created or deleted since the previous halt
+        """
+        reader = StructReader(self.owner_type)
+        dirty = {address for address, header in headers.items() if force or self.headers.get(address) != header}
+        owners = {}
+        for _, address in enumerate(headers):
+            if address in dirty:
+                continue
+            for _, owner_address in enumerate(self.members[address]):
+                try:
+                    owner = reader.read(owner_address)
+                except MemoryReadError:
+                    dirty.add(address)
+                    continue
+                owners[owner_address] = owner
+                container = owner[self.container_field]
+                if container != address:
+                    dirty.add(address)
+                    if container in headers:
+                        dirty.add(container)
+
+        lists = {}
+        for _, address in enumerate(headers):
+            if address in dirty:
+                members = [ptr for ptr in FreeRtosList(address, self.owner_type, check_length=True) if ptr != 0]
+            else:
+                members = self.members[address]
+            for _, owner_address in enumerate(members):
+                if owner_address not in owners:
+                    owners[owner_address] = reader.read(owner_address)
+            lists[address] = [owners[owner_address] for owner_address in members]
+        self.headers = dict(headers)
+        self.members = {address: [owner.address for owner in owners_] for address, owners_ in lists.items()}
+        return lists
+
+
+class Watcher:
+    """Base of objects which report changes of kernel objects on every halt.
+
+    Subclasses implement poll() returning change rows with the columns of headers. The first poll() after
+    creation only records the current state.
+    """
+
+    title = ''
+    headers = WATCH_HEADERS
+
+    def poll(self):
+        raise NotImplementedError
+
+    def caption(self):
+        """Line printed above the rows in table format"""
+        return f'{self.title} changes:'
+
+
+_watchers = {}
+
+
+def show_changes(watcher, fmt='table', output=None):
+    try:
+        rows = watcher.poll()
+    except TargetError as err:
+        print(f'{watcher.title}: {err}')
+        return
+    if not rows:
+        return
+    with open_output(output, append=True) as stream:
+        if fmt == 'table':
+            print(watcher.caption(), file=stream)
+        write_table(rows, watcher.headers, fmt, stream)
+
+
+def on_stop(_=None):
+    for _, (watcher, fmt, output) in enumerate(list(_watchers.values())):
+        show_changes(watcher, fmt, output)
+
+
+def start(name, watcher, fmt='table', output=None):
+    """Report changes found by watcher on every following halt. Replaces a watcher of the same name"""
+    try:
+        watcher.poll()
+    except TargetError as err:
+        print(f'{watcher.title}: {err}')
+        return
+    if not _watchers and gdb is not None:
+        gdb.events.stop.connect(on_stop)
+    _watchers[name] = (watcher, fmt, output)
+
+
+def stop(name):
+    if _watchers.pop(name, None) is None:
+        print(f'{name} is not watched')
+        return
+    if not _watchers and gdb is not None:
+        gdb.events.stop.disconnect(on_stop)
+
+
+def lookup_symbols(names):
+    """Return Symbols of kernel variables which exist in the program"""
+    index = get_kernel_symbols()
+    return [index.get(name) for name in names if name in index]
+
+
+def add_watch_arguments(parser):
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--watch', action='store_true',
+                       help='Print the table, then print only changes on every following halt.')
+    group.add_argument('--unwatch', action='store_true', help='Stop printing changes on halts.')
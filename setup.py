@@ -42,4 +42,7 @@ setup(
     ],
     packages=['freertos_gdb'],
     python_requires='>=3.6',
+    extras_require={
+        'offline': ['pyelftools'],
+    },
 )
@@ -0,0 +1,16 @@
+# SPDX-FileCopyrightText: 2022 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+import pytest
+from freertos_gdb import memory, snapshot
+from freertos_gdb.benchmark import SimulatedBackend, build_target
+
+
+@pytest.fixture
+def target():
+    """Small synthetic kernel state served as the current backend"""
+    synthetic = build_target(tasks=8, queues=3, waiters=1, timers=3)
+    memory.set_backend(SimulatedBackend(synthetic))
+    snapshot.invalidate()
+    yield synthetic
+    memory.set_backend(None)
+    snapshot.invalidate()
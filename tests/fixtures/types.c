@@ -0,0 +1,32 @@
+/* Types and variables read by tests/test_offline.py, which builds it with: gcc -g -O0 -no-pie types.c */
+#include <stdint.h>
+
+typedef struct {
+    unsigned u : 3;
+    signed s : 5;
+    int8_t small;
+    union {
+        uint32_t word;
+        uint8_t bytes[4];
+    };
+    struct {
+        uint16_t low;
+        int16_t high;
+    };
+    char name[8];
+    void *next;
+} Fields_t;
+
+typedef long BaseType_t;
+
+Fields_t xFields = {
+    .u = 5, .s = -3, .small = -100, .word = 0x11223344, .low = 0xbeef, .high = -2, .name = "fixture",
+    .next = &xFields,
+};
+unsigned long ulCounter = 0xfffffff0;
+BaseType_t xBase = -7;
+
+int main(void)
+{
+    return 0;
+}
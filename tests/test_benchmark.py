@@ -0,0 +1,24 @@
+# SPDX-FileCopyrightText: 2022 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+from freertos_gdb.benchmark import BENCHMARK_HEADERS, SimulatedBackend, build_target, run_benchmark
+from freertos_gdb.offline import COMMANDS
+
+
+def test_all_commands_run_on_the_synthetic_target(capsys):
+    backend = SimulatedBackend(build_target(tasks=20, queues=4, waiters=2, timers=5))
+    rows = run_benchmark(backend, warm=True)
+    assert [row[0] for row in rows] == list(COMMANDS)
+    reads = {row[0]: row[BENCHMARK_HEADERS.index('READS')] for row in rows}
+    assert reads['task'] > 0 and reads['queue'] > 0 and reads['timer'] > 0
+    # messages about kernel objects the synthetic target does not have do not mix with the benchmark output
+    assert capsys.readouterr() == ('', '')
+
+
+def test_warm_runs_reuse_symbol_and_type_caches():
+    backend = SimulatedBackend(build_target(tasks=20, queues=4, waiters=2, timers=5))
+    lookups = BENCHMARK_HEADERS.index('LOOKUPS')
+    cold = run_benchmark(backend, ['queue'])[0]
+    warm = run_benchmark(backend, ['queue'], warm=True)[0]
+    assert cold[lookups] > 0
+    assert warm[lookups] == 0
+    assert warm[1:lookups] == cold[1:lookups]
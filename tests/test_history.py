@@ -0,0 +1,82 @@
+# SPDX-FileCopyrightText: 2022 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+import os
+import pytest
+from freertos_gdb import history, snapshot
+from freertos_gdb.snapshot import get_snapshot
+
+
+def record(path, stops):
+    recorder = history.Recorder(path)
+    for _ in range(stops):
+        snapshot.invalidate()
+        recorder.poll()
+
+
+def test_round_trip(target, tmp_path):
+    path = str(tmp_path / 'session.frh')
+    record(path, 1)
+    current = get_snapshot()
+    worker = current.tasks[0].tcb
+    queue = current.queues[1].queue
+    target.write('TCB_t', worker.address, 'uxPriority', 20)
+    target.write('Queue_t', queue.address, 'uxMessagesWaiting', 5)
+    record(path, 1)
+
+    history_file = history.HistoryFile(path)
+    assert len(history_file.stops) == 2
+    first = history_file.get_stop(0)
+    assert first.header.tick_count == 1000
+    assert [task.address for task in first.tasks] == [task.tcb.address for task in current.tasks]
+    task = next(task for task in first.tasks if task.address == worker.address)
+    assert (task.name, task.state, task.priority) == (worker.string('pcTaskName'), current.tasks[0].state,
+                                                      worker['uxPriority'])
+    assert [(queue_.name, queue_.type) for queue_ in first.queues] == [('queue0', 'queue'), ('queue1', 'queue'),
+                                                                      ('queue2', 'queue')]
+    assert [timer.name for timer in first.timers] == ['timer0', 'timer2', 'timer1']
+    # names are stored once
+    assert history_file.strings.strings.count('queue0') == 1
+
+    rows = history.get_diff_rows(first, history_file.get_stop(-1))
+    assert [row[1:] for row in rows] == [[task.name, 'priority', task.priority, 20],
+                                         ['queue1', 'waiting', 1, 5]]
+
+
+@pytest.mark.usefixtures('target')
+def test_resume_after_cut_frame(tmp_path):
+    path = str(tmp_path / 'session.frh')
+    record(path, 3)
+    os.truncate(path, os.path.getsize(path) - 10)
+    assert len(history.HistoryFile(path).stops) == 2
+
+    record(path, 3)
+    history_file = history.HistoryFile(path)
+    assert len(history_file.stops) == 5
+    assert history_file.end == len(history_file.data)
+    for index in range(5):
+        assert len(history_file.get_stop(index).tasks) == 8
+
+
+@pytest.mark.usefixtures('target')
+def test_diff_defaults_to_the_next_stop(tmp_path, capsys):
+    path = str(tmp_path / 'session.frh')
+    record(path, 2)
+    history.show_diff(path, -2)
+    assert 'Stop -2 (tick 1000) -> stop 1 (tick 1000)' in capsys.readouterr().out
+    history.main([path, '-1'])
+    assert 'No stop 2' in capsys.readouterr().out
+
+
+def test_priorities_above_16_bits(target, tmp_path, monkeypatch, capsys):
+    path = str(tmp_path / 'session.frh')
+    tcb = get_snapshot().tasks[0].tcb
+    target.write('TCB_t', tcb.address, 'uxPriority', 70000)
+    record(path, 1)
+    task = next(task for task in history.HistoryFile(path).get_stop(0).tasks if task.address == tcb.address)
+    assert task.priority == 70000
+
+    # a value which does not fit its field drops the object, not the stop
+    monkeypatch.setattr(history, 'TASK', history.struct.Struct('<QIIHHbIIQ'))
+    record(path, 1)
+    assert f'task at {tcb.address:#x} is not recorded' in capsys.readouterr().out
+    assert len(history.HistoryFile(path).get_stop(1).tasks) == 7
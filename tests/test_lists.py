@@ -0,0 +1,71 @@
+# SPDX-FileCopyrightText: 2022 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+#
+# pylint: disable=redefined-outer-name  # pytest fixtures
+import pytest
+from freertos_gdb import check
+from freertos_gdb.common import FreeRtosList, ListWalk
+
+
+@pytest.fixture
+def items(target):
+    """List_t with four ListItem_t: (list address, [item addresses])"""
+    list_address = target.add_symbol('xTestList', 'List_t')
+    target.list_init(list_address)
+    addresses = []
+    for i in range(4):
+        item = target.alloc_struct('ListItem_t')
+        target.list_insert_end(list_address, item, owner=0x1000 + i, value=i)
+        addresses.append(item)
+    return list_address, addresses
+
+
+def test_walk_reads_all_items(items):
+    list_address, addresses = items
+    walk = ListWalk(list_address).walk()
+    assert walk.complete and walk.error is None
+    assert walk.addresses == addresses
+    assert [walk.field(i, 'pvOwner') for i in range(4)] == [0x1000, 0x1001, 0x1002, 0x1003]
+    owners = FreeRtosList(list_address, 'TCB_t')
+    assert owners[2] == 0x1002
+    assert list(owners) == [0x1000, 0x1001, 0x1002, 0x1003]
+
+
+def test_walk_stops_at_cycle(target, items):
+    list_address, addresses = items
+    target.write('ListItem_t', addresses[2], 'pxNext', addresses[1])
+    walk = ListWalk(list_address).walk()
+    assert walk.addresses == addresses[:3]
+    assert 'points back to item' in walk.error
+    assert list(FreeRtosList(list_address, 'TCB_t')) == [0x1000, 0x1001, 0x1002]
+
+
+def test_walk_stops_at_null_and_length_bound(target, items):
+    list_address, addresses = items
+    walk = ListWalk(list_address, max_length=2).walk()
+    assert len(walk.addresses) == 2
+    assert 'more than 2 items' in walk.error
+    target.write('ListItem_t', addresses[1], 'pxNext', 0)
+    walk = ListWalk(list_address).walk()
+    assert walk.addresses == addresses[:2]
+    assert 'is NULL' in walk.error
+
+
+def test_check_reports_broken_links(target):
+    kernel_list = next(kernel_list for kernel_list in check.get_kernel_lists()
+                       if kernel_list.name == 'xDelayedTaskList1')
+    assert not check.check_list(kernel_list)
+    addresses = ListWalk(kernel_list.address).walk().addresses
+    target.write('ListItem_t', addresses[2], 'pxPrevious', addresses[0])
+    target.write('List_t', kernel_list.address, 'uxNumberOfItems', len(addresses) + 1)
+    problems = check.check_lists([kernel_list])
+    assert [problem.item for problem in problems] == [addresses[2], '']
+    assert problems[0].problem == f'pxPrevious is {addresses[0]:#x}, expected item {addresses[1]:#x}'
+    assert problems[1].problem == f'uxNumberOfItems is {len(addresses) + 1}, {len(addresses)} items are linked'
+
+
+@pytest.mark.usefixtures('target')
+def test_kernel_lists_of_a_consistent_target_pass():
+    kernel_lists = check.get_kernel_lists()
+    assert len(kernel_lists) > 25
+    assert not check.check_lists(kernel_lists)
@@ -0,0 +1,59 @@
+# SPDX-FileCopyrightText: 2022 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+#
+# pylint: disable=protected-access
+from types import SimpleNamespace
+from freertos_gdb import memory
+from freertos_gdb.memory import FieldLayout, GdbBackend, TypeCode
+
+# type codes of the gdb module, only their identity matters
+GDB_CODES = SimpleNamespace(**{name: i for i, name in enumerate(memory._GDB_TYPE_CODES)})
+
+
+class GdbType:
+    """gdb.Type of a struct, union or integer, as far as GdbBackend uses it"""
+
+    def __init__(self, name, code, sizeof, fields=(), is_signed=False):
+        self.name = name
+        self.code = getattr(GDB_CODES, code)
+        self.sizeof = sizeof
+        self._fields = fields
+        self.is_signed = is_signed
+
+    def __str__(self):
+        return self.name
+
+    def strip_typedefs(self):
+        return self
+
+    def fields(self):
+        return self._fields
+
+
+def gdb_field(name, type_, bitpos, bitsize=0):
+    return SimpleNamespace(name=name, type=type_, bitpos=bitpos, bitsize=bitsize)
+
+
+def test_signed_bitfield_is_sign_extended():
+    signed = FieldLayout('s', 0, 4, TypeCode.INT, signed=True, bitpos=3, bitsize=5)
+    unsigned = FieldLayout('u', 0, 4, TypeCode.INT, bitpos=3, bitsize=5)
+    data = (0b11101 << 3 | 0b101).to_bytes(4, 'little')
+    assert signed.decode(data, 0, 'little') == -3
+    assert unsigned.decode(data, 0, 'little') == 29
+    assert signed.decode((0b01101 << 3).to_bytes(4, 'little'), 0, 'little') == 13
+
+
+def test_gdb_backend_flattens_anonymous_members():
+    uint16 = GdbType('uint16_t', 'TYPE_CODE_INT', 2)
+    uint32 = GdbType('uint32_t', 'TYPE_CODE_INT', 4)
+    anonymous = GdbType('union {...}', 'TYPE_CODE_UNION', 4, [gdb_field('word', uint32, 0),
+                                                              gdb_field('half', uint16, 0)])
+    outer = GdbType('Outer_t', 'TYPE_CODE_STRUCT', 8, [gdb_field('first', uint32, 0),
+                                                       gdb_field(None, anonymous, 32)])
+    backend = GdbBackend.__new__(GdbBackend)
+    backend._type_codes = {getattr(GDB_CODES, name): code
+                           for name, code in memory._GDB_TYPE_CODES.items()}
+    layout = backend._struct_layout(outer)
+    assert list(layout.fields) == ['first', 'word', 'half']
+    assert layout.fields['word'].offset == 4
+    assert layout.fields['half'].offset == 4
@@ -0,0 +1,74 @@
+# SPDX-FileCopyrightText: 2022 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+#
+# pylint: disable=redefined-outer-name  # pytest fixtures
+import os
+import shutil
+import subprocess
+import pytest
+from freertos_gdb import memory, offline
+from freertos_gdb.memory import StructReader, TypeCode, TypeNotFound
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'types.c')
+
+
+@pytest.fixture(scope='module')
+def elf(tmp_path_factory):
+    """Program built from fixtures/types.c, variables are read from its .data section"""
+    if offline.ELFFile is None:
+        pytest.skip('pyelftools is not installed')
+    if shutil.which('gcc') is None:
+        pytest.skip('gcc is not installed')
+    path = str(tmp_path_factory.mktemp('elf') / 'types.elf')
+    subprocess.run(['gcc', '-g', '-O0', '-no-pie', FIXTURE, '-o', path], check=True)
+    return path
+
+
+@pytest.fixture
+def backend(elf):
+    with offline.ElfBackend(elf) as elf_backend:
+        memory.set_backend(elf_backend)
+        yield elf_backend
+    memory.set_backend(None)
+
+
+@pytest.mark.usefixtures('backend')
+def test_struct_layout():
+    layout = memory.get_struct_layout('Fields_t')
+    assert list(layout.fields) == ['u', 's', 'small', 'word', 'bytes', 'low', 'high', 'name', 'next']
+    assert layout.fields['word'].offset == layout.fields['bytes'].offset
+    assert layout.fields['high'].offset == layout.fields['low'].offset + 2
+    assert layout.fields['next'].code is TypeCode.PTR
+    assert layout.fields['bytes'].count == 4
+
+
+@pytest.mark.usefixtures('backend')
+def test_fields_are_decoded():
+    address = memory.lookup_symbol('xFields').address
+    fields = StructReader('Fields_t').read(address)
+    assert (fields['u'], fields['s'], fields['small']) == (5, -3, -100)
+    assert fields['word'] == 0x11223344
+    assert fields['bytes'] == [0x44, 0x33, 0x22, 0x11]
+    assert (fields['low'], fields['high']) == (0xbeef, -2)
+    assert fields.string('name') == 'fixture'
+    assert fields['next'] == address
+
+
+@pytest.mark.usefixtures('backend')
+def test_type_layouts():
+    unsigned_long = memory.get_type_layout('unsigned long')
+    assert (unsigned_long.code, unsigned_long.signed) == (TypeCode.INT, False)
+    assert memory.read_variable('ulCounter') == 0xfffffff0
+    assert memory.get_type_layout('BaseType_t').signed
+    assert memory.get_type_layout('Fields_t').layout is memory.get_struct_layout('Fields_t')
+    with pytest.raises(TypeNotFound):
+        memory.get_type_layout('Missing_t')
+    with pytest.raises(TypeNotFound):
+        memory.get_struct_layout('BaseType_t')
+
+
+def test_base_type_key():
+    assert offline.get_base_type_key('unsigned long') == offline.get_base_type_key('long unsigned int')
+    assert offline.get_base_type_key('short') == offline.get_base_type_key('short int')
+    assert offline.get_base_type_key('char') != offline.get_base_type_key('signed char')
+    assert offline.get_base_type_key('uint32_t') is None
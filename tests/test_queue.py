@@ -0,0 +1,49 @@
+# SPDX-FileCopyrightText: 2022 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+import pytest
+from freertos_gdb import snapshot
+from freertos_gdb.memory import TargetError
+from freertos_gdb.queue import find_queue, get_item_decoder, read_queue_items
+from freertos_gdb.snapshot import get_snapshot
+
+
+@pytest.mark.usefixtures('target')
+def test_scalar_items_are_decoded_by_type_layout():
+    headers, decode = get_item_decoder('BaseType_t', 4)
+    assert headers == ['VALUE']
+    assert decode((-2).to_bytes(4, 'little', signed=True)) == [-2]
+    assert get_item_decoder('UBaseType_t', 4)[1](b'\xfe\xff\xff\xff') == [0xfffffffe]
+    # char is unsigned on the target
+    assert get_item_decoder('char', 1)[1](b'\xff') == [255]
+
+
+@pytest.mark.usefixtures('target')
+def test_struct_items_have_a_column_per_field():
+    headers, decode = get_item_decoder('QueueRegistryItem_t', 8)
+    assert headers == ['pcQueueName', 'xHandle']
+    assert decode(b'\x10\x00\x00\x00\x20\x00\x00\x00') == [0x10, 0x20]
+
+
+@pytest.mark.usefixtures('target')
+def test_item_type_errors():
+    with pytest.raises(TargetError, match='queue items are 4 bytes'):
+        get_item_decoder('char', 4)
+    with pytest.raises(TargetError):
+        get_item_decoder('float', 4)
+
+
+@pytest.mark.usefixtures('target')
+def test_items_are_read_oldest_first():
+    queue = find_queue(get_snapshot(), 'queue2')
+    items = read_queue_items(queue)
+    assert len(items) == 2
+    assert all(len(item) == 4 for item in items)
+    assert get_item_decoder(None, 4)[1](items[0]) == ['00000000']
+
+
+def test_read_pointer_out_of_storage_is_reported(target):
+    queue = find_queue(get_snapshot(), 'queue2')
+    target.write('Queue_t', queue.address, 'u.xQueue.pcReadFrom', queue['pcHead'] - 4)
+    snapshot.invalidate()
+    with pytest.raises(TargetError, match='pcReadFrom'):
+        read_queue_items(find_queue(get_snapshot(), 'queue2'))
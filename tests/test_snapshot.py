@@ -0,0 +1,40 @@
+# SPDX-FileCopyrightText: 2022 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+from types import SimpleNamespace
+import pytest
+from freertos_gdb import memory, snapshot
+
+
+def run_prefetch(monkeypatch):
+    """Run a prefetch of the current snapshot to its end, return the number of steps"""
+    events = []
+    monkeypatch.setattr(snapshot, 'gdb', SimpleNamespace(post_event=events.append))
+    events.append(snapshot.Prefetch(snapshot.get_snapshot()).step)
+    steps = 0
+    while events:
+        events.pop(0)()
+        steps += 1
+    return steps
+
+
+@pytest.mark.usefixtures('target')
+def test_prefetch_reads_the_whole_snapshot(monkeypatch):
+    run_prefetch(monkeypatch)
+    backend = memory.get_backend()
+    backend.reset_counters()
+    # the prefetched sections are complete, commands do not read them again
+    assert len(snapshot.get_snapshot().tasks) == 8
+    assert len(snapshot.get_snapshot().timers) == 3
+    assert backend.reads == 0
+
+
+@pytest.mark.usefixtures('target')
+def test_prefetch_stops_on_unexpected_errors(monkeypatch, capsys):
+    def broken(_):
+        raise RuntimeError('broken')
+        yield  # pylint: disable=unreachable
+
+    monkeypatch.setattr(snapshot.SystemSnapshot, '_read_queues', broken)
+    run_prefetch(monkeypatch)
+    assert 'Prefetch stopped: RuntimeError: broken' in capsys.readouterr().out
+    assert len(snapshot.get_snapshot().tasks) == 8
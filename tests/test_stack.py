@@ -0,0 +1,41 @@
+# SPDX-FileCopyrightText: 2022 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+# pylint: disable=redefined-outer-name  # pytest fixtures
+import pytest
+from freertos_gdb import memory, snapshot, stack
+from freertos_gdb.benchmark import STACK_FILL_BYTE
+from freertos_gdb.memory import StructReader
+
+
+@pytest.fixture
+def tcb_address(target):  # pylint: disable=unused-argument  # sets the backend
+    stack.clear_cache()
+    yield snapshot.get_snapshot().tasks[0].tcb.address
+    stack.clear_cache()
+
+
+def read_tcb(address):
+    return StructReader('TCB_t').read(address)
+
+
+def recreate_task(target, address):
+    """Fill the stack of a task again, as for a task created with the same TCB and stack, 16 bytes used"""
+    tcb = read_tcb(address)
+    target.write_bytes(tcb['pxStack'], bytes([STACK_FILL_BYTE]) * (tcb['pxTopOfStack'] - tcb['pxStack'] - 16))
+
+
+def test_high_water_reads_only_the_filled_part_again(tcb_address):
+    tcb = read_tcb(tcb_address)
+    high_water = stack.get_high_water(tcb)
+    backend = memory.get_backend()
+    backend.reset_counters()
+    assert stack.get_high_water(tcb) == high_water
+    assert backend.read_bytes == high_water
+
+
+def test_high_water_of_recreated_task_without_tcb_number(target, tcb_address):
+    del target.layouts['TCB_t'].fields['uxTCBNumber']
+    high_water = stack.get_high_water(read_tcb(tcb_address))
+    recreate_task(target, tcb_address)
+    tcb = read_tcb(tcb_address)
+    assert stack.get_high_water(tcb) == tcb['pxTopOfStack'] - tcb['pxStack'] - 16 > high_water
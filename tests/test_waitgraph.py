@@ -0,0 +1,24 @@
+# SPDX-FileCopyrightText: 2022 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+from freertos_gdb import memory, snapshot
+from freertos_gdb.benchmark import SimulatedBackend, build_target
+from freertos_gdb.waitgraph import WaitGraph
+
+
+def test_inversion_is_found_while_the_holder_inherits_the_priority():
+    # queue3 is a mutex held by task7, task3 waits for it
+    target = build_target(tasks=8, queues=4, waiters=1, timers=0)
+    memory.set_backend(SimulatedBackend(target))
+    snapshot.invalidate()
+    try:
+        tasks = {record.tcb['uxTaskNumber']: record.tcb.address for record in snapshot.get_snapshot().tasks}
+        target.write('TCB_t', tasks[4], 'uxPriority', 10)
+        target.write('TCB_t', tasks[8], 'uxPriority', 10)
+        snapshot.invalidate()
+        graph = WaitGraph(snapshot.get_snapshot())
+        inversions = graph.find_inversions()
+        assert inversions == {tasks[4]: [tasks[8]]}
+        assert graph.describe_chain([tasks[4], tasks[8]]).endswith('task7 (pri 10, base 7)')
+    finally:
+        memory.set_backend(None)
+        snapshot.invalidate()